@@ -0,0 +1,91 @@
+"""Synthetic models and documents of configurable size, nesting depth and rule count."""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.resolvers import ResolveWith
+from nosql_rest_preprocessor.utils import one_of, either_of, all_of
+
+
+class FakeStore(object):
+    """In-memory stand-in for a database, counts its lookups."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.lookups = 0
+
+    def find(self, key):
+        self.lookups += 1
+        return self.docs.get(key)
+
+    def find_many(self, keys):
+        self.lookups += 1
+        return dict((key, self.docs[key]) for key in keys if key in self.docs)
+
+
+def make_model(size=20, depth=2, rules=4, store=None, name='Synthetic'):
+    """Returns a model with ``size`` attributes per level, ``rules`` rule tuples and ``depth`` levels of sub models.
+
+    Every level has a private attribute and, if a ``store`` is given, a resolved attribute ``ref``.
+    """
+    required = set('attr%d' % i for i in range(size // 2))
+    optional = set('attr%d' % i for i in range(size // 2, size)) | {'secret', 'ref', 'child'}
+
+    for i in range(rules):
+        group = ('rule%d_a' % i, 'rule%d_b' % i)
+        if i % 3 == 0:
+            required.add(one_of(*group))
+        elif i % 3 == 1:
+            optional.add(all_of(*group))
+        else:
+            optional.add(either_of(*group))
+
+    attributes = {
+        'required_attributes': required,
+        'optional_attributes': optional,
+        'private_attributes': {'secret'},
+        'immutable_attributes': {'attr0'},
+        'sub_models': {},
+        'resolved_attributes': {}
+    }
+
+    if depth > 1:
+        attributes['sub_models'] = {'child': make_model(size, depth - 1, rules, store, name + 'Child')}
+
+    if store is not None:
+        ref_model = make_model(size, 1, rules, None, name + 'Ref')
+        attributes['resolved_attributes'] = {
+            'ref': ResolveWith(store.find, model=ref_model, batch_lookup_func=store.find_many)
+        }
+
+    return type(str(name + 'Model'), (BaseModel,), attributes)
+
+
+def make_document(size=20, depth=2, rules=4, ref=None, payload=0, seed=0):
+    """Returns a document valid for :func:`make_model` with the same parameters.
+
+    ``payload`` adds a list of that many numbers to every level, to simulate large embedded arrays.
+    """
+    doc = dict(('attr%d' % i, 'value %d %d' % (seed, i)) for i in range(size))
+    doc['secret'] = 'password'
+
+    for i in range(rules):
+        if i % 3 == 2:
+            doc['rule%d_a' % i] = seed
+        else:
+            doc['rule%d_a' % i] = seed
+            doc['rule%d_b' % i] = seed
+
+    if payload:
+        doc['attr%d' % (size - 1)] = list(range(payload))
+
+    if ref is not None:
+        doc['ref'] = ref
+
+    if depth > 1:
+        doc['child'] = make_document(size, depth - 1, rules, None, payload, seed)
+
+    return doc
+
+
+def make_store(count=100, size=20, rules=4):
+    return FakeStore(dict(('ref%d' % i, make_document(size, 1, rules, seed=i)) for i in range(count)))
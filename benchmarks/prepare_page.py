@@ -0,0 +1,50 @@
+"""Per-document cost of removing private attributes from a page of a list endpoint.
+
+    python -m benchmarks.prepare_page [--sizes 100 10000]
+
+Compares a loop over Model.prepare_response, Model.prepare_responses (copies) and Model.prepare_responses with
+``in_place=True`` (on deep copies of the page made before timing, as their objects are changed).
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import argparse
+import copy
+import time
+
+from benchmarks.documents import make_document, make_model
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures prepare_response on pages of documents.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--depth', type=int, default=2, help='nesting levels of sub models')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    model = make_model(size=20, depth=args.depth)
+
+    print('%8s %16s %16s %16s' % ('objects', 'loop [us/doc]', 'page [us/doc]', 'in place [us/doc]'))
+    for size in args.sizes:
+        page = [make_document(20, args.depth, seed=seed) for seed in range(size)]
+        owned = [copy.deepcopy(page) for _ in range(args.repeat)]
+
+        loop = timed(lambda: [model.prepare_response(doc) for doc in page], args.repeat)
+        collection = timed(lambda: model.prepare_responses(page), args.repeat)
+        in_place = timed(lambda: model.prepare_responses(owned.pop(), in_place=True), args.repeat)
+
+        print('%8d %16.2f %16.2f %16.2f' % (size, loop / size * 1e6, collection / size * 1e6, in_place / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
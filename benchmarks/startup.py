@@ -0,0 +1,64 @@
+"""Startup time of a large schema with :class:`ModelRegistry`.
+
+    python -m benchmarks.startup --models 300
+
+Defines ``--models`` synthetic models (each with ``--depth`` levels of sub models) and reports how long checking and
+compiling them takes, with and without the serialized schemas of a previous run.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import argparse
+import sys
+import time
+
+from nosql_rest_preprocessor.registry import ModelRegistry
+
+from benchmarks.documents import make_model
+
+
+def define_models(count, depth, rules, backend):
+    models = []
+    for index in range(count):
+        model = make_model(size=20, depth=depth, rules=rules, name='Startup%d' % index)
+        while model is not None:  # register the sub models as well
+            model.validation_backend = backend
+            models.append(model)
+            model = model.sub_models.get('child')
+
+    return models
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the startup time of a large schema.')
+    parser.add_argument('--models', type=int, default=300, help='top level models')
+    parser.add_argument('--depth', type=int, default=2, help='nesting levels of sub models')
+    parser.add_argument('--rules', type=int, default=4, help='one_of/all_of/either_of rules per model')
+    args = parser.parse_args(argv)
+
+    schemas = ModelRegistry(define_models(args.models, args.depth, args.rules, 'generated')).dumps()
+
+    print('%-36s %10s' % ('startup', 'ms'))
+    for name, backend, mode, loaded_schemas in [
+        ('lazy (check only)', 'interpreted', 'lazy', None),
+        ('eager, interpreted', 'interpreted', 'eager', None),
+        ('eager, generated', 'generated', 'eager', None),
+        ('eager, generated, loaded schemas', 'generated', 'eager', schemas),
+    ]:
+        models = define_models(args.models, args.depth, args.rules, backend)  # fresh classes, nothing compiled
+        duration, registry = timed(lambda: ModelRegistry(models, compile=mode).setup(loaded_schemas))
+        print('%-36s %10.1f   %s' % (name, duration * 1000, ', '.join(
+            '%s %.1f' % (step, seconds * 1000) for step, seconds in sorted(registry.timings.items())
+        )))
+
+    print('%d models, %d kB of serialized schemas' % (len(models), len(schemas) // 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Benchmark suite for the hot paths of models, resolvers and utils.
+
+    python -m benchmarks.suite                      # run and compare against benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline      # run and store the results as the new baseline
+    python -m benchmarks.suite --size 200 --depth 4 --rules 20 --payload 10000
+
+Reports throughput, latency percentiles and peak memory per benchmark. With ``--check`` the exit code is 1 if any
+benchmark got slower than ``--tolerance`` compared to the baseline.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from nosql_rest_preprocessor.resolvers import resolve, resolve_many
+from nosql_rest_preprocessor.utils import non_mutating
+
+from benchmarks.documents import make_model, make_document, make_store
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+@benchmark
+def validate(config):
+    model, doc = config.model(), config.document()
+    return lambda: model.validate(doc)
+
+
+@benchmark
+def validate_generated(config):
+    model, doc = config.model(), config.document()
+    model.validation_backend = 'generated'
+    return lambda: model.validate(doc)
+
+
+@benchmark
+def validate_page(config):
+    model = config.model()
+    docs = [config.document(seed=i) for i in range(config.page)]
+    return lambda: [model.validate(doc) for doc in docs]
+
+
+@benchmark
+def validate_cached(config):
+    model = config.model()
+    docs = [config.document(seed=i) for i in range(config.page)]
+    models = [model]
+    while models:
+        cached = models.pop()
+        cached.verdict_cache_size = 64
+        models.extend(cached.sub_models.values())
+    return lambda: [model.validate(doc) for doc in docs]
+
+
+@benchmark
+def validate_batch(config):
+    model = config.model()
+    docs = [config.document(seed=i) for i in range(config.page)]
+    return lambda: model.validate_batch(docs)
+
+
+@benchmark
+def validate_json(config):
+    model, data = config.model(), json.dumps(config.document()).encode('utf-8')
+    return lambda: model.validate(json.loads(data.decode('utf-8')))
+
+
+@benchmark
+def validate_raw(config):
+    model, data = config.model(), json.dumps(config.document()).encode('utf-8')
+    return lambda: model.validate_raw(data)
+
+
+@benchmark
+def prepare_response(config):
+    model, doc = config.model(), config.document()
+    return lambda: model.prepare_response(doc)
+
+
+@benchmark
+def merge_updated(config):
+    model, doc = config.model(), config.document()
+    new_doc = dict(doc, attr1='changed')
+    return lambda: model.merge_updated(doc, new_doc)
+
+
+@benchmark
+def resolve_one(config):
+    model, doc = config.model(), config.document()
+    return lambda: resolve(model, doc, depth=config.depth)
+
+
+@benchmark
+def resolve_page(config):
+    model = config.model()
+    docs = [config.document(ref='ref%d' % (i % 10), seed=i) for i in range(config.page)]
+    return lambda: resolve_many(model, docs, depth=config.depth)
+
+
+@benchmark
+def non_mutating_copy(config):
+    doc = config.document()
+    identity = non_mutating(lambda obj: obj)
+    return lambda: identity(doc)
+
+
+class Config(object):
+
+    def __init__(self, args):
+        self.size = args.size
+        self.depth = args.depth
+        self.rules = args.rules
+        self.payload = args.payload
+        self.page = args.page
+        self.store = make_store(size=self.size, rules=self.rules)
+
+    def model(self):
+        return make_model(self.size, self.depth, self.rules, self.store)
+
+    def document(self, ref='ref0', seed=0):
+        return make_document(self.size, self.depth, self.rules, ref, self.payload, seed)
+
+    def key(self):
+        return 'size=%d depth=%d rules=%d payload=%d page=%d' % (self.size, self.depth, self.rules, self.payload,
+                                                                 self.page)
+
+
+def measure(func, min_time):
+    func()  # warm up, compiles plans
+
+    latencies = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_time or len(latencies) < 10:
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'ops_per_sec': len(latencies) / sum(latencies),
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p95_us': percentile(latencies, 95) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'peak_kb': peak / 1024
+    }
+
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks nosql_rest_preprocessor.')
+    parser.add_argument('--size', type=int, default=20, help='attributes per nesting level')
+    parser.add_argument('--depth', type=int, default=2, help='nesting levels of sub models')
+    parser.add_argument('--rules', type=int, default=4, help='one_of/all_of/either_of rules per model')
+    parser.add_argument('--payload', type=int, default=0, help='length of an embedded list per level')
+    parser.add_argument('--page', type=int, default=100, help='documents per resolve_many, validate_batch and validate_page call')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to run each benchmark for')
+    parser.add_argument('--filter', default='', help='only run benchmarks containing this string')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='fail if slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown for --check')
+    args = parser.parse_args(argv)
+
+    config = Config(args)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(config.key(), {})
+
+    print(config.key())
+    print('%-20s %12s %10s %10s %10s %10s %9s' % ('benchmark', 'ops/s', 'p50 [us]', 'p95 [us]', 'p99 [us]',
+                                                  'peak [kB]', 'baseline'))
+
+    results, regressions = {}, []
+    for bench in BENCHMARKS:
+        if args.filter not in bench.__name__:
+            continue
+
+        result = results[bench.__name__] = measure(bench(config), args.min_time)
+
+        compared = ''
+        if bench.__name__ in baseline:
+            ratio = result['ops_per_sec'] / baseline[bench.__name__]['ops_per_sec']
+            compared = '%.2fx' % ratio
+            if ratio < 1 - args.tolerance:
+                regressions.append(bench.__name__)
+
+        print('%-20s %12.0f %10.1f %10.1f %10.1f %10.1f %9s' % (
+            bench.__name__, result['ops_per_sec'], result['p50_us'], result['p95_us'], result['p99_us'],
+            result['peak_kb'], compared
+        ))
+
+    if args.save_baseline:
+        baselines[config.key()] = dict(baseline, **results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if regressions:
+        print('slower than baseline: %s' % ', '.join(regressions))
+        if args.check:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
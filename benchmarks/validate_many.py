@@ -0,0 +1,64 @@
+"""Compares serial and process-pool validation to find where Model.validate_many starts to pay off.
+
+    python -m benchmarks.validate_many [--workers N]
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import argparse
+import multiprocessing
+import time
+
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import one_of, either_of, all_of
+
+
+class AddressModel(BaseModel):
+    required_attributes = {'street', 'city', 'plz'}
+    optional_attributes = {'location', either_of('floor', 'building')}
+
+
+class UserModel(BaseModel):
+    required_attributes = {'firstName', 'lastName', one_of('email', 'phone'), either_of('nick', 'alias')}
+    optional_attributes = {'address', 'age', all_of('phoneCarrier', 'phoneModel')} | {'field%d' % i for i in range(20)}
+
+    sub_models = {
+        'address': AddressModel
+    }
+
+
+def make_users(count):
+    user = dict(
+        ('field%d' % i, i) for i in range(20)
+    )
+    user.update({
+        'firstName': 'Sepp', 'lastName': 'Huber', 'email': 'sepp.huber@fancypants.com', 'nick': 'sepp',
+        'phoneCarrier': 'Carrier', 'phoneModel': 'Model',
+        'address': {'street': 'Bakerstreet', 'city': 'London', 'plz': '12345', 'floor': 2}
+    })
+    return [dict(user, age=i) for i in range(count)]
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000, 50000, 100000, 200000])
+    args = parser.parse_args()
+
+    print('%8s %12s %12s %8s' % ('objects', 'serial [s]', 'pool [s]', 'speedup'))
+    for size in args.sizes:
+        users = make_users(size)
+
+        serial = timed(UserModel.validate_many, users, workers=1)
+        pooled = timed(UserModel.validate_many, users, workers=args.workers, min_parallel_size=0)
+
+        print('%8d %12.3f %12.3f %7.2fx' % (size, serial, pooled, serial / pooled))
+
+
+if __name__ == '__main__':
+    main()
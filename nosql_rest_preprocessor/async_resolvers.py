@@ -0,0 +1,137 @@
+"""Asyncio counterpart of :mod:`nosql_rest_preprocessor.resolvers` (Python 3.5+).
+
+``ResolveWith`` lookup functions (and batch lookup functions) may be coroutine functions here; plain functions work
+as well. All lookups of one depth level run concurrently, bounded by ``concurrency``. Lookups waiting for an instance
+of an exhausted ``lookup_scope='pool'`` wait in an executor thread, not on the event loop.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import asyncio
+from functools import partial, wraps
+from inspect import isawaitable
+
+from nosql_rest_preprocessor import instrumentation
+from nosql_rest_preprocessor.resolvers import MAX_DEPTH, ResolveWith, _copies, _resolution
+
+
+def instrumented(operation):
+    """Coroutine counterpart of :func:`instrumentation.instrumented`."""
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(model, obj, *args, **kwargs):
+            if not instrumentation.enabled():
+                return await f(model, obj, *args, **kwargs)
+
+            error = None
+            start = instrumentation.timer()
+            try:
+                return await f(model, obj, *args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                instrumentation.emit(instrumentation.operation_event(operation, model, obj, start, error))
+
+        return wrapper
+
+    return decorator
+
+
+@instrumented('async_resolve')
+async def async_resolve(model, obj, depth=1, fail_fast=False, concurrency=10, fields=None, identity_map=None,
+                        budget=None, max_depth=MAX_DEPTH):
+    return (await _resolve_many(model, [obj], depth, fail_fast, concurrency, fields, identity_map, budget,
+                                max_depth))[0]
+
+
+@instrumented('async_resolve_many')
+async def async_resolve_many(model, objs, depth=1, fail_fast=False, concurrency=10, fields=None, identity_map=None,
+                             budget=None, max_depth=MAX_DEPTH):
+    return await _resolve_many(model, objs, depth, fail_fast, concurrency, fields, identity_map, budget, max_depth)
+
+
+async def _resolve_many(model, objs, depth, fail_fast, concurrency, fields, identity_map, budget, max_depth):
+    resolved_objs = _copies(objs, fields)
+
+    if min(depth, max_depth) > 0:
+        resolution = _resolution(model, resolved_objs, depth, fail_fast, fields, identity_map, budget, max_depth)
+        await _run_lookups(resolution, asyncio.Semaphore(concurrency))
+
+    return resolved_objs
+
+
+async def _run_lookups(resolution, semaphore):
+    try:
+        requests = next(resolution)
+        while True:
+            attr_configs = list(requests)
+            found = await asyncio.gather(*[
+                _lookup_many(attr_config, requests[attr_config], semaphore) for attr_config in attr_configs
+            ])
+            requests = resolution.send(dict(zip(attr_configs, found)))
+    except StopIteration:
+        pass
+
+
+async def _lookup_many(attr_config, keys, semaphore):
+    if not isinstance(attr_config, ResolveWith):  # in case a function was passed directly
+        return dict(await _gather(attr_config, keys, semaphore))
+
+    found, missing = attr_config._from_cache(keys)
+
+    if missing:
+        if attr_config.batch_lookup_func is None:
+            fetched = dict(await _gather(partial(_call, attr_config, attr_config.lookup_func), missing, semaphore))
+        else:
+            async with semaphore:
+                fetched = dict(await _call(attr_config, attr_config.batch_lookup_func, missing))
+
+        found.update(attr_config._to_cache(missing, fetched))
+
+    return found
+
+
+async def _call(attr_config, func, arg):
+    if not attr_config.lookup_class:
+        return await _result(func(arg))
+
+    # the lookup_class instance is only released after the lookup has been awaited
+    instances = attr_config.lookup_instances
+    lookup_obj = instances.acquire_nowait()
+    if lookup_obj is None:
+        lookup_obj = await _acquire(instances)
+
+    try:
+        return await _result(func(lookup_obj, arg))
+    finally:
+        instances.release(lookup_obj)
+
+
+async def _acquire(instances):
+    # an exhausted pool is waited for in another thread, the lookups which release instances run on this event loop
+    acquiring = asyncio.get_event_loop().run_in_executor(None, instances.acquire)
+    try:
+        return await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(partial(_release_acquired, instances))  # don't lose the instance once it's ours
+        raise
+
+
+def _release_acquired(instances, acquiring):
+    if not acquiring.cancelled() and acquiring.exception() is None:
+        instances.release(acquiring.result())
+
+
+async def _gather(lookup, keys, semaphore):
+    async def lookup_one(key):
+        async with semaphore:
+            return key, await _result(lookup(key))
+
+    return await asyncio.gather(*[lookup_one(key) for key in keys])
+
+
+async def _result(value):
+    if isawaitable(value):
+        return await value
+
+    return value
@@ -0,0 +1,113 @@
+"""Validation of many documents which share a few shapes, e.g. the rows of a bulk endpoint.
+
+The rules of a model only look at the keys of a document, so :func:`validate_batch` groups the documents by their keys
+and checks the keys of every group once, for all documents of the group. Embedded objects of ``sub_models`` are
+collected across all documents and validated the same way, one batch per attribute.
+
+Pays off for documents of a few shapes. If (almost) every document has a shape of its own, validating them one by one
+is a little faster.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.compiled import plan_for
+from nosql_rest_preprocessor.utils import without_failures
+
+
+def validate_batch(model, objs, errors=None):
+    """Validates a list of objects with the rules of ``model``, with the same outcome as ``model.validate`` for each.
+
+    Returns the valid objects, see :func:`utils.without_failures` for ``errors``.
+    """
+    objs = list(objs)
+    return without_failures(objs, sorted(_failures(plan_for(model), objs).items()), errors)
+
+
+def _failures(plan, objs):
+    # the error validate would raise for every invalid object, by index
+    failures = {}
+    groups = {}  # hash of the keys in order -> [(index of the first object, indexes of all objects), ...]
+
+    # documents of the same shape usually have their keys in the same order as well. Only the hash of the keys is kept
+    # per shape, keeping their sets (or tuples) around would cost more than checking them for documents of many shapes
+    last_keys, last_indexes = None, None
+    for index, obj in enumerate(objs):
+        if isinstance(obj, dict):
+            keys = tuple(obj)
+            if keys == last_keys:  # most of the time the same shape as the object before
+                last_indexes.append(index)
+                continue
+
+            shapes = groups.setdefault(hash(keys), [])
+            for first, indexes in shapes:
+                if tuple(objs[first]) == keys:
+                    indexes.append(index)
+                    break
+            else:
+                indexes = [index]
+                shapes.append((index, indexes))
+
+            last_keys, last_indexes = keys, indexes
+        else:
+            try:
+                plan.model.validate(obj)  # whatever validate makes of it
+            except Exception as e:
+                failures[index] = e
+
+    valid = []
+    for shapes in groups.values():
+        for first, indexes in shapes:
+            error = _verdict(plan, objs[first])
+            if error is None:
+                valid.extend(indexes)
+            else:
+                for index in indexes:
+                    failures[index] = _copy(error)
+
+    if not (valid and plan.has_sub_models):
+        return failures
+
+    # all embedded objects of an attribute in one batch, in the order validate would check them
+    valid.sort()
+    for attr, sub_plan in plan.sub_plans:
+        positions, values = [], []
+        for index in valid:
+            obj = objs[index]
+            if attr in obj and index not in failures:  # only the first failing sub model is reported
+                value = obj[attr]
+                if isinstance(value, list):
+                    for element_index, element in enumerate(value):
+                        positions.append((index, (attr, element_index)))
+                        values.append(element)
+                else:
+                    positions.append((index, (attr,)))
+                    values.append(value)
+
+        if values:
+            for position, e in sorted(_failures(sub_plan, values).items()):
+                index, path = positions[position]
+                if index not in failures:
+                    if isinstance(e, exceptions.ValidationError):
+                        e.prefix(*path)
+                    failures[index] = e
+
+    return failures
+
+
+def _verdict(plan, obj):
+    # the same checks on the same set of keys as validate
+    keys = frozenset(obj)
+    try:
+        plan.check_required(keys)
+        plan.check_allowed(keys)
+    except exceptions.ValidationError as e:
+        return e
+
+    return None
+
+
+def _copy(error):
+    # every object gets its own error, prefix() changes the paths of its violations
+    return exceptions.ValidationError(errors=[
+        exceptions.Violation(violation.rule, violation.keys, violation.path) for violation in error.errors
+    ])
@@ -0,0 +1,313 @@
+"""Bulk processing of newline-delimited JSON files, e.g. nightly validation and redaction of database exports.
+
+    nosql-bulk myapp.models.UserModel users.ndjson --operation prepare_response --output users.public.ndjson
+
+The input file is memory-mapped and split into chunks of about ``--chunk-size`` bytes which end at a line break, so
+every chunk holds whole documents. The chunks are processed by a pool of ``--workers`` processes and written in input
+order, with at most two chunks per worker in flight, so memory stays bounded for files of any size.
+
+Operations (documents which fail are left out of the output and listed in the ``--errors`` report instead):
+
+* ``validate``: copies the valid lines to the output unchanged.
+* ``prepare_response``: writes the documents without their private attributes.
+* ``resolve``: resolves the documents with the objects of a ``--lookups`` JSON file instead of the lookup functions
+  of the model, ``{"<resolved attribute>": {"<key>": <object>, ...}, ...}``, and writes them like prepare_response.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import argparse
+import importlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+
+from nosql_rest_preprocessor import exceptions, instrumentation
+from nosql_rest_preprocessor.compiled import plan_for
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.resolvers import MAX_DEPTH, _resolve_many
+
+OPERATIONS = ('validate', 'prepare_response', 'resolve')
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+_worker_processor = None
+
+
+class BulkProcessor(object):
+    """Processes the lines of an NDJSON file with ``model``, see the module documentation for the operations.
+
+    ``lookups`` is the object of a ``--lookups`` file, ``raw`` validates lines with ``validate_raw`` instead of
+    decoding them, which is faster for documents with large embedded values.
+    """
+
+    def __init__(self, model, operation='validate', lookups=None, depth=1, raw=False):
+        if operation not in OPERATIONS:
+            raise exceptions.ConfigurationError('Unknown operation %r, expected one of %s' % (operation, ', '.join(OPERATIONS)))
+        if raw and operation != 'validate':
+            raise exceptions.ConfigurationError('Only the validate operation can work on raw documents')
+
+        self.model = model
+        self.operation = operation
+        self.lookups = lookups or {}
+        self.depth = depth
+        self.raw = raw
+        self._names = None
+
+    def process_chunk(self, path, start, end):
+        """Processes the lines between the byte offsets ``start`` and ``end`` of the file at ``path``.
+
+        Returns the output, the number of lines and ``(line index within the chunk, byte offset, exception)`` for every
+        line which failed.
+        """
+        with io.open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                lines, count = _lines(mapped, start, end)
+                output, errors = getattr(self, '_' + self.operation)(mapped, lines)
+            finally:
+                mapped.close()
+
+        return b''.join(output), count, errors
+
+    def _validate(self, mapped, lines):
+        output, errors = [], []
+        for index, start, end in lines:
+            line = mapped[start:end]
+            try:
+                if self.raw:
+                    self.model.validate_raw(line)
+                else:
+                    self.model.validate(_decode(line))
+            except Exception as e:
+                errors.append((index, start, e))
+            else:
+                output.append(line + b'\n')
+
+        return output, errors
+
+    def _prepare_response(self, mapped, lines):
+        objs, errors = [], []
+        for index, start, end in lines:
+            try:
+                objs.append(_decode(mapped[start:end]))
+            except ValueError as e:
+                errors.append((index, start, e))
+
+        # the decoded documents belong to nobody else
+        return [_encode(obj) for obj in self.model.prepare_responses(objs, in_place=True)], errors
+
+    def _resolve(self, mapped, lines):
+        objs, decoded, errors = [], [], []
+        for index, start, end in lines:
+            try:
+                objs.append(_decode(mapped[start:end]))
+                decoded.append((index, start))
+            except ValueError as e:
+                errors.append((index, start, e))
+
+        try:
+            resolved_objs = self._resolve_many(objs)
+        except Exception:
+            # find the failing documents by resolving them one by one
+            resolved_objs = []
+            for obj, (index, start) in zip(objs, decoded):
+                try:
+                    resolved_objs.append(self._resolve_many([obj])[0])
+                except Exception as e:
+                    resolved_objs.append(None)
+                    errors.append((index, start, e))
+
+        resolved_objs = [resolved_obj for resolved_obj in resolved_objs if resolved_obj is not None]
+        output = [_encode(obj) for obj in self.model.prepare_responses(resolved_objs)]  # shares the looked up objects
+
+        errors.sort(key=lambda error: error[0])
+        return output, errors
+
+    def _resolve_many(self, objs):
+        # like resolve_many, answering the lookups from self.lookups
+        if self._names is None:
+            self._names = _attribute_names(self.model)
+
+        return _resolve_many(self.model, objs, self.depth, False, None, None, None, MAX_DEPTH, self._lookup_many)
+
+    def _lookup_many(self, attr_config, keys):
+        table = self.lookups.get(self._names.get(attr_config)) or {}
+        return dict((key, table.get(key if isinstance(key, type('')) else json.dumps(key))) for key in keys)
+
+
+def process(processor, path, output, errors=None, workers=None, chunk_size=CHUNK_SIZE):
+    """Processes the NDJSON file at ``path`` with a :class:`BulkProcessor`, writing to the binary file ``output``.
+
+    A JSON line ``{"line": ..., "offset": ..., "error": ..., "message": ...}`` is written to the text file ``errors``
+    for every line which failed. Returns the number of lines, the number of failed lines and the size of the input.
+    """
+    size = os.path.getsize(path)
+    workers = workers or multiprocessing.cpu_count()
+    chunks = list(_chunks(path, size, chunk_size))
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = (processor.process_chunk(path, start, end) for start, end in chunks)
+        return _write(results, output, errors) + (size,)
+
+    pool = multiprocessing.Pool(workers, _init_worker, (processor,))
+    try:
+        return _write(_ordered(pool, path, chunks, window=2 * workers), output, errors) + (size,)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def load_model(path):
+    """Imports a model class by its dotted path, ``package.module.Model`` or ``package.module:Model``."""
+    module_name, _, name = path.replace(':', '.').rpartition('.')
+    try:
+        model = getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise exceptions.ConfigurationError('Could not import model %s: %s' % (path, e))
+
+    if not (isinstance(model, type) and issubclass(model, BaseModel)):
+        raise exceptions.ConfigurationError('%s is not a BaseModel' % path)
+
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nosql-bulk', description='Processes a newline-delimited JSON file with a model.')
+    parser.add_argument('model', help='dotted path of the model class, e.g. myapp.models.UserModel')
+    parser.add_argument('input', help='NDJSON file, one document per line')
+    parser.add_argument('--operation', choices=OPERATIONS, default='validate')
+    parser.add_argument('--output', help='NDJSON file for the processed documents (default: <input>.out)')
+    parser.add_argument('--errors', help='NDJSON file listing the lines which failed (default: <input>.errors)')
+    parser.add_argument('--lookups', help='JSON file with the objects to resolve, by resolved attribute and key')
+    parser.add_argument('--depth', type=int, default=1, help='depth to resolve to')
+    parser.add_argument('--raw', action='store_true', help='validate without decoding the documents')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='bytes per chunk of the input')
+    args = parser.parse_args(argv)
+
+    lookups = None
+    if args.lookups:
+        with io.open(args.lookups, 'rb') as f:
+            lookups = _decode(f.read())
+
+    try:
+        processor = BulkProcessor(load_model(args.model), args.operation, lookups, args.depth, args.raw)
+    except exceptions.ConfigurationError as e:
+        parser.error('%s' % e)
+
+    start = instrumentation.timer()
+    with io.open(args.output or args.input + '.out', 'wb') as output:
+        with io.open(args.errors or args.input + '.errors', 'w', encoding='utf-8') as errors:
+            lines, failed, size = process(processor, args.input, output, errors, args.workers, args.chunk_size)
+    duration = max(instrumentation.timer() - start, 1e-9)
+
+    print('%d lines, %d failed, %.1f MB in %.2f s: %.0f lines/s, %.1f MB/s' % (
+        lines, failed, size / 1e6, duration, lines / duration, size / 1e6 / duration
+    ), file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+def _chunks(path, size, chunk_size):
+    # (start, end) byte offsets of about chunk_size bytes, extended to the end of the line they stop in
+    if not size:
+        return
+
+    with io.open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = mapped.find(b'\n', min(start + chunk_size, size) - 1)
+                end = size if end == -1 else end + 1
+                yield start, end
+                start = end
+        finally:
+            mapped.close()
+
+
+def _lines(mapped, start, end):
+    # (index, start, end) of every non-empty line without the line break, and the number of lines
+    lines, index = [], 0
+    while start < end:
+        line_end = mapped.find(b'\n', start, end)
+        if line_end == -1:
+            line_end = end
+
+        if line_end > start:
+            lines.append((index, start, line_end))
+        index += 1
+        start = line_end + 1
+
+    return lines, index
+
+
+def _ordered(pool, path, chunks, window):
+    # the results of the chunks in input order, with at most window chunks being processed or waiting to be written
+    pending = []
+    for start, end in chunks:
+        if len(pending) >= window:
+            yield pending.pop(0).get()
+        pending.append(pool.apply_async(_process_chunk, (path, start, end)))
+
+    for result in pending:
+        yield result.get()
+
+
+def _write(results, output, errors):
+    lines = failed = 0
+    for chunk_output, chunk_lines, chunk_errors in results:
+        output.write(chunk_output)
+
+        for index, offset, e in chunk_errors:
+            if errors is not None:
+                errors.write(_error_line(lines + index + 1, offset, e))
+        failed += len(chunk_errors)
+        lines += chunk_lines
+
+    return lines, failed
+
+
+def _error_line(line, offset, e):
+    message = getattr(e, 'message', None) or '%s' % e
+    return '%s\n' % json.dumps({'line': line, 'offset': offset, 'error': type(e).__name__, 'message': message})
+
+
+def _init_worker(processor):
+    global _worker_processor
+    _worker_processor = processor
+
+    plan_for(processor.model)  # compile the rules once per worker
+
+
+def _process_chunk(path, start, end):
+    return _worker_processor.process_chunk(path, start, end)
+
+
+def _attribute_names(model):
+    # the name of the resolved attribute of every attribute config reachable from model, to find its lookup table
+    names, pending, seen = {}, [model], set()
+    while pending:
+        plan = plan_for(pending.pop())
+        for attr, attr_config, resolving_model in plan.resolved:
+            names.setdefault(attr_config, attr)
+            if resolving_model is not None and resolving_model not in seen:
+                seen.add(resolving_model)
+                pending.append(resolving_model)
+
+    return names
+
+
+def _decode(data):
+    return json.loads(data.decode('utf-8'))
+
+
+def _encode(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+MISSING = object()  # returned by ResolveCache.get for keys that are not cached
+
+
+class ResolveCache(object):
+    """Bounded LRU cache for looked up objects, to be passed to one or more ``ResolveWith`` as ``cache``.
+
+    Entries expire after ``ttl`` seconds (never if ``None``). Lookups that found nothing are cached as well unless
+    ``cache_misses`` is false, and expire after ``negative_ttl`` seconds (defaults to ``ttl``). Objects are copied on
+    the way in and out, so neither the lookup function nor the callers of ``resolve`` can mutate a cached object.
+
+    A cache can be shared by many threads, every operation holds a lock (copying happens outside of it).
+    """
+
+    def __init__(self, max_size=1024, ttl=None, cache_misses=True, negative_ttl=None, clock=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_misses = cache_misses
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.clock = clock or getattr(time, 'monotonic', time.time)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._entries = OrderedDict()  # key -> (expires_at, obj), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires_at, obj = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._touch(key)
+            self.hits += 1
+
+        return deepcopy(obj)  # cached objects are never mutated, so they can be copied without the lock
+
+    def put(self, key, obj):
+        if obj:
+            ttl = self.ttl
+        elif self.cache_misses:
+            ttl = self.negative_ttl
+        else:
+            return
+
+        obj = deepcopy(obj)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (None if ttl is None else self.clock() + ttl, obj)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _touch(self, key):
+        self._entries[key] = self._entries.pop(key)  # OrderedDict.move_to_end is not available on Python 2
+
+
+class VerdictCache(object):
+    """Bounded cache of the outcome of a model's rules per set of keys, see ``BaseModel.verdict_cache_size``.
+
+    A verdict is ``None`` for keys which pass, or the ``(rule, keys)`` of the violation they fail with. Hits are read
+    without locking and only mark their entry as used, so they cost less than the checks they replace. Only ``put``
+    locks: once the cache is full it evicts the oldest entry which has not been used since it was last passed over
+    (second chance), which approximates least recently used. Like :class:`ResolveCache` it can be shared by many
+    threads, the hit and miss counts are approximate while they do.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # keys -> verdict, oldest first
+        self._used = set()  # keys which were hit since they were inserted or passed over by an eviction
+        self._lock = threading.Lock()
+
+    def get(self, keys):
+        verdict = self._entries.get(keys, MISSING)
+
+        if verdict is MISSING:
+            self.misses += 1
+        else:
+            self._used.add(keys)
+            self.hits += 1
+
+        return verdict
+
+    def put(self, keys, verdict):
+        with self._lock:
+            self._entries[keys] = verdict
+
+            if len(self._used) > self.max_size:  # keys hit while they were being evicted by another thread
+                self._used.intersection_update(self._entries)
+
+            while len(self._entries) > self.max_size:
+                oldest, oldest_verdict = self._entries.popitem(last=False)
+                if oldest in self._used:
+                    self._used.discard(oldest)
+                    self._entries[oldest] = oldest_verdict  # second chance, to the end of the line
+                else:
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self._entries)
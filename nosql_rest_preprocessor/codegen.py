@@ -0,0 +1,164 @@
+"""Generated validators: the rules of a compiled :class:`ModelPlan` as straight-line Python source.
+
+Used by models with ``validation_backend = 'generated'``. The source inlines every key check as a literal and calls
+the generated functions of the sub models directly, so no rule tuples are dispatched at validation time. Errors are
+the same as those of the interpreted ``validate``.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import hashlib
+import threading
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.compiled import _error
+
+_lock = threading.RLock()
+
+
+def compile_validator(plan):
+    """Returns the generated validator of ``plan``, compiling it on first use.
+
+    Sub plans are compiled when the first object with that sub model is validated.
+    """
+    if plan.validator is not None:
+        return plan.validator
+
+    with _lock:  # every plan is compiled once, even if several threads validate its first objects at the same time
+        if plan.validator is None:
+            namespace, source = _generate(plan)
+            plan.validator = _define(compile(source, _filename(plan), 'exec'), namespace)
+
+    return plan.validator
+
+
+def validator_code(plan):
+    """Returns a fingerprint of the source and the compiled code object of the validator of ``plan``, e.g. to
+    serialize them."""
+    namespace, source = _generate(plan)
+    return _fingerprint(source), compile(source, _filename(plan), 'exec')
+
+
+def load_validator(plan, fingerprint, code):
+    """Uses ``code`` from :func:`validator_code` (of another process) as the validator of ``plan``, without compiling.
+
+    Only if ``plan`` still generates a source with the same ``fingerprint``, returns whether the code was used.
+    """
+    with _lock:
+        namespace, source = _generate(plan)
+        if _fingerprint(source) != fingerprint:
+            return False
+
+        if plan.validator is None:
+            plan.validator = _define(code, namespace)
+
+        return True
+
+
+def _generate(plan):
+    namespace = {'ValidationError': exceptions.ValidationError, '_error': _error, '_compile': compile_validator}
+    return namespace, generate_source(plan, namespace)
+
+
+def _fingerprint(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def _define(code, namespace):
+    exec(code, namespace)
+    return namespace['validate']
+
+
+def _filename(plan):
+    return '<generated validator of %s>' % plan.model.__name__
+
+
+def generate_source(plan, namespace=None):
+    """Returns the source of a ``validate(obj)`` function for ``plan``.
+
+    Values which can't be written as literals (e.g. the sets passed to errors) are added to ``namespace``.
+    """
+    namespace = {} if namespace is None else namespace
+    lines = ['def validate(obj):']
+
+    def constant(value):
+        name = '_c%d' % len(namespace)
+        namespace[name] = value
+        return name
+
+    def present(keys):
+        return ' and '.join('%s in obj' % _literal(key, constant) for key in sorted(keys, key=repr))
+
+    def count(keys):
+        return ' + '.join('(%s in obj)' % _literal(key, constant) for key in sorted(keys, key=repr))
+
+    def any_present(keys):
+        return ' or '.join('%s in obj' % _literal(key, constant) for key in sorted(keys, key=repr))
+
+    # required_attributes
+    if plan.required_keys:
+        required = constant(plan.required_keys)
+        lines.append('    if not (%s):' % present(plan.required_keys))
+        lines.append("        raise _error('required', %s.difference(obj))" % required)
+
+    # rules in a stable order, the same plan generates the same source in every process (see load_validator)
+    for members in sorted(plan.one_of_groups, key=_sort_key):
+        lines.append('    if not (%s):' % any_present(members))
+        lines.append("        raise _error('one_of', %s)" % constant(members))
+
+    for members in sorted(plan.either_of_groups, key=_sort_key):
+        lines.append('    if %s != 1:' % count(members))
+        lines.append("        raise _error('either_of', %s)" % constant(members))
+
+    # optional_attributes
+    if plan.restricts_keys:
+        allowed = constant(plan.allowed_keys)
+        lines.append('    if not %s.issuperset(obj):' % allowed)
+        lines.append("        raise _error('not_allowed', frozenset(obj).difference(%s))" % allowed)
+
+        groups = {}
+        for key in plan.group_keys:
+            groups.setdefault(plan.group_index[key], []).append(key)
+
+        for (rule, members), keys in sorted(groups.items(), key=lambda group: (group[0][0], _sort_key(group[0][1]))):
+            # the rule only applies if one of the keys it is responsible for is present
+            lines.append('    if (%s) and %s:' % (
+                any_present(keys),
+                'not (%s)' % present(members) if rule == 'all_of' else '%s != 1' % count(members)
+            ))
+            lines.append('        raise _error(%r, %s)' % (str(rule), constant(members)))
+
+    # sub_models, lists of embedded objects are validated element by element
+    for attr, sub_plan in plan.sub_plans:
+        key, sub = _literal(attr, constant), constant(sub_plan)
+        lines.extend([
+            '    if %s in obj:' % key,
+            '        value = obj[%s]' % key,
+            '        if isinstance(value, list):',
+            '            for index, element in enumerate(value):',
+            '                try:',
+            '                    (%s.validator or _compile(%s))(element)' % (sub, sub),
+            '                except ValidationError as e:',
+            '                    e.prefix(%s, index)' % key,
+            '                    raise',
+            '        else:',
+            '            try:',
+            '                (%s.validator or _compile(%s))(value)' % (sub, sub),
+            '            except ValidationError as e:',
+            '                e.prefix(%s)' % key,
+            '                raise',
+        ])
+
+    lines.append('    return obj')
+    return '\n'.join(lines) + '\n'
+
+
+def _sort_key(keys):
+    return sorted(repr(key) for key in keys)
+
+
+def _literal(value, constant):
+    # attribute names are inlined as literals if they survive a round trip through repr
+    if isinstance(value, (str, type(''), int)) and not isinstance(value, bool):
+        return repr(value)
+
+    return constant(value)
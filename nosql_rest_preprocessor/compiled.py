@@ -0,0 +1,384 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import threading
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.cache import MISSING, VerdictCache
+
+
+class ModelPlan(object):
+    """Precomputed rules of a single model class, a node in the compiled tree of a model and its sub models.
+
+    Built once per class and reused by every call to ``validate``, ``prepare_response`` and ``resolve``. The plan
+    remembers the declarations it was built from and is rebuilt as soon as one of them, or one of a sub model, is
+    reassigned. Declarations which are changed in place (e.g. ``Model.required_attributes.add('name')``) are not
+    noticed: the plan, and a ``verdict_cache_size`` cache, keep enforcing the old rules. Assign a new value instead.
+
+    Plans are never changed after they have been published on their model (except for the ``version`` stamp and the
+    lazily generated ``validator``, which are set atomically), so threads read them without locking. The optional
+    ``verdicts`` cache locks on its own.
+    """
+
+    declarations = ('required_attributes', 'optional_attributes', 'private_attributes', 'sub_models',
+                    'resolved_attributes', 'verdict_cache_size')
+
+    __slots__ = ('model', 'version', 'sources', 'required_keys', 'one_of_groups', 'either_of_groups', 'restricts_keys',
+                 'allowed_keys', 'group_keys', 'group_index', 'private_keys', 'sub_models', 'sub_plans',
+                 'sub_plan_index', 'prepared_sub_plans', 'needs_prepare', 'resolved', 'has_sub_models', 'has_resolved',
+                 'validator', 'verdicts')
+
+    def __init__(self, model, building=None):
+        self.model = model
+        self.version = None
+        self.validator = None  # generated by codegen.compile_validator on first use
+
+        # a new plan starts out with an empty cache, verdicts of changed declarations are never used
+        self.verdicts = VerdictCache(model.verdict_cache_size) if model.verdict_cache_size else None
+        self.sources = tuple(getattr(model, name) for name in self.declarations)
+
+        required_keys = set()
+        one_of_groups = []
+        either_of_groups = []
+        required_flat = set()
+
+        for attr in model.required_attributes:
+            if isinstance(attr, tuple):
+                rule, members = _split_rule(attr, REQUIRED_RULES)
+
+                if rule == 'one_of':
+                    one_of_groups.append(members)
+                else:
+                    either_of_groups.append(members)
+
+                required_flat |= members
+            else:
+                required_keys.add(attr)
+                required_flat.add(attr)
+
+        self.required_keys = frozenset(required_keys)
+        self.one_of_groups = tuple(one_of_groups)
+        self.either_of_groups = tuple(either_of_groups)
+
+        self.restricts_keys = model.optional_attributes is not None
+        allowed_keys = set(required_flat)
+        group_index = {}
+
+        for opt_attr in model.optional_attributes or ():
+            if isinstance(opt_attr, tuple):
+                rule, members = _split_rule(opt_attr, OPTIONAL_RULES)
+                for key in members:
+                    if key not in required_flat:
+                        group_index.setdefault(key, (rule, members))  # the first matching rule wins
+
+                allowed_keys |= members
+            else:
+                allowed_keys.add(opt_attr)
+
+        # plain optional attributes are always allowed, regardless of any group they appear in
+        for opt_attr in model.optional_attributes or ():
+            if not isinstance(opt_attr, tuple):
+                group_index.pop(opt_attr, None)
+
+        self.allowed_keys = frozenset(allowed_keys)
+        self.group_keys = frozenset(group_index)
+        self.group_index = group_index
+
+        self.private_keys = frozenset(model.private_attributes)
+        self.sub_models = tuple(model.sub_models.items())
+        self.has_sub_models = bool(self.sub_models)
+
+        # attribute, config and the model of the resolved object (None if neither model nor sub_models say so)
+        self.resolved = tuple(
+            (attr, attr_config, getattr(attr_config, 'model', None) or model.sub_models.get(attr))
+            for attr, attr_config in model.resolved_attributes.items()
+        )
+        self.has_resolved = bool(self.resolved)
+
+        # sub models can be cyclic, plans which are still being built are only referenced
+        building = {} if building is None else building
+        building[model] = self
+        self.needs_prepare = True  # assume the worst for cyclic references to this plan
+
+        self.sub_plans = tuple(
+            (attr, building[sub_model] if sub_model in building else plan_for(sub_model, building))
+            for attr, sub_model in self.sub_models
+        )
+        self.sub_plan_index = dict(self.sub_plans)
+        self.prepared_sub_plans = tuple(
+            (attr, sub_plan) for attr, sub_plan in self.sub_plans if sub_plan.needs_prepare
+        )
+        self.needs_prepare = bool(self.private_keys or self.prepared_sub_plans)
+
+    def is_current(self, model, building=None, seen=None):
+        for source, name in zip(self.sources, self.declarations):
+            if source is not getattr(model, name):
+                return False
+
+        # a sub model which changed invalidates its whole branch of the tree
+        building = building or {}
+        seen = seen or set()
+        seen.add(model)
+        for attr, sub_plan in self.sub_plans:
+            sub_model = sub_plan.model
+
+            if sub_model in building:  # (cyclic) reference to a plan which is being rebuilt right now
+                if sub_plan is not building[sub_model]:
+                    return False
+                continue
+
+            if sub_plan is not sub_model.__dict__.get('_compiled_plan'):
+                return False
+
+            if sub_model not in seen and not sub_plan.is_current(sub_model, building, seen):
+                return False
+
+        return True
+
+    def prepare(self, obj):
+        """``prepare_response`` on the compiled tree, skips every branch without private attributes."""
+        if not self.needs_prepare or not isinstance(obj, dict):
+            return obj
+
+        # copy-on-write: only dicts that actually change are copied, everything else is shared with obj
+        prepared = obj
+
+        # remove non-public attrs
+        for attr in self.private_keys:
+            if attr in prepared:
+                if prepared is obj:
+                    prepared = dict(obj)
+                del prepared[attr]
+
+        # recurse for sub models
+        for attr, sub_plan in self.prepared_sub_plans:
+            if attr in prepared:
+                value = prepared[attr]
+                value = sub_plan.prepare_list(value) if isinstance(value, list) else sub_plan.prepare(value)
+                if value is not prepared[attr]:
+                    if prepared is obj:
+                        prepared = dict(obj)
+                    prepared[attr] = value
+
+        return prepared
+
+    def strip(self, obj):
+        """``prepare`` in place, for objects owned by the caller: removes the private attributes without copying."""
+        if not self.needs_prepare or not isinstance(obj, dict):
+            return obj
+
+        for attr in self.private_keys:
+            if attr in obj:
+                del obj[attr]
+
+        for attr, sub_plan in self.prepared_sub_plans:
+            value = obj.get(attr)
+            if isinstance(value, list):
+                for element in value:
+                    sub_plan.strip(element)
+            elif value is not None:
+                sub_plan.strip(value)
+
+        return obj
+
+    def prepare_value(self, value):
+        return self.prepare_list(value) if isinstance(value, list) else self.prepare(value)
+
+    def prepare_list(self, objs):
+        prepared_objs = [self.prepare(obj) for obj in objs]
+
+        for prepared, obj in zip(prepared_objs, objs):
+            if prepared is not obj:
+                return prepared_objs
+
+        return objs  # nothing changed, keep sharing the list
+
+    def check_keys(self, keys):
+        """``check_required`` and ``check_allowed``, with the verdict cache of the model if it has one."""
+        verdicts = self.verdicts
+        if verdicts is None:
+            self.check_required(keys)
+            self.check_allowed(keys)
+            return
+
+        verdict = verdicts.get(keys)
+        if verdict is MISSING:
+            try:
+                self.check_required(keys)
+                self.check_allowed(keys)
+            except exceptions.ValidationError as e:
+                violation = e.errors[0]
+                verdicts.put(keys, (violation.rule, violation.keys))
+                raise
+
+            verdicts.put(keys, None)
+
+        elif verdict is not None:
+            raise _error(*verdict)  # a new error every time, it's changed on its way out of sub models
+
+    def check_required(self, keys):
+        if not self.required_keys.issubset(keys):
+            raise _error('required', self.required_keys.difference(keys))
+
+        for members in self.one_of_groups:
+            if members.isdisjoint(keys):
+                raise _error('one_of', members)
+
+        for members in self.either_of_groups:
+            if len(members.intersection(keys)) != 1:
+                raise _error('either_of', members)
+
+    def check_allowed(self, keys):
+        if not self.restricts_keys:
+            return
+
+        if not self.allowed_keys.issuperset(keys):
+            raise _error('not_allowed', frozenset(keys).difference(self.allowed_keys))
+
+        for key in self.group_keys.intersection(keys):
+            rule, members = self.group_index[key]
+
+            if rule == 'all_of':
+                if not members.issubset(keys):  # if one of these is present, all of them have to be there
+                    raise _error('all_of', members)
+
+            elif len(members.intersection(keys)) != 1:  # either_of: no other key may be present
+                raise _error('either_of', members)
+
+    def violations(self, keys):
+        """Returns every broken rule instead of raising the first one."""
+        keys = frozenset(keys)
+        violations = []
+
+        missing = self.required_keys.difference(keys)
+        if missing:
+            violations.append(exceptions.Violation('required', missing))
+
+        for members in self.one_of_groups:
+            if members.isdisjoint(keys):
+                violations.append(exceptions.Violation('one_of', members))
+
+        for members in self.either_of_groups:
+            if len(members.intersection(keys)) != 1:
+                violations.append(exceptions.Violation('either_of', members))
+
+        if self.restricts_keys:
+            not_allowed = keys.difference(self.allowed_keys)
+            if not_allowed:
+                violations.append(exceptions.Violation('not_allowed', not_allowed))
+
+            broken_groups = set()
+            for key in self.group_keys.intersection(keys):
+                rule, members = self.group_index[key]
+                if rule == 'all_of' and not members.issubset(keys):
+                    broken_groups.add((rule, members))
+                elif rule == 'either_of' and len(members.intersection(keys)) != 1:
+                    broken_groups.add((rule, members))
+
+            violations.extend(exceptions.Violation(rule, members) for rule, members in broken_groups)
+
+        return violations
+
+
+def project(plan, value, fields):
+    """Returns a copy of value with only the attributes of the field tree ``fields`` (see :func:`utils.field_tree`).
+
+    Private attributes of ``plan`` (which may be ``None``) and its sub plans are removed, unrequested attributes are
+    neither copied nor prepared.
+    """
+    if isinstance(value, list):
+        return [project(plan, element, fields) for element in value]
+
+    if not isinstance(value, dict):
+        return value  # e.g. an id which has not been resolved
+
+    projected = {}
+    for key, sub_fields in fields.items():
+        if key in value and (plan is None or key not in plan.private_keys):
+            sub_plan = plan.sub_plan_index.get(key) if plan is not None else None
+
+            if sub_fields is True:
+                projected[key] = value[key] if sub_plan is None else sub_plan.prepare_value(value[key])
+            else:
+                projected[key] = project(sub_plan, value[key], sub_fields)
+
+    return projected
+
+
+def _error(rule, keys):
+    return exceptions.ValidationError(errors=[exceptions.Violation(rule, keys)])
+
+
+def check_rules(name, attributes):
+    """Raises ``ConfigurationError`` for a malformed rule tuple in a ``required_attributes`` or
+    ``optional_attributes`` declaration, so broken models fail when they are defined instead of on every request."""
+    rules = {'required_attributes': REQUIRED_RULES, 'optional_attributes': OPTIONAL_RULES}.get(name)
+    if rules is None:
+        return
+
+    for attr in attributes or ():
+        if isinstance(attr, tuple):
+            _split_rule(attr, rules)
+
+
+def _split_rule(attr, rules):
+    try:
+        rule, members = attr
+        members = frozenset(members)
+    except (TypeError, ValueError):
+        raise exceptions.ConfigurationError()
+
+    if rule not in rules:
+        raise exceptions.ConfigurationError()
+
+    return rule, members
+
+
+REQUIRED_RULES = frozenset(['one_of', 'either_of'])
+
+OPTIONAL_RULES = frozenset(['all_of', 'either_of'])
+
+_version = [0]  # bumped whenever a declaration of any model is reassigned
+
+_version_lock = threading.Lock()
+
+_build_lock = threading.RLock()  # plans are built by one thread at a time, reading them needs no lock
+
+
+def declarations_changed():
+    with _version_lock:
+        _version[0] += 1
+
+
+def plan_for(model, building=None):
+    """Returns the current :class:`ModelPlan` of ``model``, compiling it on first use."""
+    plan = model.__dict__.get('_compiled_plan')
+
+    version = _version[0]
+    if plan is not None and plan.version == version:
+        return plan  # no model changed since this plan was last checked
+
+    if building is not None:  # a sub model of a plan being built, the lock is held already
+        return _current_plan(model, version, building)
+
+    with _build_lock:
+        building = {}
+        plan = _current_plan(model, version, building)
+
+        # publish the new plans only once all of them are complete, cyclic ones reference each other
+        for built_model, built_plan in building.items():
+            built_plan.version = version
+            built_model._compiled_plan = built_plan
+
+    return plan
+
+
+def _current_plan(model, version, building):
+    if model in building:
+        return building[model]
+
+    plan = model.__dict__.get('_compiled_plan')
+    if plan is not None and (plan.version == version or plan.is_current(model, building)):
+        plan.version = version
+        return plan
+
+    return ModelPlan(model, building)  # adds itself and its new sub plans to building
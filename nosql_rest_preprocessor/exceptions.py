@@ -1,8 +1,68 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
 
+class Violation(object):
+    """A single broken rule: ``rule`` is one of ``'required'``, ``'one_of'``, ``'either_of'``, ``'all_of'`` or
+    ``'not_allowed'``, ``keys`` are the offending attributes and ``path`` leads through ``sub_models`` to the object.
+    ``merge_patch`` reports malformed patches as ``'invalid_patch'``, with the JSON pointer as the only key."""
+
+    __slots__ = ('rule', 'keys', 'path')
+
+    messages = {
+        'required': 'missing required attributes',
+        'one_of': 'needs at least one of',
+        'either_of': 'needs exactly one of',
+        'all_of': 'needs all of',
+        'not_allowed': 'attributes not allowed',
+        'invalid_patch': 'invalid patch operation at'
+    }
+
+    def __init__(self, rule, keys, path=()):
+        self.rule = rule
+        self.keys = tuple(sorted(keys, key=repr))  # keys may be of any (mixed) hashable type
+        self.path = tuple(path)
+
+    @property
+    def message(self):
+        path = '.'.join('%s' % part for part in self.path)
+        return '%s: %s %s' % (path or '<root>', self.messages[self.rule],
+                               ', '.join('%s' % key for key in self.keys))
+
+    def __eq__(self, other):
+        return isinstance(other, Violation) and (self.rule, self.keys, self.path) == (other.rule, other.keys, other.path)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.rule, self.keys, self.path))
+
+    def __repr__(self):
+        return 'Violation(%r, %r, path=%r)' % (self.rule, self.keys, self.path)
+
+    def __reduce__(self):
+        return Violation, (self.rule, self.keys, self.path)
+
+
 class ValidationError(Exception):
-    pass
+    """Raised for invalid objects. ``errors`` holds the :class:`Violation` which failed first, or all of them if
+    the object was validated with ``collect_errors=True``."""
+
+    def __init__(self, message='', errors=None):
+        self.errors = list(errors or [])
+        self.message = message or '; '.join(error.message for error in self.errors)
+        super(ValidationError, self).__init__(self.message)
+
+    def prefix(self, *path):
+        # called while the error propagates out of sub models
+        for error in self.errors:
+            error.path = path + error.path
+
+        self.message = '; '.join(error.message for error in self.errors) or self.message
+        self.args = (self.message,)
+
+    def __reduce__(self):
+        return type(self), (self.message, self.errors)
 
 
 class ChangingImmutableAttributeError(Exception):
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import json
+import logging
+import threading
+import time
+from functools import wraps
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_collector = None  # called with every event while instrumentation is enabled
+
+
+def enable(collector):
+    """Starts sending events to ``collector``, a callable which takes a single event dict.
+
+    Operations (``validate``, ``prepare_response``, ``merge_updated``, ``resolve``) produce events with the keys
+    ``operation``, ``model``, ``duration``, ``size`` (number of keys or objects) and ``error`` (exception name or
+    ``None``). Every resolved attribute on every depth level produces a ``lookup`` event with ``model``,
+    ``attribute``, ``depth``, ``hits`` and ``misses`` (objects resolved and ids left unresolved).
+    """
+    global _collector
+    _collector = collector
+
+
+def disable():
+    global _collector
+    _collector = None
+
+
+def emit(event):
+    if _collector is not None:
+        _collector(event)
+
+
+def enabled():
+    return _collector is not None
+
+
+def instrumented(operation):
+    """Records the duration of a ``(model, obj, ...)`` function as an ``operation`` event while enabled."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(model, obj, *args, **kwargs):
+            if _collector is None:
+                return f(model, obj, *args, **kwargs)
+
+            error = None
+            start = timer()
+            try:
+                return f(model, obj, *args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                emit(operation_event(operation, model, obj, start, error))
+
+        return wrapper
+
+    return decorator
+
+
+def operation_event(operation, model, obj, start, error):
+    """The event of an ``operation`` on ``obj`` which started at ``start``, for :func:`instrumented` and its async
+    counterpart. ``error`` is the name of the exception it raised, if any."""
+    return {
+        'operation': operation,
+        'model': model.__name__,
+        'duration': timer() - start,
+        'size': len(obj) if hasattr(obj, '__len__') else None,  # iterators and cursors have no length
+        'error': error
+    }
+
+
+class StatsCollector(object):
+    """Aggregates events per operation and model class, and lookups per resolved attribute. Thread-safe."""
+
+    def __init__(self):
+        self.operations = {}
+        self.lookups = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self._add(event)
+
+    def _add(self, event):
+        if event['operation'] == 'lookup':
+            stats = self.lookups.setdefault((event['model'], event['attribute']), {
+                'hits': 0, 'misses': 0, 'max_depth': 0
+            })
+            stats['hits'] += event['hits']
+            stats['misses'] += event['misses']
+            stats['max_depth'] = max(stats['max_depth'], event['depth'])
+        else:
+            stats = self.operations.setdefault((event['operation'], event['model']), {
+                'calls': 0, 'errors': 0, 'total_duration': 0.0, 'max_duration': 0.0, 'total_size': 0
+            })
+            stats['calls'] += 1
+            stats['errors'] += event['error'] is not None
+            stats['total_duration'] += event['duration']
+            stats['max_duration'] = max(stats['max_duration'], event['duration'])
+            stats['total_size'] += event['size'] or 0
+
+    def dump(self):
+        """Returns the collected stats as a JSON serializable dict."""
+        with self._lock:
+            operations = []
+            for (operation, model), stats in sorted(self.operations.items()):
+                operations.append(dict(stats, operation=operation, model=model,
+                                       mean_duration=stats['total_duration'] / stats['calls']))
+
+            lookups = []
+            for (model, attribute), stats in sorted(self.lookups.items()):
+                lookups.append(dict(stats, model=model, attribute=attribute))
+
+        return {'operations': operations, 'lookups': lookups}
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.lookups.clear()
+
+
+class LoggingCollector(object):
+    """Emits every event as a structured log record, as JSON message and as ``record.event``."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('nosql_rest_preprocessor')
+        self.level = level
+
+    def __call__(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps(event, sort_keys=True), extra={'event': event})
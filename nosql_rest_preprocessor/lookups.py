@@ -0,0 +1,183 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import threading
+from inspect import isclass
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from nosql_rest_preprocessor import exceptions
+
+
+class LookupInstances(object):
+    """Hands out instances of a ``lookup_class`` for the duration of a single lookup.
+
+    ``setup`` is called with every new instance, ``teardown`` with every instance that is discarded, either right after
+    the lookup (scope ``'call'``) or when :meth:`close` is called.
+    """
+
+    def __init__(self, lookup_class, lookup_class_kwargs, setup=None, teardown=None):
+        self.lookup_class = lookup_class
+        self.lookup_class_kwargs = lookup_class_kwargs
+        self.setup = setup
+        self.teardown = teardown
+
+    def acquire(self):
+        raise NotImplementedError()
+
+    def acquire_nowait(self):
+        """Like :meth:`acquire`, but returns ``None`` instead of waiting for an instance, e.g. on an event loop."""
+        return self.acquire()
+
+    def release(self, instance):
+        pass
+
+    def close(self):
+        pass
+
+    def _create(self):
+        instance = self.lookup_class(**self.lookup_class_kwargs)
+        if self.setup is not None:
+            self.setup(instance)
+
+        return instance
+
+    def _discard(self, instance):
+        if self.teardown is not None:
+            self.teardown(instance)
+
+
+class SharedInstance(LookupInstances):
+    # lookup_class is already an instance, it's used as is and never torn down
+
+    def acquire(self):
+        return self.lookup_class
+
+
+class PerCallInstances(LookupInstances):
+
+    def acquire(self):
+        return self._create()
+
+    def release(self, instance):
+        self._discard(instance)
+
+
+class PerResolverInstances(LookupInstances):
+
+    def __init__(self, *args, **kwargs):
+        super(PerResolverInstances, self).__init__(*args, **kwargs)
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._create()
+
+        return self._instance
+
+    def close(self):
+        with self._lock:
+            instance, self._instance = self._instance, None
+
+        if instance is not None:
+            self._discard(instance)
+
+
+class ThreadLocalInstances(LookupInstances):
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadLocalInstances, self).__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._instances = []  # every instance created in any thread, so close() can tear them down
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        instance = getattr(self._local, 'instance', None)
+
+        if instance is None:
+            instance = self._local.instance = self._create()
+            with self._lock:
+                self._instances.append(instance)
+
+        return instance
+
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+
+        self._local = threading.local()
+        for instance in instances:
+            self._discard(instance)
+
+
+class InstancePool(LookupInstances):
+
+    def __init__(self, lookup_class, lookup_class_kwargs, setup=None, teardown=None, size=4):
+        super(InstancePool, self).__init__(lookup_class, lookup_class_kwargs, setup, teardown)
+        self.size = size
+        self._free = queue.LifoQueue()  # reuse the most recently used (warmest) instance first
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        instance = self.acquire_nowait()
+        if instance is None:
+            instance = self._free.get()  # block until another thread releases an instance
+
+        return instance
+
+    def acquire_nowait(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return None  # exhausted
+
+    def release(self, instance):
+        self._free.put(instance)
+
+    def close(self):
+        while True:
+            try:
+                instance = self._free.get_nowait()
+            except queue.Empty:
+                break
+
+            with self._lock:
+                self._created -= 1
+            self._discard(instance)
+
+
+def lookup_instances(lookup_class, lookup_class_kwargs, scope='call', pool_size=4, setup=None, teardown=None):
+    if not isclass(lookup_class):
+        return SharedInstance(lookup_class, lookup_class_kwargs)
+
+    if scope == 'call':
+        return PerCallInstances(lookup_class, lookup_class_kwargs, setup, teardown)
+    elif scope == 'resolver':
+        return PerResolverInstances(lookup_class, lookup_class_kwargs, setup, teardown)
+    elif scope == 'thread':
+        return ThreadLocalInstances(lookup_class, lookup_class_kwargs, setup, teardown)
+    elif scope == 'pool':
+        return InstancePool(lookup_class, lookup_class_kwargs, setup, teardown, size=pool_size)
+    else:
+        raise exceptions.ConfigurationError()
@@ -1,10 +1,43 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
-from nosql_rest_preprocessor import exceptions
-from nosql_rest_preprocessor.utils import non_mutating
+from nosql_rest_preprocessor import batch, codegen, exceptions, parallel, patches, raw
+from nosql_rest_preprocessor.compiled import ModelPlan, check_rules, declarations_changed, plan_for, project
+from nosql_rest_preprocessor.instrumentation import instrumented
+from nosql_rest_preprocessor.utils import field_tree, map_stream, with_metaclass
 
 
-class BaseModel(object):
+class ModelType(type):
+    # lets the compiled plans know when a declaration like required_attributes is reassigned on any model
+
+    backends = ('interpreted', 'generated')
+
+    def __init__(cls, name, bases, attributes):
+        super(ModelType, cls).__init__(name, bases, attributes)
+        for attr, value in attributes.items():
+            cls._check_declaration(attr, value)
+
+    def __setattr__(cls, name, value):
+        cls._check_declaration(name, value)
+        super(ModelType, cls).__setattr__(name, value)
+        if name in ModelPlan.declarations:
+            declarations_changed()
+
+    def __delattr__(cls, name):
+        super(ModelType, cls).__delattr__(name)
+        if name in ModelPlan.declarations:
+            declarations_changed()
+
+    def _check_declaration(cls, name, value):
+        # broken declarations fail when the model is defined, not on every request
+        check_rules(name, value)
+        if name == 'validation_backend' and value not in ModelType.backends:
+            raise exceptions.ConfigurationError()
+        if name == 'verdict_cache_size' and value is not None and (
+                isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            raise exceptions.ConfigurationError()
+
+
+class BaseModel(with_metaclass(ModelType)):
     required_attributes = set()
 
     optional_attributes = None
@@ -17,34 +50,109 @@ class BaseModel(object):
 
     resolved_attributes = {}
 
-    @classmethod
-    def validate(cls, obj):
-        cls._check_required_attributes(obj)
+    # 'generated' validates with a function generated from the rules of the model and its sub models, see codegen
+    validation_backend = 'interpreted'
 
-        cls._check_allowed_attributes(obj)
+    # remember the outcome of required_attributes and optional_attributes for up to this many distinct sets of keys,
+    # for the 'interpreted' backend. Sub models are validated on every call, see ModelPlan.check_keys
+    verdict_cache_size = None
 
-        # recurse for sub models
-        for attr, sub_model in cls.sub_models.items():
-            if attr in obj.keys():
-                sub_model.validate(obj[attr])
+    @classmethod
+    @instrumented('validate')
+    def validate(cls, obj, collect_errors=False):
+        try:
+            plan = plan_for(cls)
+            if cls.validation_backend == 'generated':
+                return (plan.validator or codegen.compile_validator(plan))(obj)
+
+            plan.check_keys(frozenset(obj))
+
+            # recurse for sub models, lists of embedded objects are validated element by element
+            for attr, sub_model in plan.sub_models:
+                if attr in obj:
+                    for path, value in _elements(attr, obj[attr]):
+                        try:
+                            sub_model.validate(value)
+                        except exceptions.ValidationError as e:
+                            e.prefix(*path)
+                            raise
+
+        except exceptions.ValidationError:
+            if not collect_errors:
+                raise
+
+            # only invalid objects pay for looking for all violations
+            raise exceptions.ValidationError(errors=cls.validation_errors(obj))
 
         return obj
 
     @classmethod
-    @non_mutating
-    def prepare_response(cls, obj):
-        # remove non-public attrs
-        for attr in cls.private_attributes:
-            obj.pop(attr, None)
+    @instrumented('validate_raw')
+    def validate_raw(cls, data, collect_errors=False, decode=False):
+        """Validates a JSON document given as bytes, memoryview or mmap without decoding it, see :func:`raw.validate_raw`."""
+        return raw.validate_raw(cls, data, collect_errors, decode)
+
+    @classmethod
+    def validation_errors(cls, obj, path=()):
+        """Returns a list of every :class:`exceptions.Violation` in obj and its sub models, empty if obj is valid."""
+        errors = plan_for(cls).violations(obj)
+        for error in errors:
+            error.path = path
 
         # recurse for sub models
         for attr, sub_model in cls.sub_models.items():
             if attr in obj.keys():
-                obj[attr] = sub_model.prepare_response(obj[attr])
+                for sub_path, value in _elements(attr, obj[attr]):
+                    errors.extend(sub_model.validation_errors(value, path + sub_path))
 
-        return obj
+        return errors
+
+    @classmethod
+    @instrumented('prepare_response')
+    def prepare_response(cls, obj, fields=None):
+        # removes non-public attrs on the compiled model tree, copying only the dicts that actually change
+        if fields is None:
+            return plan_for(cls).prepare(obj)
+
+        # partial response, e.g. fields=['name', 'address.city']
+        return project(plan_for(cls), obj, field_tree(fields))
+
+    @classmethod
+    @instrumented('prepare_responses')
+    def prepare_responses(cls, objs, in_place=False):
+        """``prepare_response`` for a list of objects, e.g. a page of a list endpoint, with the compiled rules looked up
+        once for all of them. With ``in_place`` the private attributes are deleted from the objects themselves instead
+        of from copies, only for objects the caller owns."""
+        plan = plan_for(cls)
+        if not plan.needs_prepare:
+            return list(objs)
+
+        prepare = plan.strip if in_place else plan.prepare
+        return [prepare(obj) for obj in objs]
+
+    @classmethod
+    def validate_stream(cls, objs, errors=None):
+        """Lazily validates every object of an iterable or cursor, see :func:`utils.map_stream` for ``errors``."""
+        return map_stream(cls.validate, objs, errors)
 
     @classmethod
+    def prepare_stream(cls, objs, errors=None, fields=None):
+        """Lazily prepares every object of an iterable or cursor, see :func:`utils.map_stream` for ``errors``."""
+        fields = field_tree(fields)
+        return map_stream(lambda obj: cls.prepare_response(obj, fields), objs, errors)
+
+    @classmethod
+    def validate_many(cls, objs, workers=None, chunksize=2000, errors=None, **kwargs):
+        """Validates a list of objects across a process pool, see :func:`parallel.validate_many`."""
+        return parallel.validate_many(cls, objs, workers, chunksize, errors, **kwargs)
+
+    @classmethod
+    def validate_batch(cls, objs, errors=None):
+        """Validates a list of objects, checking the keys of every shape of object once, see :func:`batch.validate_batch`."""
+        return batch.validate_batch(cls, objs, errors)
+
+    @classmethod
+    @instrumented('merge_updated')
     def merge_updated(cls, db_obj, new_obj):
         cls.validate(new_obj)
 
@@ -59,84 +167,40 @@ class BaseModel(object):
         for key, value in new_obj.items():
             cls._check_immutable_attrs_on_update(key, value, db_obj)
 
-            if key in cls.resolved_attributes and isinstance(value, dict):  # ignore resolved attributes in update
+            if key in cls.resolved_attributes and _is_resolved(value):  # ignore resolved attributes in update
                 merged_obj[key] = db_obj[key]
             else:
                 merged_obj[key] = value
 
-        # recurse for sub models
+        # recurse for sub models, lists of embedded objects are merged element by element
         for attr, sub_model in cls.sub_models.items():
-            merged_obj[attr] = sub_model.merge_updated(db_obj[attr], new_obj[attr])
+            if attr not in new_obj or (attr in cls.resolved_attributes and _is_resolved(new_obj[attr])):
+                continue
+
+            merged_obj[attr] = patches.merge_embedded(sub_model, db_obj.get(attr), new_obj[attr])
 
         return merged_obj
 
+    @classmethod
+    @instrumented('merge_patch')
+    def merge_patch(cls, db_obj, patch):
+        """Applies a JSON (Merge) Patch, returns the merged object and a change set, see :func:`patches.merge_patch`."""
+        return patches.merge_patch(cls, db_obj, patch)
+
     @classmethod
     def _check_immutable_attrs_on_update(cls, key, value, db_obj):
         # check if immutable attributes should be changed
         if key in cls.immutable_attributes:
-            if db_obj[key] != value:
+            if key in db_obj and db_obj[key] != value:
                 raise exceptions.ChangingImmutableAttributeError()
 
     @classmethod
-    def _check_required_attributes(cls, obj):
-        for attr in cls.required_attributes:
-            if isinstance(attr, tuple):
-                set_wanted = set(attr[1])
-                set_contained = set(obj.keys())
-
-                if attr[0] == 'one_of':
-                    if len(set_wanted & set_contained) < 1:
-                        raise exceptions.ValidationError()
-
-                elif attr[0] == 'either_of':
-                    if len(set_wanted & set_contained) != 1:
-                        raise exceptions.ValidationError()
-
-                else:
-                    raise exceptions.ConfigurationError()
-
-            else:
-                if attr not in obj.keys():
-                    raise exceptions.ValidationError()
+    def _check_required_attributes(cls, obj, keys=None):
+        plan_for(cls).check_required(frozenset(obj) if keys is None else keys)
 
     @classmethod
-    def _check_allowed_attributes(cls, obj):
-        if cls.optional_attributes is not None:
-            required = cls._required_attributes()
-
-            for attr in obj.keys():
-                if attr in required:
-                    continue
-
-                allowed = False
-                for opt_attr in cls.optional_attributes:
-                    if attr == opt_attr:
-                        allowed = True
-                        break
-
-                    elif isinstance(opt_attr, tuple):
-
-                        if opt_attr[0] == 'all_of':
-                            if attr in opt_attr[1]:  # if one of these is in obj.keys()...
-                                if not set(opt_attr[1]).issubset(obj.keys()):  # ...all of them have to be there
-                                    raise exceptions.ValidationError()
-                                else:
-                                    allowed = True
-                                    break
-
-                        elif opt_attr[0] == 'either_of':
-                            if attr in opt_attr[1]:  # if one of these is in obj.keys()...
-                                if next((key for key in opt_attr[1] if key != attr and key in obj.keys()), None):  # ...no other key may be present in obj.keys()
-                                    raise exceptions.ValidationError()
-                                else:
-                                    allowed = True
-                                    break
-
-                        else:
-                            raise exceptions.ConfigurationError()
-
-                if not allowed:  # if we haven't found attr anywhere in cls.optional_attributes
-                    raise exceptions.ValidationError()
+    def _check_allowed_attributes(cls, obj, keys=None):
+        plan_for(cls).check_allowed(frozenset(obj) if keys is None else keys)
 
     @classmethod
     def _required_attributes(cls):
@@ -147,4 +211,20 @@ class BaseModel(object):
             else:
                 required.add(attr)
 
-        return required
\ No newline at end of file
+        return required
+
+
+def _elements(attr, value):
+    # yields (path, obj) for a single embedded object or for every object of a list
+    if isinstance(value, list):
+        for index, element in enumerate(value):
+            yield (attr, index), element
+    else:
+        yield (attr,), value
+
+
+def _is_resolved(value):
+    if isinstance(value, list):
+        return any(isinstance(element, dict) for element in value)
+
+    return isinstance(value, dict)
@@ -0,0 +1,97 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import multiprocessing
+
+from nosql_rest_preprocessor.compiled import plan_for
+from nosql_rest_preprocessor.utils import map_stream, without_failures
+
+MIN_PARALLEL_SIZE = 20000  # below this, starting a process pool costs more than it saves, see benchmarks/
+
+# what the workers validate with, sent instead of the model classes: a worker started with 'spawn' would import them
+# with the declarations of their module, and classes defined in a function can't be imported at all
+_RULES = ('required_attributes', 'optional_attributes', 'validation_backend', 'verdict_cache_size')
+
+_worker_model = None
+
+
+def validate_many(model, objs, workers=None, chunksize=2000, errors=None, min_parallel_size=MIN_PARALLEL_SIZE,
+                  start_method=None):
+    """Validates a list of objects with ``model`` across a pool of ``workers`` processes.
+
+    Returns the valid objects, see :func:`utils.without_failures` for ``errors``. Inputs smaller than
+    ``min_parallel_size`` are validated in the calling process.
+
+    The workers get the current rules of ``model`` and its sub models once and validate with models rebuilt from them,
+    so classes which override ``validate`` are validated by their declarations only. ``start_method`` is one of
+    ``multiprocessing``'s, e.g. ``'spawn'``, the platform's default if ``None``.
+    """
+    objs = list(objs)
+    workers = workers or multiprocessing.cpu_count()
+
+    if workers <= 1 or len(objs) < min_parallel_size:
+        return list(map_stream(model.validate, objs, errors))
+
+    # the rules are sent to every worker once, the chunks only carry the objects and only failures are sent back
+    context = multiprocessing if start_method is None else multiprocessing.get_context(start_method)
+    pool = context.Pool(workers, _init_worker, (_rules(model),))
+    try:
+        chunks = ((offset, objs[offset:offset + chunksize]) for offset in range(0, len(objs), chunksize))
+
+        failures = []
+        for chunk_failures in pool.imap(_validate_chunk, chunks):
+            failures.extend(chunk_failures)
+            if failures and errors is None:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return without_failures(objs, failures, errors)
+
+
+def _rules(model):
+    # the rules of model and its sub models as plain data: (name, declarations, sub models by position) per model
+    entries, positions, pending = [], {model: 0}, [model]
+    while pending:
+        current = pending.pop(0)
+        sub_models = {}
+        for attr, sub_model in current.sub_models.items():
+            if sub_model not in positions:
+                positions[sub_model] = len(positions)
+                pending.append(sub_model)
+            sub_models[attr] = positions[sub_model]
+
+        entries.append((current.__name__, dict((name, getattr(current, name)) for name in _RULES), sub_models))
+
+    return entries
+
+
+def _model_from_rules(entries):
+    # new model classes with the rules of _rules (including cyclic sub models), returns the first one
+    from nosql_rest_preprocessor.models import BaseModel  # models imports this module
+
+    models = [type(BaseModel)(str(name), (BaseModel,), declarations) for name, declarations, sub_models in entries]
+    for model, (name, declarations, sub_models) in zip(models, entries):
+        model.sub_models = dict((attr, models[position]) for attr, position in sub_models.items())
+
+    return models[0]
+
+
+def _init_worker(entries):
+    global _worker_model
+    _worker_model = _model_from_rules(entries)
+
+    plan_for(_worker_model)  # compile the rules once per worker
+
+
+def _validate_chunk(chunk):
+    offset, objs = chunk
+
+    failures = []
+    for index, obj in enumerate(objs, offset):
+        try:
+            _worker_model.validate(obj)
+        except Exception as e:
+            failures.append((index, e))
+
+    return failures
@@ -0,0 +1,239 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.compiled import plan_for
+
+MISSING = object()
+
+
+def merge_patch(model, db_obj, patch):
+    """Applies a partial update to ``db_obj`` and returns the merged object and a minimal change set.
+
+    ``patch`` is either a JSON Merge Patch (RFC 7386, a dict where ``None`` removes an attribute) or a JSON Patch
+    (RFC 6902, a list of operations). JSON Patch pointers may only lead through objects: pointers into arrays (like
+    ``/tags/0`` or ``/tags/-``) are not supported, replace the whole array instead. Only the dicts containing a touched
+    path are validated against their model and copied, everything else is shared with ``db_obj``, which is never
+    mutated. The change set looks like ``{'$set': {'address.city': 'London'}, '$unset': {'nickname': ''}}``.
+
+    Malformed or failing patches raise a ``ValidationError`` with an ``'invalid_patch'`` violation of the pointer.
+    """
+    if isinstance(patch, list):
+        operations = _json_patch_operations(db_obj, patch)
+    elif isinstance(patch, dict):
+        operations = _merge_patch_operations(model, db_obj, patch, ())
+    else:
+        raise _invalid('', 'a patch is either a JSON Merge Patch (object) or a JSON Patch (array)')
+
+    merged_obj = db_obj
+    touched_paths = []
+
+    for path, value in operations:
+        merged_obj = _apply(model, merged_obj, path, value)
+        touched_paths.append(path)
+
+    # the key rules only have to be checked for the dicts which contain a touched attribute
+    for parent_path in set(path[:-1] for path in touched_paths):
+        parent_model = _model_at(model, parent_path)
+        if parent_model is not None:
+            keys = frozenset(_get(merged_obj, parent_path))
+            plan = plan_for(parent_model)
+            try:
+                plan.check_required(keys)
+                plan.check_allowed(keys)
+            except exceptions.ValidationError as e:
+                e.prefix(*parent_path)
+                raise
+
+    return merged_obj, _changes(db_obj, merged_obj, touched_paths)
+
+
+def _merge_patch_operations(model, db_obj, patch, path):
+    # translates a merge patch into (path, value) pairs, where value MISSING removes the attribute
+    operations = []
+
+    for key, value in patch.items():
+        key_path = path + (key,)
+        db_value = db_obj.get(key) if isinstance(db_obj, dict) else None
+        resolved = model is not None and key in model.resolved_attributes
+
+        if value is None:
+            operations.append((key_path, MISSING))
+        elif isinstance(value, dict) and isinstance(db_value, dict) and not resolved:
+            sub_model = model.sub_models.get(key) if model is not None else None
+            operations.extend(_merge_patch_operations(sub_model, db_value, value, key_path))
+        else:
+            operations.append((key_path, value))
+
+    return operations
+
+
+def _json_patch_operations(db_obj, patch):
+    # translates a JSON patch into (path, value) pairs, where value MISSING removes the attribute
+    operations = []
+    current = dict(db_obj)  # shallow view of the object after the previous operations, for 'test', 'move' and 'copy'
+
+    for operation in patch:
+        try:
+            op, pointer = operation['op'], operation['path']
+        except (KeyError, TypeError):
+            raise _invalid('', 'every operation needs an "op" and a "path"')
+
+        path = _parse_pointer(current, pointer)
+
+        if op in ('add', 'replace'):
+            if 'value' not in operation:
+                raise _invalid(pointer, '"%s" needs a "value"' % op)
+            if op == 'replace' and _get(current, path, MISSING) is MISSING:
+                raise _invalid(pointer, 'nothing to replace')
+            changed = [(path, operation['value'])]
+
+        elif op == 'remove':
+            if _get(current, path, MISSING) is MISSING:
+                raise _invalid(pointer, 'nothing to remove')
+            changed = [(path, MISSING)]
+
+        elif op == 'test':
+            if _get(current, path, MISSING) != operation.get('value', MISSING):
+                raise _invalid(pointer, 'test failed')
+            changed = []
+
+        elif op in ('move', 'copy'):
+            from_pointer = operation.get('from')
+            from_path = _parse_pointer(current, from_pointer)
+            value = _get(current, from_path, MISSING)
+            if value is MISSING:
+                raise _invalid(from_pointer, 'nothing to %s' % op)
+            changed = [(from_path, MISSING)] if op == 'move' else []
+            changed.append((path, value))
+
+        else:
+            raise _invalid(pointer, 'unknown operation %r' % (op,))
+
+        for changed_path, value in changed:
+            if not changed_path:
+                raise _invalid(pointer, 'use merge_updated to replace the whole object')
+            if not isinstance(_get(current, changed_path[:-1], MISSING), dict):
+                raise _invalid(pointer, 'the parent of the target does not exist')
+            current = _set(current, changed_path, value)
+            operations.append((changed_path, value))
+
+    return operations
+
+
+def _parse_pointer(current, pointer):
+    if pointer == '':
+        return ()
+
+    if not hasattr(pointer, 'startswith') or not pointer.startswith('/'):
+        raise _invalid(pointer, 'a JSON pointer starts with "/"')
+
+    path = tuple(part.replace('~1', '/').replace('~0', '~') for part in pointer[1:].split('/'))
+
+    obj = current
+    for key in path[:-1]:
+        obj = obj.get(key) if isinstance(obj, dict) else None
+        if isinstance(obj, list):
+            raise _invalid(pointer, 'pointers into arrays are not supported, replace the whole array')
+
+    return path
+
+
+def _invalid(pointer, reason):
+    return exceptions.ValidationError('%s: %s' % (pointer or '<root>', reason),
+                                      errors=[exceptions.Violation('invalid_patch', ['%s' % (pointer,)])])
+
+
+def _apply(model, obj, path, value):
+    parent_model = _model_at(model, path[:-1])
+    key = path[-1]
+    parent = _get(obj, path[:-1], MISSING)
+
+    if not isinstance(parent, dict):
+        raise _invalid(_pointer(path), 'the parent of the target is not an object')
+
+    old_value = parent.get(key, MISSING)
+
+    if parent_model is not None:
+        if key in parent_model.immutable_attributes and old_value is not MISSING and old_value != value:
+            raise exceptions.ChangingImmutableAttributeError()
+
+        if key in parent_model.resolved_attributes and isinstance(value, dict):
+            return obj  # ignore resolved attributes in update
+
+        sub_model = parent_model.sub_models.get(key)
+        if sub_model is not None and value is not MISSING:
+            value = merge_embedded(sub_model, old_value, value)
+
+    return _set(obj, path, value)
+
+
+def merge_embedded(sub_model, db_value, new_value):
+    """``sub_model.merge_updated`` for an embedded object, or element by element for a list of embedded objects."""
+    if isinstance(new_value, list):
+        db_values = db_value if isinstance(db_value, list) else []
+        return [
+            merge_embedded(sub_model, db_values[index] if index < len(db_values) else None, value)
+            for index, value in enumerate(new_value)
+        ]
+
+    return sub_model.merge_updated(db_value if isinstance(db_value, dict) else {}, new_value)
+
+
+def _model_at(model, path):
+    for key in path:
+        if model is None:
+            break
+        model = model.sub_models.get(key)
+
+    return model
+
+
+def _get(obj, path, default=None):
+    for key in path:
+        if not isinstance(obj, dict) or key not in obj:
+            return default
+        obj = obj[key]
+
+    return obj
+
+
+def _set(obj, path, value):
+    # copy-on-write: returns a copy of obj with only the dicts along path copied
+    if not isinstance(obj, dict):
+        raise _invalid(_pointer(path), 'the parent of the target is not an object')
+
+    key = path[0]
+    copied = dict(obj)
+
+    if len(path) > 1:
+        copied[key] = _set(obj.get(key, MISSING), path[1:], value)
+    elif value is MISSING:
+        copied.pop(key, None)
+    else:
+        copied[key] = value
+
+    return copied
+
+
+def _pointer(path):
+    return ''.join('/%s' % ('%s' % key).replace('~', '~0').replace('/', '~1') for key in path)
+
+
+def _changes(db_obj, merged_obj, touched_paths):
+    changes = {'$set': {}, '$unset': {}}
+
+    touched = set(touched_paths)
+    for path in sorted(touched):
+        if any(path[:i] in touched for i in range(1, len(path))):
+            continue  # an enclosing path is set or unset as a whole
+
+        old_value = _get(db_obj, path, MISSING)
+        new_value = _get(merged_obj, path, MISSING)
+
+        if new_value is MISSING:
+            if old_value is not MISSING:
+                changes['$unset']['.'.join(path)] = ''
+        elif new_value != old_value:
+            changes['$set']['.'.join(path)] = new_value
+
+    return changes
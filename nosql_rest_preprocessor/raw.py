@@ -0,0 +1,198 @@
+"""Validation of raw JSON (``bytes``, ``bytearray``, ``memoryview`` or ``mmap``) without decoding it.
+
+Validation only looks at keys, so :func:`validate_raw` scans the document for the keys of every object which is
+checked (the document and its ``sub_models``) and skips over all other values without decoding them. Values are only
+materialized with ``json.loads`` if they're asked for (``decode=True``) or can't be checked from their keys alone.
+
+The scan expects well-formed JSON: it doesn't verify skipped values in detail, decode the document to find out whether
+it's valid JSON as well.
+"""
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import json
+import re
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.compiled import plan_for
+
+_STRING = br'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+# whitespace and the start of the next value: an object, an array, a string or a scalar
+_VALUE = re.compile(br'[ \t\n\r]*(?:(\{)|(\[)|(' + _STRING + br')|([^ \t\n\r,:\[\]{}"]+))', re.S)
+
+# whitespace and a key of an object up to the colon, or the end of an empty object; for the common case of a string or
+# a scalar value the value and the separator after it as well, so most members take a single match
+_MEMBER = re.compile(
+    br'[ \t\n\r]*(?:"([^"\\]*(?:\\.[^"\\]*)*)"[ \t\n\r]*:'
+    br'(?:[ \t\n\r]*(' + _STRING + br'|[^ \t\n\r,:\[\]{}"]+)[ \t\n\r]*([,}]))?|(\}))', re.S
+)
+
+# whitespace and the separator after a value in an object or an array
+_SEPARATOR = re.compile(br'[ \t\n\r]*([,\]}])')
+
+# everything (including strings) up to and including the next bracket in a skipped object or array
+_SKIP = re.compile(br'[^"\[\]{}]*(?:' + _STRING + br'[^"\[\]{}]*)*(?:([\[{])|([\]}]))', re.S)
+
+_END = re.compile(br'[ \t\n\r]*\Z')
+
+
+def validate_raw(model, data, collect_errors=False, decode=False):
+    """Validates the JSON document ``data`` like ``model.validate(json.loads(data))``, with the same errors.
+
+    Returns the decoded document if ``decode`` is true (only after it passed validation) and ``None`` otherwise. Invalid
+    documents are decoded to find all violations if ``collect_errors`` is true.
+    """
+    match = _match(_VALUE, data, 0)
+    if not match.group(1):  # not an object, checked like validate would
+        obj = _decode(data, slice(0, len(data)))
+        model.validate(obj, collect_errors)
+        return obj if decode else None
+
+    try:
+        plan = plan_for(model)
+        node, end = _scan_object(data, match.end(), plan)
+        if not _END.match(data, end):
+            raise ValueError('Extra data at offset %d' % end)
+
+        _check(plan, node, data)
+
+    except exceptions.ValidationError:
+        if not collect_errors:
+            raise
+
+        model.validate(_decode(data, slice(0, len(data))), collect_errors=True)
+        raise  # only reached if validate disagrees with the scan
+
+    return _decode(data, slice(0, len(data))) if decode else None
+
+
+def _check(plan, node, data):
+    # the same checks in the same order as BaseModel.validate, on the scanned keys
+    keys, children = node
+
+    plan.check_keys(keys)
+
+    for attr, sub_plan in plan.sub_plans:
+        if attr in children:
+            value = children[attr]
+            if isinstance(value, list):
+                for index, element in enumerate(value):
+                    _check_value(sub_plan, element, data, (attr, index))
+            else:
+                _check_value(sub_plan, value, data, (attr,))
+
+
+def _check_value(plan, value, data, path):
+    try:
+        if isinstance(value, slice):  # the position of a value which isn't an object, checked like validate would
+            plan.model.validate(_decode(data, value))
+        else:
+            _check(plan, value, data)
+    except exceptions.ValidationError as e:
+        e.prefix(*path)
+        raise
+
+
+def _scan_object(data, pos, plan):
+    # returns the keys of the object starting after '{' at pos, the scanned values of its sub models and the end
+    keys = []
+    children = {}
+    sub_plans = plan.sub_plan_index
+
+    while True:
+        match = _match(_MEMBER, data, pos)
+        raw_key, value, separator, empty = match.groups()
+        if empty:
+            if keys:
+                raise ValueError('Expecting property name at offset %d' % pos)
+            return (frozenset(keys), children), match.end()
+
+        key = json.loads(b'"' + raw_key + b'"') if b'\\' in raw_key else raw_key.decode('utf-8')
+        keys.append(key)
+
+        sub_plan = sub_plans.get(key)
+        if separator:
+            if sub_plan is not None:
+                children[key] = slice(match.start(2), match.end(2))
+            pos = match.end()
+        else:
+            if sub_plan is None:
+                pos = _skip_value(data, match.end())
+            else:
+                children[key], pos = _scan_value(data, match.end(), sub_plan)
+
+            match = _match(_SEPARATOR, data, pos)
+            pos = match.end()
+            separator = match.group(1)
+
+        if separator == b'}':
+            return (frozenset(keys), children), pos
+        elif separator != b',':
+            raise ValueError('Expecting , or } at offset %d' % (pos - 1))
+
+
+def _scan_value(data, pos, plan):
+    # a sub model: an object is scanned, a list element by element, anything else is kept as a slice of data
+    match = _match(_VALUE, data, pos)
+
+    if match.group(1):
+        return _scan_object(data, match.end(), plan)
+
+    if not match.group(2):
+        end = _skip_value(data, pos)
+        return slice(match.start(match.lastindex), end), end
+
+    elements = []
+    pos = match.end()
+
+    empty = _SEPARATOR.match(data, pos)
+    if empty and empty.group(1) == b']':
+        return elements, empty.end()
+
+    while True:
+        element = _match(_VALUE, data, pos)
+        if element.group(1):
+            node, pos = _scan_object(data, element.end(), plan)
+            elements.append(node)
+        else:
+            end = _skip_value(data, pos)
+            elements.append(slice(element.start(element.lastindex), end))
+            pos = end
+
+        separator = _match(_SEPARATOR, data, pos)
+        pos = separator.end()
+        if separator.group(1) == b']':
+            return elements, pos
+        elif separator.group(1) != b',':
+            raise ValueError('Expecting , or ] at offset %d' % separator.start(1))
+
+
+def _skip_value(data, pos):
+    match = _match(_VALUE, data, pos)
+    if not (match.group(1) or match.group(2)):
+        return match.end()  # a string or a scalar
+
+    depth = 1
+    pos = match.end()
+    while depth:
+        match = _match(_SKIP, data, pos)
+        pos = match.end()
+        if match.group(1):
+            depth += 1
+        else:
+            depth -= 1
+
+    return pos
+
+
+def _match(pattern, data, pos):
+    match = pattern.match(data, pos)
+    if match is None:
+        raise ValueError('Invalid JSON at offset %d' % pos)
+
+    return match
+
+
+def _decode(data, position):
+    raw = data[position]
+    return json.loads((raw if isinstance(raw, bytes) else bytes(raw)).decode('utf-8'))
@@ -0,0 +1,163 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import marshal
+import sys
+
+from nosql_rest_preprocessor import codegen, exceptions, instrumentation
+from nosql_rest_preprocessor.compiled import check_rules, plan_for
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.resolvers import ResolveWith
+
+# marshalled code objects can only be loaded by the Python version which dumped them
+_PYTHON = getattr(getattr(sys, 'implementation', None), 'cache_tag', None) or sys.version
+
+
+class ModelRegistry(object):
+    """The models of an application, checked once at startup instead of failing at request time.
+
+    ``models`` defaults to every subclass of ``BaseModel`` which has been defined (imported) when the registry is used.
+    With ``compile='eager'`` :meth:`setup` builds the compiled plans (and generated validators) of all models right
+    away, with ``'lazy'`` they are built on first use as usual. ``timings`` holds the seconds spent per step.
+    """
+
+    def __init__(self, models=None, compile='lazy'):
+        if compile not in ('eager', 'lazy'):
+            raise exceptions.ConfigurationError()
+
+        self._models = None if models is None else list(models)
+        self.compile_mode = compile
+        self.timings = {}
+
+    @property
+    def models(self):
+        if self._models is not None:
+            return self._models
+
+        return _subclasses(BaseModel)
+
+    def setup(self, schemas=None):
+        """Checks all models and compiles them if eager, using the compiled ``schemas`` of :meth:`dumps` if given."""
+        self.check()
+
+        if schemas is not None:
+            self.loads(schemas)
+
+        if self.compile_mode == 'eager':
+            self.compile()
+
+        return self
+
+    def problems(self):
+        """Returns a description of every configuration error of every model, empty if all of them are fine."""
+        start = instrumentation.timer()
+        problems = []
+
+        for model in self.models:
+            name = _key(model)
+
+            for declaration in ('required_attributes', 'optional_attributes'):
+                try:
+                    check_rules(declaration, getattr(model, declaration))
+                except exceptions.ConfigurationError:
+                    problems.append('%s: malformed rule in %s' % (name, declaration))
+
+            for attr, sub_model in model.sub_models.items():
+                if not _is_model(sub_model):
+                    problems.append('%s.%s: sub model %r is not a BaseModel' % (name, attr, sub_model))
+
+            for attr, attr_config in model.resolved_attributes.items():
+                resolving_model = getattr(attr_config, 'model', None) or model.sub_models.get(attr)
+
+                if not isinstance(attr_config, ResolveWith) and not callable(attr_config):
+                    problems.append('%s.%s: resolved attribute needs a ResolveWith or a function' % (name, attr))
+                elif resolving_model is None:
+                    problems.append('%s.%s: resolved attribute has neither a model nor a sub_models entry' % (name, attr))
+                elif not _is_model(resolving_model):
+                    problems.append('%s.%s: resolving model %r is not a BaseModel' % (name, attr, resolving_model))
+
+        self.timings['check'] = instrumentation.timer() - start
+        return problems
+
+    def check(self):
+        """Raises a ``ConfigurationError`` describing all problems found by :meth:`problems`."""
+        problems = self.problems()
+        if problems:
+            raise exceptions.ConfigurationError('\n'.join(problems))
+
+    def compile(self):
+        """Builds the compiled plans of all models, and their validators if ``validation_backend`` is 'generated'."""
+        start = instrumentation.timer()
+        plans = [(model, plan_for(model)) for model in self.models]
+        self.timings['plans'] = instrumentation.timer() - start
+
+        start = instrumentation.timer()
+        for model, plan in plans:
+            if model.validation_backend == 'generated':
+                codegen.compile_validator(plan)
+        self.timings['validators'] = instrumentation.timer() - start
+
+    def dumps(self):
+        """Serializes the generated validators of all models with the 'generated' backend, for :meth:`loads`.
+
+        Only load data dumped by your own application, it contains code which is executed.
+        """
+        validators = {}
+        for key, model in self._by_key().items():
+            if model.validation_backend == 'generated':
+                validators[key] = codegen.validator_code(plan_for(model))
+
+        return marshal.dumps({'python': _PYTHON, 'validators': validators})
+
+    def loads(self, data):
+        """Uses the validators of :meth:`dumps` instead of compiling them, returns the number of validators loaded.
+
+        Validators of models whose rules changed since they were dumped are ignored and compiled as usual, as are all
+        of them if ``data`` was dumped by another Python version.
+        """
+        start = instrumentation.timer()
+        loaded = 0
+
+        schemas = marshal.loads(data)
+        if schemas.get('python') == _PYTHON:
+            models = self._by_key()
+            for key, (fingerprint, code) in schemas['validators'].items():
+                model = models.get(key)
+                if model is not None and codegen.load_validator(plan_for(model), fingerprint, code):
+                    loaded += 1
+
+        self.timings['load'] = instrumentation.timer() - start
+        return loaded
+
+    def _by_key(self):
+        # models are identified across processes by module and name, ambiguous ones are left out
+        models, ambiguous = {}, set()
+        for model in self.models:
+            key = _key(model)
+            if key in models:
+                ambiguous.add(key)
+            models[key] = model
+
+        for key in ambiguous:
+            del models[key]
+
+        return models
+
+
+def _subclasses(model):
+    found, seen, pending = [], set(), [model]
+    while pending:
+        for subclass in pending.pop().__subclasses__():
+            if subclass not in seen:
+                seen.add(subclass)
+                found.append(subclass)
+                pending.append(subclass)
+
+    return found
+
+
+def _key(model):
+    return '%s.%s' % (model.__module__, getattr(model, '__qualname__', model.__name__))
+
+
+def _is_model(model):
+    return isinstance(model, type) and issubclass(model, BaseModel)
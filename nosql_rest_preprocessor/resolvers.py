@@ -1,68 +1,443 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
-from nosql_rest_preprocessor import exceptions
-from inspect import isclass
+from nosql_rest_preprocessor import exceptions, instrumentation
+from nosql_rest_preprocessor.cache import MISSING
+from nosql_rest_preprocessor.compiled import plan_for, project
+from nosql_rest_preprocessor.instrumentation import instrumented
+from nosql_rest_preprocessor.lookups import lookup_instances
+from nosql_rest_preprocessor.utils import chunked, field_tree
+
+MAX_DEPTH = 3  # don't resolve infinitely, resolve calls can go deeper with max_depth
 
 
 class ResolveWith(object):
 
     def lookup(self, key):
-        if self.lookup_class:
-            if isclass(self.lookup_class):
-                lookup_obj = self.lookup_class(**self.lookup_class_kwargs)
+        found, missing = self._from_cache([key])
+
+        if missing:
+            found = self._to_cache(missing, {key: self._lookup(key)})
+
+        return found.get(key)
+
+    def lookup_many(self, keys):
+        """Looks up all ``keys`` and returns a dict of the objects found by their key.
+
+        Uses a single call to ``batch_lookup_func`` if one was given and falls back to one lookup per key otherwise.
+        """
+        found, missing = self._from_cache(keys)
+
+        if missing:
+            if self.batch_lookup_func is None:
+                fetched = dict((key, self._lookup(key)) for key in missing)
+            else:
+                fetched = dict(self._batch_lookup(missing))
+
+            found.update(self._to_cache(missing, fetched))
+
+        return found
+
+    def invalidate(self, key):
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(key))
+
+    def close(self):
+        """Tears down the lookup_class instances kept by this resolver."""
+        self.lookup_instances.close()
+
+    def _lookup(self, key):
+        return self._call(self.lookup_func, key)
+
+    def _batch_lookup(self, keys):
+        return self._call(self.batch_lookup_func, keys)
+
+    def _call(self, func, arg):
+        if not self.lookup_class:
+            return func(arg)  # lookup directly
+
+        lookup_obj = self.lookup_instances.acquire()
+        try:
+            return func(lookup_obj, arg)  # uses the instantiated obj and its method to lookup by key
+        finally:
+            self.lookup_instances.release(lookup_obj)
+
+    def _from_cache(self, keys):
+        # returns the cached objects by key and the keys which still have to be looked up
+        if self.cache is None:
+            return {}, list(keys)
+
+        found, missing = {}, []
+        for key in keys:
+            cached = self.cache.get(self._cache_key(key))
+            if cached is MISSING:
+                missing.append(key)
             else:
-                lookup_obj = self.lookup_class
+                found[key] = cached
+
+        return found, missing
 
-            return self.lookup_func(lookup_obj, key)  # uses the instantiated obj and its method to lookup by key
-        else:
-            return self.lookup_func(key)  # lookup directly
+    def _to_cache(self, keys, fetched):
+        if self.cache is not None:
+            for key in keys:
+                self.cache.put(self._cache_key(key), fetched.get(key))
 
-    def __init__(self, lookup_func, model=None, lookup_class=None, **lookup_class_kwargs):
+        return fetched
+
+    def _cache_key(self, key):
+        return self.cache_namespace, key
+
+    def __init__(self, lookup_func, model=None, lookup_class=None, batch_lookup_func=None, cache=None,
+                 cache_namespace=None, lookup_scope='call', pool_size=4, setup=None, teardown=None, max_depth=None,
+                 max_lookups=None, lookup_class_kwargs=None, **kwargs):
         self.lookup_func = lookup_func
+        self.batch_lookup_func = batch_lookup_func  # takes a list of keys, returns a dict of found objects by key
         self.model = model
 
+        # e.g. max_depth=1 for an expensive fan-out which is only resolved on the top level object
+        self.max_depth = max_depth
+        self.max_lookups = max_lookups  # keys looked up per resolve call, the others are left unresolved
+
+        # the constructor arguments of lookup_class. Other keyword arguments are passed on as well (the old way to pass
+        # them), but can't have the name of an argument of ResolveWith
+        if lookup_class_kwargs is not None and set(lookup_class_kwargs) & set(kwargs):
+            raise exceptions.ConfigurationError('%s passed both in lookup_class_kwargs and as keyword argument' %
+                                                ', '.join(sorted(set(lookup_class_kwargs) & set(kwargs))))
+
         self.lookup_class = lookup_class
-        self.lookup_class_kwargs = lookup_class_kwargs
+        self.lookup_class_kwargs = dict(lookup_class_kwargs or {}, **kwargs)
 
+        # lookup_scope decides how long an instance of lookup_class lives: 'call', 'resolver', 'thread' or 'pool'
+        self.lookup_instances = lookup_instances(lookup_class, self.lookup_class_kwargs, lookup_scope, pool_size,
+                                                 setup, teardown)
 
-def resolve(model, obj, depth=1, fail_fast=False):
-    depth = min(depth, 3)  # don't resolve infinitely
+        # a ResolveCache can be shared between resolvers, which share entries if they use the same namespace
+        self.cache = cache
+        self.cache_namespace = self._default_namespace() if cache_namespace is None else cache_namespace
 
-    if depth <= 0:
-        return obj
+    def _default_namespace(self):
+        # the same lookup method of different lookup_class instances (e.g. one per collection) finds different objects
+        if not self.lookup_class:
+            return self.lookup_func
 
-    new_obj = {}
-    for attr, old_value in obj.items():
-        if attr in model.resolved_attributes:
+        try:
+            namespace = self.lookup_func, self.lookup_class, tuple(sorted(self.lookup_class_kwargs.items()))
+            hash(namespace)
+        except TypeError:  # unhashable or unorderable constructor arguments, share with nobody
+            return self
 
-            attr_config = model.resolved_attributes[attr]  # config for attribute
+        return namespace
 
-            if isinstance(attr_config, ResolveWith):
-                resolved_obj = attr_config.lookup(old_value)
-            else:
-                resolved_obj = attr_config(old_value)  # in case a function was passed directly
 
-            if not resolved_obj:
-                if fail_fast:
-                    raise exceptions.ResolvedObjectNotFound(message='Could not find object with id %s for attribute %s' % (old_value, attr))
+@instrumented('resolve')
+def resolve(model, obj, depth=1, fail_fast=False, fields=None, identity_map=None, budget=None, max_depth=MAX_DEPTH):
+    return _resolve_many(model, [obj], depth, fail_fast, fields, identity_map, budget, max_depth)[0]
+
+
+@instrumented('resolve_many')
+def resolve_many(model, objs, depth=1, fail_fast=False, fields=None, identity_map=None, budget=None,
+                 max_depth=MAX_DEPTH):
+    """Resolves a list of objects like :func:`resolve`, but level by level.
+
+    All keys of a resolved attribute are collected across ``objs`` at each depth level, de-duplicated and looked up
+    with a single ``ResolveWith.lookup_many`` call.
+
+    Like with :func:`resolve`, the objects and every resolved object are shallow copies: nested values are shared with
+    ``objs``, with the objects returned by the lookups and with other objects which resolved the same key.
+    """
+    return _resolve_many(model, objs, depth, fail_fast, fields, identity_map, budget, max_depth)
+
+
+def _resolve_many(model, objs, depth, fail_fast, fields, identity_map, budget, max_depth, lookup_many=None):
+    # lookup_many(attr_config, keys) answers the lookups instead of the attribute configs, e.g. from a bulk lookups file
+    resolved_objs = _copies(objs, fields)
+
+    if min(depth, max_depth) > 0:
+        resolution = _resolution(model, resolved_objs, depth, fail_fast, fields, identity_map, budget, max_depth)
+        _run_lookups(resolution, lookup_many or _lookup_many)
+
+    return resolved_objs
+
+
+def _copies(objs, fields):
+    # the objects to resolve in place, only with the requested fields if there is a projection
+    fields = field_tree(fields)
+    if fields is None:
+        return [dict(obj) for obj in objs]
+    else:
+        return [project(None, obj, fields) for obj in objs]
+
+
+def resolve_stream(model, objs, depth=1, fail_fast=False, chunk_size=100, errors=None, fields=None,
+                   identity_map=None, budget=None, max_depth=MAX_DEPTH):
+    """Lazily resolves an iterable or cursor of objects, ``chunk_size`` objects at a time with :func:`resolve_many`.
+
+    If a list is passed as ``errors``, objects which can't be resolved are skipped and ``(index, obj, exception)`` is
+    appended to it instead of aborting the stream.
+    """
+    fields = field_tree(fields)
+
+    offset = 0
+    for chunk in chunked(objs, chunk_size):
+        try:
+            resolved_objs = resolve_many(model, chunk, depth, fail_fast, fields, identity_map, budget, max_depth)
+        except Exception:
+            if errors is None:
+                raise
+
+            # find the failing objects by resolving the chunk one by one
+            resolved_objs = []
+            for index, obj in enumerate(chunk, offset):
+                try:
+                    resolved_objs.append(resolve(model, obj, depth, fail_fast, fields, identity_map, budget, max_depth))
+                except Exception as e:
+                    errors.append((index, obj, e))
+
+        for resolved_obj in resolved_objs:
+            yield resolved_obj
+
+        offset += len(chunk)
+
+
+class IdentityMap(object):
+    """Request-scoped map of everything looked up while resolving, shared by all depth levels and attributes.
+
+    Pass the same instance to several ``resolve`` calls of one request, so each key of a lookup function (or of a
+    ``ResolveWith.cache_namespace``) is looked up at most once. Unlike a ``ResolveCache`` it never expires and is meant
+    to be thrown away with the request. ``cycles`` lists the ``(lookup, key)`` references which were left unresolved
+    because they pointed back to one of their own parents. ``unresolved`` lists the ``(model, attribute, key, reason)``
+    of every id which was left unresolved because a :class:`ResolveBudget` or ``ResolveWith.max_lookups`` was spent.
+    """
+
+    def __init__(self):
+        self.objs = {}
+        self.cycles = []
+        self.unresolved = []
+
+    def __contains__(self, identity):
+        return identity in self.objs
+
+    def __len__(self):
+        return len(self.objs)
+
+
+class ResolveBudget(object):
+    """Limits what a request may spend on resolving, shared by every ``resolve`` call it is passed to.
+
+    ``timeout`` (seconds, counted from the creation of the budget) is checked before every depth level, a lookup which
+    is already running is not interrupted. ``max_lookups`` limits the number of keys passed to lookup functions. Once
+    the budget is spent, the remaining ids are left unresolved and ``(model, attribute, key, reason)`` is appended to
+    ``unresolved``, where reason is ``'timeout'`` or ``'max_lookups'``.
+    """
+
+    def __init__(self, timeout=None, max_lookups=None, clock=None):
+        self.clock = clock or instrumentation.timer
+        self.deadline = None if timeout is None else self.clock() + timeout
+        self.max_lookups = max_lookups
+        self.lookups = 0
+        self.unresolved = []
+
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def exhausted(self):
+        return self.max_lookups is not None and self.lookups >= self.max_lookups
+
+
+def _resolution(model, objs, depth, fail_fast, fields=None, identity_map=None, budget=None, max_depth=MAX_DEPTH):
+    # Resolves objs in place, one depth level at a time. Yields the keys to look up per attribute config and expects
+    # the found objects per attribute config and key to be sent back, so the lookups can be done by any driver.
+    depth = min(depth, max_depth)
+    identity_map = IdentityMap() if identity_map is None else identity_map
+    known = identity_map.objs
+
+    skipped = {}  # (lookup, key) which were not looked up because a budget was spent, with the reason
+    attr_lookups = {}  # keys looked up per attribute config, for ResolveWith.max_lookups
+
+    # every object carries the (lookup, key) references of its parents as a chain, to stop at reference cycles
+    plan, fields = plan_for(model), field_tree(fields)
+    level = [(plan, obj, fields, None) for obj in objs]
+    level_depth = 1
+
+    while level and depth > 0:
+        requests = {}
+        reserved = set()  # (lookup, key) requested on this level, only known once the lookups have succeeded
+        pending = []
+        configs = {}  # per attribute config: lookup identity, whether it's resolved on this level and has a limit
+
+        expired = budget is not None and budget.expired()
+        limited = budget is not None and (expired or budget.max_lookups is not None)
+
+        for plan, obj, obj_fields, parents in level:
+            if plan.has_resolved:
+                for attr, attr_config, resolving_model in plan.resolved:
+                    if attr in obj:  # unrequested attributes have been projected away already
+                        config = configs.get(attr_config)
+                        if config is None:
+                            config = configs[attr_config] = _level_config(attr_config, level_depth, limited)
+
+                        lookup, resolved_on_level, attr_limited = config
+                        if not resolved_on_level:
+                            continue
+
+                        keys = _keys(obj[attr])
+                        for key in keys:
+                            if (lookup, key) in known or (lookup, key) in reserved or (lookup, key) in skipped:
+                                continue
+
+                            if attr_limited:
+                                reason = _spent(attr_config, budget, attr_lookups, expired)
+                                if reason:
+                                    skipped[lookup, key] = reason
+                                    continue
+                                attr_lookups[attr_config] = attr_lookups.get(attr_config, 0) + 1
+                                if limited:
+                                    budget.lookups += 1
+
+                            reserved.add((lookup, key))
+                            requests.setdefault(attr_config, []).append(key)
+
+                        attr_fields = None if obj_fields is None or obj_fields[attr] is True else obj_fields[attr]
+                        pending.append((plan, obj, attr, keys, lookup, resolving_model, attr_fields, parents))
+
+        if not pending:
+            break
+
+        if budget is not None and not limited:
+            budget.lookups += sum(len(keys) for keys in requests.values())
+
+        if requests:
+            found = yield requests
+            for attr_config, keys in requests.items():
+                lookup, found_objs = configs[attr_config][0], found[attr_config]
+                for key in keys:
+                    known[lookup, key] = found_objs.get(key)
+
+        if instrumentation.enabled():
+            _emit_lookups(pending, known, level_depth)
+
+        next_level = []
+        plans = {}
+        for plan, obj, attr, keys, lookup, resolving_model, attr_fields, parents in pending:
+            resolved_values = []
+            for key in keys:
+                if skipped and (lookup, key) in skipped:
+                    unresolved = (plan.model, attr, key, skipped[lookup, key])
+                    identity_map.unresolved.append(unresolved)
+                    if budget is not None:
+                        budget.unresolved.append(unresolved)
+                    resolved_values.append(key)  # degrade instead of spending more than the budget
+                    continue
+
+                resolved_obj = known[lookup, key]
+
+                if not resolved_obj:
+                    if fail_fast:
+                        raise exceptions.ResolvedObjectNotFound(message='Could not find object with id %s for attribute %s' % (key, attr))
+                    else:
+                        resolved_values.append(key)  # leave id unresolved and go on
+                        continue
+
+                if parents is not None and _is_parent(parents, lookup, key):
+                    identity_map.cycles.append((lookup, key))
+                    resolved_values.append(key)  # reference back to a parent, leave it unresolved
+                    continue
+
+                if resolving_model is None:
+                    raise exceptions.ConfigurationError('No model to resolve %s.%s with' % (plan.model.__name__, attr))
+
+                resolving_plan = plans.get(resolving_model)
+                if resolving_plan is None:
+                    resolving_plan = plans[resolving_model] = plan_for(resolving_model)
+
+                # remove private attributes, copy so the next level can be resolved without touching the looked up object.
+                # The next level only assigns top level attributes, nested values stay shared (see resolve_many)
+                if attr_fields is None:
+                    resolved_obj = dict(resolving_plan.prepare(resolved_obj))
                 else:
-                    new_obj[attr] = old_value
-                    continue  # leave id unresolved and go on
+                    resolved_obj = project(resolving_plan, resolved_obj, attr_fields)
+
+                # resolveception
+                next_level.append((resolving_plan, resolved_obj, attr_fields, (lookup, key, parents)))
+                resolved_values.append(resolved_obj)
+
+            # save resolved attribute, lists of ids keep their order
+            obj[attr] = resolved_values if isinstance(keys, list) else resolved_values[0]
+
+        level = next_level
+        depth -= 1
+        level_depth += 1
+
+
+def _level_config(attr_config, level_depth, limited):
+    attr_max_depth = getattr(attr_config, 'max_depth', None)
+    resolved_on_level = attr_max_depth is None or level_depth <= attr_max_depth
+    attr_limited = limited or getattr(attr_config, 'max_lookups', None) is not None
+
+    return _lookup_identity(attr_config), resolved_on_level, attr_limited
+
+
+def _is_parent(parents, lookup, key):
+    while parents is not None:
+        parent_lookup, parent_key, parents = parents
+        if parent_key == key and parent_lookup == lookup:
+            return True
+
+    return False
+
+
+def _spent(attr_config, budget, attr_lookups, expired):
+    # the reason why no more keys may be looked up, None while there is budget left
+    if expired:
+        return 'timeout'
+
+    attr_max_lookups = getattr(attr_config, 'max_lookups', None)
+    if (budget is not None and budget.exhausted()) or (attr_max_lookups is not None and attr_lookups.get(attr_config, 0) >= attr_max_lookups):
+        return 'max_lookups'
+
+    return None
+
+
+def _lookup_identity(attr_config):
+    # resolvers with the same cache namespace share the objects they looked up. By default that's the lookup function,
+    # with its lookup_class and constructor arguments if it has one, see ResolveWith._default_namespace
+    return attr_config.cache_namespace if isinstance(attr_config, ResolveWith) else attr_config
+
+
+def _keys(value):
+    return value if isinstance(value, list) else (value,)
+
+
+def _run_lookups(resolution, lookup_many):
+    try:
+        requests = next(resolution)
+        while True:
+            requests = resolution.send(dict(
+                (attr_config, lookup_many(attr_config, keys)) for attr_config, keys in requests.items()
+            ))
+    except StopIteration:
+        pass
 
-            try:
-                resolving_model = attr_config.model
-            except AttributeError:
-                resolving_model = model.sub_models[attr]
 
-            # remove private attributes
-            resolved_obj = resolving_model.prepare_response(resolved_obj)
+def _lookup_many(attr_config, keys):
+    if isinstance(attr_config, ResolveWith):
+        return attr_config.lookup_many(keys)
+    else:
+        return dict((key, attr_config(key)) for key in keys)  # in case a function was passed directly
 
-            # resolveception
-            resolved_obj = resolve(resolving_model, resolved_obj, depth - 1)
 
-            # save resolved attribute
-            new_obj[attr] = resolved_obj
-        else:
-            new_obj[attr] = old_value
+def _emit_lookups(pending, known, level_depth):
+    counts = {}
+    for plan, obj, attr, keys, lookup, resolving_model, attr_fields, parents in pending:
+        hits_and_misses = counts.setdefault((plan.model, attr), [0, 0])
+        for key in keys:
+            hits_and_misses[0 if known.get((lookup, key)) else 1] += 1
 
-    return new_obj
\ No newline at end of file
+    for (level_model, attr), (hits, misses) in counts.items():
+        instrumentation.emit({
+            'operation': 'lookup',
+            'model': level_model.__name__,
+            'attribute': attr,
+            'depth': level_depth,
+            'hits': hits,
+            'misses': misses
+        })
@@ -12,6 +12,79 @@ def map_if_list(func, potential_list):
         return func(potential_list)
 
 
+def chunked(iterable, size):
+    """Lazily splits any iterable into lists of at most ``size`` items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def map_stream(func, iterable, errors=None):
+    """Lazily applies ``func`` to every item of ``iterable``.
+
+    If a list is passed as ``errors``, items for which ``func`` raises are skipped and ``(index, item, exception)`` is
+    appended to it instead of aborting the stream.
+    """
+    for index, item in enumerate(iterable):
+        if errors is None:
+            yield func(item)
+            continue
+
+        try:
+            result = func(item)
+        except Exception as e:
+            errors.append((index, item, e))
+        else:
+            yield result
+
+
+def without_failures(objs, failures, errors=None):
+    """Returns the objects of the list ``objs`` which did not fail, in input order.
+
+    ``failures`` lists ``(index, exception)`` of the failed objects in input order. If a list is passed as ``errors``,
+    ``(index, obj, exception)`` is appended to it for every failed object, otherwise the first exception is raised.
+    """
+    if not failures:
+        return objs
+
+    if errors is None:
+        raise failures[0][1]
+
+    errors.extend((index, objs[index], e) for index, e in failures)
+    failed = set(index for index, e in failures)
+
+    return [obj for index, obj in enumerate(objs) if index not in failed]
+
+
+def field_tree(fields):
+    """Turns dotted field paths like ``['name', 'address.city']`` into ``{'name': True, 'address': {'city': True}}``.
+
+    ``None`` (all fields) and trees which are already parsed are returned as they are.
+    """
+    if fields is None or isinstance(fields, dict):
+        return fields
+
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split('.')
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break  # a parent is already requested as a whole
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+
+    return tree
+
+
 def non_mutating(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -23,6 +96,11 @@ def non_mutating(f):
     return wrapper
 
 
+def with_metaclass(meta, base=object):
+    # class syntax for metaclasses differs between Python 2 and 3
+    return meta(str('%sBase' % meta.__name__), (base,), {})
+
+
 def all_of(*attributes):
     return 'all_of', attributes
 
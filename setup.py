@@ -17,5 +17,8 @@ setup(
   keywords = ['nosql', 'rest', 'web', 'middleware'],
   classifiers = [],
   license = 'MIT',
-  install_requires = []
+  install_requires = [],
+  entry_points = {
+    'console_scripts': ['nosql-bulk = nosql_rest_preprocessor.bulk:main']
+  }
 )
\ No newline at end of file
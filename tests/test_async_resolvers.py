@@ -0,0 +1,151 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import asyncio
+
+from nosql_rest_preprocessor.async_resolvers import async_resolve, async_resolve_many
+from nosql_rest_preprocessor.resolvers import resolve, ResolveWith
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor import exceptions
+from pytest import raises
+
+
+class AsyncFakeStore(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def find(self, key):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        await asyncio.sleep(0.001)
+
+        self.in_flight -= 1
+        return self.docs.get(key)
+
+    async def find_many(self, keys):
+        self.calls += 1
+        await asyncio.sleep(0.001)
+        return dict((key, self.docs[key]) for key in keys if key in self.docs)
+
+
+docs = {
+    'address_1': {'street': 'Bakerstreet', 'city': 'London', 'plz': '12345', 'openWifi': 'nopassword'},
+    'address_2': {'street': 'Brook St', 'city': 'London', 'plz': '98765'},
+    'company_1': {'name': 'Continental', 'address': 'address_2'},
+}
+
+
+def make_models(store, batched=False):
+    batch_lookup_func = store.find_many if batched else None
+
+    class AddressModel(BaseModel):
+        private_attributes = {'openWifi'}
+
+    class CompanyModel(BaseModel):
+        resolved_attributes = {
+            'address': ResolveWith(store.find, model=AddressModel, batch_lookup_func=batch_lookup_func)
+        }
+
+    class PersonModel(BaseModel):
+        resolved_attributes = {
+            'address': ResolveWith(store.find, model=AddressModel, batch_lookup_func=batch_lookup_func),
+            'company': ResolveWith(store.find, model=CompanyModel, batch_lookup_func=batch_lookup_func)
+        }
+
+    return PersonModel
+
+
+class SyncFakeStore(object):
+    find_many = None
+
+    @staticmethod
+    def find(key):
+        return docs.get(key)
+
+
+people = [
+    {'name': 'Person %d' % i, 'address': 'address_%d' % (i % 3), 'company': 'company_1'} for i in range(12)
+]
+
+
+# noinspection PyMethodMayBeStatic
+class TestAsyncResolve(object):
+
+    def test_same_result_as_resolve(self):
+        model = make_models(AsyncFakeStore(docs))
+
+        for depth in range(4):
+            expected = [resolve(make_models(SyncFakeStore()), person, depth=depth) for person in people]
+            assert asyncio.run(async_resolve_many(model, people, depth=depth)) == expected
+            assert asyncio.run(async_resolve(model, people[1], depth=depth)) == expected[1]
+
+    def test_private_attributes_are_removed(self):
+        resolved_obj = asyncio.run(async_resolve(make_models(AsyncFakeStore(docs)), people[1], depth=2))
+        assert resolved_obj['address'] == {'street': 'Bakerstreet', 'city': 'London', 'plz': '12345'}
+
+    def test_lookups_run_concurrently(self):
+        store = AsyncFakeStore(docs)
+        asyncio.run(async_resolve_many(make_models(store), people))
+
+        assert store.calls == 4  # address_0, address_1, address_2 and company_1
+        assert store.max_in_flight == 4
+
+    def test_concurrency_limit(self):
+        store = AsyncFakeStore(docs)
+        asyncio.run(async_resolve_many(make_models(store), people, concurrency=2))
+
+        assert store.max_in_flight == 2
+
+    def test_batch_lookups(self):
+        store = AsyncFakeStore(docs)
+        resolved_objs = asyncio.run(async_resolve_many(make_models(store, batched=True), people, depth=2))
+
+        assert store.calls == 2  # address and company, company.address has been looked up with address already
+        assert resolved_objs[2]['company']['address']['plz'] == '98765'
+
+    def test_depth_is_capped(self):
+        store = AsyncFakeStore(docs)
+        asyncio.run(async_resolve_many(make_models(store), people, depth=0))
+
+        assert store.calls == 0
+
+    def test_failing_fast(self):
+        model = make_models(AsyncFakeStore(docs))
+
+        resolved_obj = asyncio.run(async_resolve(model, people[0]))
+        assert resolved_obj['address'] == 'address_0'
+
+        with raises(exceptions.ResolvedObjectNotFound):
+            asyncio.run(async_resolve(model, people[0], fail_fast=True))
+
+    def test_lookup_instance_pool(self):
+        class AsyncConnection(object):
+            created = []
+            in_use = set()
+
+            def __init__(self):
+                AsyncConnection.created.append(self)
+
+            async def find(self, key):
+                assert self not in AsyncConnection.in_use
+                AsyncConnection.in_use.add(self)
+                await asyncio.sleep(0.001)
+                AsyncConnection.in_use.discard(self)
+                return {'street': key}
+
+        class PooledModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(AsyncConnection.find, lookup_class=AsyncConnection, lookup_scope='pool',
+                                       pool_size=2, model=BaseModel)
+            }
+
+        objs = [{'address': 'street %d' % i} for i in range(10)]
+        resolved_objs = asyncio.run(asyncio.wait_for(async_resolve_many(PooledModel, objs), timeout=5))
+
+        assert [obj['address'] for obj in resolved_objs] == [{'street': 'street %d' % i} for i in range(10)]
+        assert len(AsyncConnection.created) == 2
@@ -0,0 +1,95 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import random
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.compiled import ModelPlan
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import either_of
+from pytest import raises
+
+from tests.test_codegen import KEYS, random_document, random_model
+from tests.test_raw import noisy
+
+
+class AddressModel(BaseModel):
+    required_attributes = {'street', 'city'}
+
+
+class UserModel(BaseModel):
+    required_attributes = {'name', either_of('email', 'phone')}
+    optional_attributes = {'addresses', 'age'}
+    sub_models = {'addresses': AddressModel}
+
+
+def outcome(model, obj):
+    try:
+        model.validate(obj)
+    except exceptions.ValidationError as e:
+        return 'invalid', e.errors, '%s' % e
+    except Exception as e:
+        return 'error', type(e)
+
+    return None
+
+
+def assert_same_outcomes(model, objs):
+    errors = []
+    valid = model.validate_batch(objs, errors)
+
+    outcomes = [None] * len(objs)
+    for index, obj, e in errors:
+        if isinstance(e, exceptions.ValidationError):
+            outcomes[index] = 'invalid', e.errors, '%s' % e
+        else:
+            outcomes[index] = 'error', type(e)
+
+    assert outcomes == [outcome(model, obj) for obj in objs]
+    assert valid == [obj for obj, result in zip(objs, outcomes) if result is None]
+
+
+# noinspection PyMethodMayBeStatic
+class TestValidateBatch(object):
+
+    def test_same_outcome_as_validate(self):
+        rng = random.Random(3)
+        for model_index in range(40):
+            model = random_model(rng, 'BatchModel%d' % model_index, depth=3)
+
+            # a few shapes repeated many times, like the rows of a bulk payload
+            shapes = [noisy(rng, random_document(rng, model)) for _ in range(20)]
+            assert_same_outcomes(model, [dict(rng.choice(shapes)) for _ in range(300)])
+
+    def test_many_shapes(self):
+        rng = random.Random(5)
+        wide_keys = KEYS + ['extra%d' % i for i in range(200)]
+        for model_index in range(20):
+            model = random_model(rng, 'WideModel%d' % model_index, depth=1)
+
+            objs = [dict((key, 1) for key in rng.sample(wide_keys, rng.randint(0, 12))) for _ in range(500)]
+            objs += [dict((key, 1) for key in rng.sample(KEYS, rng.randint(0, len(KEYS)))) for _ in range(500)]
+            objs += [dict(reversed(list(obj.items()))) for obj in objs[-100:]]  # the same keys in another order
+            assert_same_outcomes(model, objs)
+
+    def test_first_error_is_raised(self):
+        objs = [{'name': 'Sepp', 'phone': 1}, {'name': 'Hans', 'phone': 1, 'addresses': [{'street': 'x'}]}, {}]
+
+        with raises(exceptions.ValidationError) as e:
+            UserModel.validate_batch(objs)
+        assert e.value.errors == [exceptions.Violation('required', ['city'], path=('addresses', 0))]
+
+    def test_key_sets_are_checked_once(self, monkeypatch):
+        calls = []
+        check_required = ModelPlan.check_required
+        monkeypatch.setattr(ModelPlan, 'check_required', lambda plan, keys: calls.append(plan.model) or check_required(plan, keys))
+
+        objs = [
+            {'name': 'user %d' % i, 'email': 'x', 'addresses': [{'street': 'x', 'city': 'y'}] * (i % 3)}
+            for i in range(1000)
+        ]
+        objs[500] = {'name': 'no email'}
+
+        errors = []
+        assert len(UserModel.validate_batch(objs, errors)) == 999
+        assert [index for index, obj, e in errors] == [500]
+        assert calls.count(UserModel) == 2 and calls.count(AddressModel) == 1
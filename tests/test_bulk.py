@@ -0,0 +1,131 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import io
+import json
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.bulk import BulkProcessor, load_model, main, process
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.resolvers import ResolveWith
+from pytest import raises
+
+
+def find_company(key):
+    raise AssertionError('the bulk processor looks up in the lookups file instead')
+
+
+class CompanyModel(BaseModel):
+    required_attributes = {'name'}
+    private_attributes = {'revenue'}
+
+
+class UserModel(BaseModel):
+    required_attributes = {'name'}
+    private_attributes = {'password'}
+    resolved_attributes = {'company': ResolveWith(find_company, model=CompanyModel)}
+
+
+def write_lines(tmpdir, lines):
+    path = tmpdir.join('users.ndjson')
+    path.write_binary(b''.join(line + b'\n' for line in lines))
+    return str(path)
+
+
+def user(index):
+    return {'name': 'user %d' % index, 'password': 'secret', 'company': index % 3}
+
+
+def run(path, processor, **kwargs):
+    output, errors = io.BytesIO(), io.StringIO()
+    lines, failed, size = process(processor, path, output, errors, **kwargs)
+
+    return (
+        [json.loads(line.decode('utf-8')) for line in output.getvalue().splitlines()],
+        [json.loads(line) for line in errors.getvalue().splitlines()],
+        lines
+    )
+
+
+# noinspection PyMethodMayBeStatic
+class TestBulkProcessor(object):
+
+    def test_validate(self, tmpdir):
+        path = write_lines(tmpdir, [json.dumps(user(0)).encode('utf-8'), b'{"password": "x"}', b'', b'{"name": '])
+
+        for raw in (False, True):
+            output, errors, lines = run(path, BulkProcessor(UserModel, raw=raw), workers=1)
+
+            assert output == [user(0)]  # copied as it is
+            assert [error['line'] for error in errors] == [2, 4]
+            assert errors[0]['error'] == 'ValidationError'
+            assert errors[0]['message'] == '<root>: missing required attributes name'
+            assert lines == 4
+
+    def test_prepare_response(self, tmpdir):
+        path = write_lines(tmpdir, [json.dumps(user(index)).encode('utf-8') for index in range(3)])
+
+        output, errors, lines = run(path, BulkProcessor(UserModel, 'prepare_response'), workers=1)
+        assert output == [{'name': 'user %d' % index, 'company': index % 3} for index in range(3)]
+        assert errors == []
+
+    def test_resolve(self, tmpdir):
+        path = write_lines(tmpdir, [json.dumps(user(index)).encode('utf-8') for index in range(4)] + [b'[}'])
+        lookups = {'company': {'0': {'name': 'ACME', 'revenue': 1}, '1': {'name': 'Initech', 'revenue': 2}}}
+
+        output, errors, lines = run(path, BulkProcessor(UserModel, 'resolve', lookups), workers=1)
+        assert [obj['company'] for obj in output] == [{'name': 'ACME'}, {'name': 'Initech'}, 2, {'name': 'ACME'}]
+        assert all('password' not in obj for obj in output)
+        assert [error['line'] for error in errors] == [5]
+
+    def test_chunks_and_workers(self, tmpdir):
+        docs = [user(index) if index % 7 else {'password': index} for index in range(500)]
+        path = write_lines(tmpdir, [json.dumps(doc).encode('utf-8') for doc in docs])
+
+        expected = run(path, BulkProcessor(UserModel), workers=1)
+        assert len(expected[1]) == 72
+
+        for workers, chunk_size in [(1, 100), (2, 1), (3, 1000)]:
+            assert run(path, BulkProcessor(UserModel), workers=workers, chunk_size=chunk_size) == expected
+
+    def test_unknown_operation(self):
+        with raises(exceptions.ConfigurationError):
+            BulkProcessor(UserModel, 'delete')
+
+        with raises(exceptions.ConfigurationError):
+            BulkProcessor(UserModel, 'prepare_response', raw=True)
+
+
+# noinspection PyMethodMayBeStatic
+class TestMain(object):
+
+    def test_main(self, tmpdir, capsys):
+        path = write_lines(tmpdir, [json.dumps(user(index)).encode('utf-8') for index in range(3)])
+        lookups = tmpdir.join('lookups.json')
+        lookups.write(json.dumps({'company': {'1': {'name': 'Initech'}}}))
+
+        assert main(['tests.test_bulk:UserModel', path, '--operation', 'resolve', '--lookups', str(lookups)]) == 0
+        assert '3 lines, 0 failed' in capsys.readouterr().err
+
+        output = [json.loads(line) for line in tmpdir.join('users.ndjson.out').readlines()]
+        assert [obj['company'] for obj in output] == [0, {'name': 'Initech'}, 2]
+        assert tmpdir.join('users.ndjson.errors').read() == ''
+
+        path = write_lines(tmpdir, [b'{"name": "valid"}', b'{"password": "invalid"}'])
+        errors = str(tmpdir.join('report.ndjson'))
+        assert main(['tests.test_bulk.UserModel', path, '--errors', errors, '--workers', '2', '--chunk-size', '1']) == 1
+        assert len(io.open(errors).readlines()) == 1
+
+    def test_raw_needs_validate(self, tmpdir, capsys):
+        path = write_lines(tmpdir, [b'{"name": "valid"}'])
+
+        with raises(SystemExit):
+            main(['tests.test_bulk.UserModel', path, '--operation', 'resolve', '--raw'])
+        assert 'raw' in capsys.readouterr().err
+        assert not tmpdir.join('users.ndjson.out').check()
+
+    def test_load_model(self):
+        assert load_model('tests.test_bulk.UserModel') is UserModel
+
+        for path in ('tests.test_bulk.NoModel', 'tests.no_module.UserModel', 'tests.test_bulk.user', 'UserModel'):
+            with raises(exceptions.ConfigurationError):
+                load_model(path)
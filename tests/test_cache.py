@@ -0,0 +1,313 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import threading
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.cache import ResolveCache, VerdictCache, MISSING
+from nosql_rest_preprocessor.compiled import ModelPlan, plan_for
+from nosql_rest_preprocessor.resolvers import resolve, resolve_many, ResolveWith
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import either_of
+from pytest import raises
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStore(object):
+
+    def __init__(self):
+        self.docs = {
+            'address_1': {'street': 'Bakerstreet', 'city': 'London', 'tags': ['a']},
+            'address_2': {'street': 'Brook St', 'city': 'London', 'tags': ['b']}
+        }
+        self.calls = []
+
+    def find(self, key):
+        self.calls.append(key)
+        return self.docs.get(key)
+
+    def find_many(self, keys):
+        self.calls.append(sorted(keys))
+        return dict((key, self.docs[key]) for key in keys if key in self.docs)
+
+
+class AddressModel(BaseModel):
+    pass
+
+
+# noinspection PyMethodMayBeStatic
+class TestResolveCache(object):
+
+    def test_get_and_put(self):
+        cache = ResolveCache()
+        assert cache.get('A') is MISSING
+
+        cache.put('A', {'B': 'something'})
+        assert cache.get('A') == {'B': 'something'}
+        assert cache.stats == {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0}
+
+    def test_lru_eviction(self):
+        cache = ResolveCache(max_size=2)
+        cache.put('A', {'A': 1})
+        cache.put('B', {'B': 1})
+        cache.get('A')  # B is now the least recently used entry
+        cache.put('C', {'C': 1})
+
+        assert cache.get('B') is MISSING
+        assert cache.get('A') == {'A': 1}
+        assert cache.get('C') == {'C': 1}
+        assert cache.evictions == 1
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = ResolveCache(ttl=10, negative_ttl=1, clock=clock)
+        cache.put('A', {'A': 1})
+        cache.put('B', None)
+
+        clock.now = 5
+        assert cache.get('A') == {'A': 1}
+        assert cache.get('B') is MISSING  # negative entries expire earlier
+
+        clock.now = 10
+        assert cache.get('A') is MISSING
+        assert cache.expirations == 2
+        assert len(cache) == 0
+
+    def test_negative_caching(self):
+        cache = ResolveCache()
+        cache.put('A', None)
+        assert cache.get('A') is None
+
+        cache = ResolveCache(cache_misses=False)
+        cache.put('A', None)
+        assert cache.get('A') is MISSING
+
+    def test_entries_are_copied(self):
+        cache = ResolveCache()
+        obj = {'A': ['something']}
+        cache.put('A', obj)
+
+        obj['A'].append('else')
+        cached = cache.get('A')
+        assert cached == {'A': ['something']}
+
+        cached['A'].append('else')
+        assert cache.get('A') == {'A': ['something']}
+
+    def test_invalidate(self):
+        cache = ResolveCache()
+        cache.put('A', {'A': 1})
+        cache.put('B', {'B': 1})
+
+        cache.invalidate('A')
+        assert cache.get('A') is MISSING
+        assert cache.get('B') == {'B': 1}
+
+        cache.clear()
+        assert len(cache) == 0
+
+
+# noinspection PyMethodMayBeStatic
+class TestCachedResolving(object):
+
+    def test_lookups_are_cached(self):
+        store, cache = FakeStore(), ResolveCache()
+
+        class PersonModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(store.find, model=AddressModel, cache=cache)
+            }
+
+        for i in range(3):
+            resolve(PersonModel, {'address': 'address_1'})
+            resolve(PersonModel, {'address': 'unknown'})
+
+        assert store.calls == ['address_1', 'unknown']
+        assert cache.hits == 4
+
+        PersonModel.resolved_attributes['address'].invalidate('address_1')
+        resolve(PersonModel, {'address': 'address_1'})
+        assert store.calls == ['address_1', 'unknown', 'address_1']
+
+    def test_batch_lookups_only_fetch_uncached_keys(self):
+        store, cache = FakeStore(), ResolveCache()
+
+        class PersonModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(store.find, model=AddressModel, batch_lookup_func=store.find_many, cache=cache)
+            }
+
+        resolve(PersonModel, {'address': 'address_1'})
+        resolved_objs = resolve_many(PersonModel, [{'address': 'address_1'}, {'address': 'address_2'}])
+
+        assert store.calls == [['address_1'], ['address_2']]
+        assert [obj['address']['street'] for obj in resolved_objs] == ['Bakerstreet', 'Brook St']
+
+    def test_shared_cache(self):
+        store, cache = FakeStore(), ResolveCache()
+
+        class PersonModel(BaseModel):
+            resolved_attributes = {
+                'home': ResolveWith(store.find, model=AddressModel, cache=cache),
+                'work': ResolveWith(store.find, model=AddressModel, cache=cache),
+                'other': ResolveWith(store.find, model=AddressModel, cache=cache, cache_namespace='other')
+            }
+
+        resolve(PersonModel, {'home': 'address_1'})
+        resolve(PersonModel, {'work': 'address_1', 'other': 'address_1'})
+
+        assert store.calls == ['address_1', 'address_1']  # 'other' uses its own namespace
+
+    def test_lookup_classes_do_not_share_entries(self):
+        cache = ResolveCache()
+
+        class Collection(object):
+            docs = {'users': {1: {'name': 'user1'}}, 'companies': {1: {'name': 'company1'}}}
+
+            def __init__(self, name):
+                self.name = name
+
+            def find(self, key):
+                return self.docs[self.name].get(key)
+
+        users = ResolveWith(Collection.find, lookup_class=Collection, cache=cache, name='users')
+        companies = ResolveWith(Collection.find, lookup_class=Collection, cache=cache, name='companies')
+
+        assert users.lookup(1) == {'name': 'user1'}
+        assert companies.lookup(1) == {'name': 'company1'}
+        assert cache.stats['misses'] == 2
+
+        # the same collection does share, unless the resolvers are told otherwise
+        assert ResolveWith(Collection.find, lookup_class=Collection, cache=cache, name='users').lookup(1) == {'name': 'user1'}
+        assert cache.stats['hits'] == 1
+
+    def test_resolved_objects_cannot_change_the_cache(self):
+        store, cache = FakeStore(), ResolveCache()
+
+        class PersonModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(store.find, model=AddressModel, cache=cache)
+            }
+
+        resolved_obj = resolve(PersonModel, {'address': 'address_1'})
+        resolved_obj['address']['tags'].append('changed')
+
+        assert resolve(PersonModel, {'address': 'address_1'})['address']['tags'] == ['a']
+
+
+class CachedUserModel(BaseModel):
+    required_attributes = {'name', either_of('email', 'phone')}
+    optional_attributes = {'address', 'age'}
+    sub_models = {'address': AddressModel}
+    verdict_cache_size = 2
+
+
+# noinspection PyMethodMayBeStatic
+class TestVerdictCache(object):
+
+    def test_lru(self):
+        cache = VerdictCache(max_size=2)
+        cache.put(frozenset('a'), None)
+        cache.put(frozenset('b'), ('required', frozenset('c')))
+
+        assert cache.get(frozenset('a')) is None  # a is now the most recently used
+        cache.put(frozenset('c'), None)
+
+        assert cache.get(frozenset('b')) is MISSING
+        assert cache.get(frozenset('c')) is None
+        assert cache.stats == {'size': 2, 'hits': 2, 'misses': 1, 'evictions': 1}
+
+    def test_used_entries_get_a_second_chance(self):
+        cache = VerdictCache(max_size=3)
+        hot = frozenset('h')
+        cache.put(hot, None)
+
+        for i in range(100):
+            assert cache.get(hot) is None
+            cache.put(frozenset(['cold', i]), None)
+
+        assert len(cache) == 3
+        assert cache.stats['evictions'] == 98 and cache.stats['hits'] == 100
+
+    def test_hits_skip_the_rules(self, monkeypatch):
+        calls = []
+        check_required = ModelPlan.check_required
+        monkeypatch.setattr(ModelPlan, 'check_required', lambda plan, keys: calls.append(plan.model) or check_required(plan, keys))
+
+        for i in range(10):
+            CachedUserModel.validate({'name': 'user %d' % i, 'email': 'x', 'address': {'street': 'x'}})
+            with raises(exceptions.ValidationError) as e:
+                CachedUserModel.validate({'name': 'user %d' % i, 'email': 'x', 'phone': 'y'})
+            assert e.value.errors == [exceptions.Violation('either_of', ['email', 'phone'])]
+
+        assert calls.count(CachedUserModel) == 2
+        assert calls.count(AddressModel) == 10  # sub models are still validated, AddressModel has no cache
+        assert plan_for(CachedUserModel).verdicts.stats['hits'] == 18
+
+    def test_errors_are_not_shared(self):
+        class OwnerModel(BaseModel):
+            sub_models = {'users': CachedUserModel}
+
+        for _ in range(2):
+            with raises(exceptions.ValidationError) as e:
+                OwnerModel.validate({'users': [{'name': 'x', 'email': 'x'}, {'email': 'x'}]})
+            assert e.value.errors == [exceptions.Violation('required', ['name'], path=('users', 1))]
+
+    def test_invalidated_with_the_declarations(self):
+        class SomeModel(BaseModel):
+            optional_attributes = {'A'}
+            verdict_cache_size = 10
+
+        SomeModel.validate({'A': 1})
+        cache = plan_for(SomeModel).verdicts
+        assert len(cache) == 1
+
+        SomeModel.optional_attributes = {'B'}
+        with raises(exceptions.ValidationError):
+            SomeModel.validate({'A': 1})
+        assert plan_for(SomeModel).verdicts is not cache
+
+        SomeModel.verdict_cache_size = None
+        SomeModel.validate({'B': 1})
+        assert plan_for(SomeModel).verdicts is None
+
+    def test_config_error(self):
+        for size in (0, -1, 1.5, '10', True):
+            with raises(exceptions.ConfigurationError):
+                class ErrorModel(BaseModel):
+                    verdict_cache_size = size
+
+    def test_threads(self):
+        class SomeModel(BaseModel):
+            required_attributes = {'A'}
+            optional_attributes = {'B', 'C', 'D'}
+            verdict_cache_size = 3
+
+        objs = [dict((key, 1) for key in keys) for keys in ('A', 'AB', 'AC', 'AD', 'ABC', 'B', 'AE')]
+        expected = [SomeModel.validation_errors(obj) for obj in objs]
+
+        def validate_all(results):
+            for _ in range(200):
+                for obj, violations in zip(objs, expected):
+                    try:
+                        SomeModel.validate(obj)
+                        results.append(violations == [])
+                    except exceptions.ValidationError as e:
+                        results.append(e.errors == violations)
+
+        results = []
+        threads = [threading.Thread(target=validate_all, args=(results,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 4 * 200 * len(objs) and all(results)
+        assert len(plan_for(SomeModel).verdicts) == 3
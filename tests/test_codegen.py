@@ -0,0 +1,161 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import random
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.codegen import compile_validator, generate_source
+from nosql_rest_preprocessor.compiled import plan_for
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import all_of, either_of, one_of
+from pytest import raises
+
+KEYS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J']
+
+
+def random_model(rng, name, depth):
+    keys = rng.sample(KEYS, 8)
+    required = set(keys[:rng.randint(0, 2)])
+    optional = set(keys[2:rng.randint(2, 4)])
+
+    if rng.random() < 0.6:
+        required.add(one_of(*keys[4:6]))
+    if rng.random() < 0.6:
+        required.add(either_of(*keys[5:7]))
+    if rng.random() < 0.6:
+        optional.add(all_of(*keys[6:8]))
+    if rng.random() < 0.6:
+        optional.add(either_of(*keys[2:5]))
+
+    attributes = {
+        'required_attributes': required,
+        'optional_attributes': optional | {'child', 'children'} if rng.random() < 0.8 else None,
+    }
+
+    if depth > 1:
+        attributes['sub_models'] = {
+            'child': random_model(rng, name + 'Child', depth - 1),
+            'children': random_model(rng, name + 'Children', depth - 1)
+        }
+
+    return type(str(name), (BaseModel,), attributes)
+
+
+def random_document(rng, model):
+    # starts out from a mostly valid document and breaks it with random changes
+    plan = plan_for(model)
+    doc = dict((key, 1) for key in plan.required_keys)
+
+    for members in plan.one_of_groups + plan.either_of_groups:
+        for key in members:
+            doc.pop(key, None)
+        doc[rng.choice(sorted(members))] = 1
+
+    if rng.random() < 0.2:
+        key = rng.choice(KEYS)
+        if doc.pop(key, None) is None:
+            doc[key] = 1
+
+    sub_models = dict(model.sub_models)
+    if 'child' in sub_models and rng.random() < 0.7:
+        doc['child'] = random_document(rng, sub_models['child'])
+    if 'children' in sub_models and rng.random() < 0.5:
+        doc['children'] = [random_document(rng, sub_models['children']) for _ in range(rng.randint(0, 3))]
+
+    return doc
+
+
+def outcome(validate, doc):
+    try:
+        validate(doc)
+    except exceptions.ValidationError as e:
+        return e.errors
+
+    return None
+
+
+# noinspection PyMethodMayBeStatic
+class TestGeneratedValidator(object):
+
+    def test_same_outcome_as_interpreted(self):
+        rng = random.Random(42)
+        invalid = 0
+
+        for model_index in range(40):
+            model = random_model(rng, 'RandomModel%d' % model_index, depth=3)
+            generated = compile_validator(plan_for(model))
+
+            for _ in range(100):
+                doc = random_document(rng, model)
+                expected, actual = outcome(model.validate, doc), outcome(generated, doc)
+
+                if expected is None:
+                    assert actual is None, (generate_source(plan_for(model)), doc)
+                    continue
+
+                # the first violation may differ if several rules are broken, but it has to be one of them
+                invalid += 1
+                all_violations = model.validation_errors(doc)
+                assert len(actual) == 1 and actual[0] in all_violations, (generate_source(plan_for(model)), doc)
+                if len(all_violations) == 1:
+                    assert actual == expected
+
+        assert 1000 < invalid < 3000  # both valid and invalid documents were checked
+
+    def test_validation_backend(self):
+        class GeneratedAddressModel(BaseModel):
+            required_attributes = {'street'}
+            optional_attributes = {'city'}
+            validation_backend = 'generated'
+
+        class GeneratedPersonModel(BaseModel):
+            required_attributes = {'name', either_of('email', 'phone')}
+            sub_models = {'address': GeneratedAddressModel}
+            validation_backend = 'generated'
+
+        person = {'name': 'Sepp', 'email': 'sepp@example.com', 'address': [{'street': 'Bakerstreet'}, {}]}
+        with raises(exceptions.ValidationError) as e:
+            GeneratedPersonModel.validate(person)
+        assert e.value.errors == [exceptions.Violation('required', {'street'}, path=('address', 1))]
+
+        person['address'][1]['street'] = 'Brook St'
+        assert GeneratedPersonModel.validate(person) is person
+
+        with raises(exceptions.ValidationError) as e:
+            GeneratedPersonModel.validate({'name': 'Sepp', 'address': {'city': 'London'}}, collect_errors=True)
+        assert len(e.value.errors) == 2
+
+    def test_recompiled_when_rules_change(self):
+        class ChangingModel(BaseModel):
+            required_attributes = {'A'}
+            validation_backend = 'generated'
+
+        ChangingModel.validate({'A': 1})
+
+        ChangingModel.required_attributes = {'B'}
+        with raises(exceptions.ValidationError):
+            ChangingModel.validate({'A': 1})
+
+    def test_cyclic_sub_models(self):
+        class NodeModel(BaseModel):
+            required_attributes = {'name'}
+            validation_backend = 'generated'
+
+        NodeModel.sub_models = {'child': NodeModel}
+
+        NodeModel.validate({'name': 'root', 'child': {'name': 'leaf'}})
+        with raises(exceptions.ValidationError) as e:
+            NodeModel.validate({'name': 'root', 'child': {'child': {'name': 'leaf'}}})
+        assert e.value.errors[0].path == ('child',)
+
+    def test_literal_checks(self):
+        class LiteralModel(BaseModel):
+            required_attributes = {'name', one_of('email', 'phone')}
+
+        source = generate_source(plan_for(LiteralModel))
+        assert "'name' in obj" in source
+        assert "'email' in obj or 'phone' in obj" in source
+
+    def test_unknown_backend(self):
+        with raises(exceptions.ConfigurationError):
+            class UnknownBackendModel(BaseModel):
+                validation_backend = 'jit'
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import json
+import logging
+
+from nosql_rest_preprocessor import instrumentation, exceptions
+from nosql_rest_preprocessor.instrumentation import StatsCollector, LoggingCollector
+from nosql_rest_preprocessor.resolvers import resolve, resolve_many, ResolveWith
+from nosql_rest_preprocessor.models import BaseModel
+from pytest import raises
+
+
+docs = {
+    'address_1': {'street': 'Bakerstreet', 'city': 'London'}
+}
+
+
+class AddressModel(BaseModel):
+    required_attributes = {'street'}
+
+
+class PersonModel(BaseModel):
+    required_attributes = {'name'}
+
+    sub_models = {
+        'home': AddressModel
+    }
+
+    resolved_attributes = {
+        'address': ResolveWith(docs.get, model=AddressModel)
+    }
+
+
+# noinspection PyMethodMayBeStatic
+class TestInstrumentation(object):
+
+    def setup_method(self):
+        self.events = []
+        instrumentation.enable(self.events.append)
+
+    def teardown_method(self):
+        instrumentation.disable()
+
+    def test_disabled(self):
+        instrumentation.disable()
+        PersonModel.validate({'name': 'Sepp'})
+        resolve(PersonModel, {'address': 'address_1'})
+
+        assert self.events == []
+
+    def test_operations(self):
+        PersonModel.validate({'name': 'Sepp', 'home': {'street': 'Bakerstreet'}})
+        with raises(exceptions.ValidationError):
+            PersonModel.validate({})
+        PersonModel.prepare_response({'name': 'Sepp'})
+
+        assert [(event['operation'], event['model'], event['size'], event['error']) for event in self.events] == [
+            ('validate', 'AddressModel', 1, None),  # sub models finish first
+            ('validate', 'PersonModel', 2, None),
+            ('validate', 'PersonModel', 0, 'ValidationError'),
+            ('prepare_response', 'PersonModel', 1, None)
+        ]
+        assert all(event['duration'] >= 0 for event in self.events)
+
+    def test_lookups(self):
+        resolve_many(PersonModel, [{'address': 'address_1'}, {'address': 'address_1'}, {'address': 'unknown'}])
+
+        lookup_event, resolve_event = self.events[0], self.events[-1]
+        assert lookup_event == {
+            'operation': 'lookup', 'model': 'PersonModel', 'attribute': 'address', 'depth': 1, 'hits': 2, 'misses': 1
+        }
+        assert (resolve_event['operation'], resolve_event['size']) == ('resolve_many', 3)
+
+    def test_async_operations(self):
+        import asyncio
+        from nosql_rest_preprocessor.async_resolvers import async_resolve_many
+
+        resolved_objs = asyncio.run(async_resolve_many(PersonModel, iter([{'address': 'address_1'}])))
+        assert resolved_objs == [{'address': docs['address_1']}]
+
+        resolve_event = self.events[-1]
+        assert (resolve_event['operation'], resolve_event['size'], resolve_event['error']) == (
+            'async_resolve_many', None, None
+        )
+
+    def test_stats_collector(self):
+        collector = StatsCollector()
+        instrumentation.enable(collector)
+
+        for i in range(3):
+            resolve(PersonModel, {'address': 'address_1'})
+        resolve(PersonModel, {'address': 'unknown'})
+
+        stats = json.loads(json.dumps(collector.dump()))
+        assert stats['lookups'] == [
+            {'model': 'PersonModel', 'attribute': 'address', 'hits': 3, 'misses': 1, 'max_depth': 1}
+        ]
+
+        resolve_stats = [op for op in stats['operations'] if op['operation'] == 'resolve'][0]
+        assert (resolve_stats['model'], resolve_stats['calls'], resolve_stats['errors']) == ('PersonModel', 4, 0)
+
+        collector.reset()
+        assert collector.dump() == {'operations': [], 'lookups': []}
+
+    def test_logging_collector(self, caplog):
+        instrumentation.enable(LoggingCollector())
+
+        with caplog.at_level(logging.DEBUG, logger='nosql_rest_preprocessor'):
+            AddressModel.validate({'street': 'Bakerstreet'})
+
+        record, = caplog.records
+        assert record.event['operation'] == 'validate'
+        assert json.loads(record.getMessage())['model'] == 'AddressModel'
@@ -0,0 +1,144 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import threading
+
+from nosql_rest_preprocessor.lookups import lookup_instances, InstancePool
+from nosql_rest_preprocessor.resolvers import resolve, ResolveWith
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor import exceptions
+from pytest import raises
+
+
+class FakeConnection(object):
+    created = []
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.open = False
+        FakeConnection.created.append(self)
+
+    def find(self, key):
+        assert self.open
+        return self.docs.get(key)
+
+
+def connect(connection):
+    connection.open = True
+
+
+def disconnect(connection):
+    connection.open = False
+
+
+docs = {'address_1': {'street': 'Bakerstreet'}}
+
+
+class AddressModel(BaseModel):
+    pass
+
+
+def make_model(**kwargs):
+    class PersonModel(BaseModel):
+        resolved_attributes = {
+            'address': ResolveWith(FakeConnection.find, model=AddressModel, lookup_class=FakeConnection,
+                                   setup=connect, teardown=disconnect, docs=docs, **kwargs)
+        }
+
+    return PersonModel
+
+
+# noinspection PyMethodMayBeStatic
+class TestLookupInstances(object):
+
+    def setup_method(self):
+        del FakeConnection.created[:]
+
+    def test_per_call(self):
+        model = make_model()
+        for i in range(3):
+            assert resolve(model, {'address': 'address_1'})['address'] == docs['address_1']
+
+        assert len(FakeConnection.created) == 3
+        assert not any(connection.open for connection in FakeConnection.created)
+
+    def test_per_resolver(self):
+        model = make_model(lookup_scope='resolver')
+        for i in range(3):
+            resolve(model, {'address': 'address_1'})
+
+        assert len(FakeConnection.created) == 1
+        assert FakeConnection.created[0].open
+
+        model.resolved_attributes['address'].close()
+        assert not FakeConnection.created[0].open
+
+    def test_per_thread(self):
+        model = make_model(lookup_scope='thread')
+
+        def work():
+            for i in range(3):
+                resolve(model, {'address': 'address_1'})
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(FakeConnection.created) == 4
+
+        model.resolved_attributes['address'].close()
+        assert not any(connection.open for connection in FakeConnection.created)
+
+    def test_pool(self):
+        pool = lookup_instances(FakeConnection, {'docs': docs}, scope='pool', pool_size=2, setup=connect,
+                                teardown=disconnect)
+        assert isinstance(pool, InstancePool)
+
+        first, second = pool.acquire(), pool.acquire()
+        assert first is not second
+
+        acquired = []
+        waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiting.start()
+        waiting.join(0.05)
+        assert not acquired  # pool is exhausted, so the thread has to wait
+
+        pool.release(first)
+        waiting.join()
+        assert acquired == [first]
+        assert len(FakeConnection.created) == 2
+
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+        assert not any(connection.open for connection in FakeConnection.created)
+
+    def test_pooled_resolving(self):
+        model = make_model(lookup_scope='pool', pool_size=2)
+        for i in range(3):
+            resolve(model, {'address': 'address_1'})
+
+        assert len(FakeConnection.created) == 1
+
+    def test_instances_are_shared(self):
+        connection = FakeConnection(docs)
+        assert lookup_instances(connection, {}, scope='pool').acquire() is connection
+
+    def test_constructor_arguments_named_like_options(self):
+        class CachingConnection(FakeConnection):
+            def __init__(self, docs, cache):
+                super(CachingConnection, self).__init__(docs)
+                self.open, self.cache = True, cache
+
+        resolver = ResolveWith(CachingConnection.find, lookup_class=CachingConnection, lookup_scope='resolver',
+                               lookup_class_kwargs={'docs': docs, 'cache': 'lru'})
+        assert resolver.lookup('address_1') == docs['address_1']
+        assert FakeConnection.created[-1].cache == 'lru' and resolver.cache is None
+
+        with raises(exceptions.ConfigurationError):
+            ResolveWith(FakeConnection.find, lookup_class=FakeConnection, lookup_class_kwargs={'docs': docs}, docs={})
+
+    def test_unknown_scope(self):
+        with raises(exceptions.ConfigurationError):
+            make_model(lookup_scope='request')
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.compiled import plan_for
 from nosql_rest_preprocessor.utils import *
 from nosql_rest_preprocessor import exceptions
 from copy import deepcopy
@@ -51,6 +52,14 @@ class CompanyModel(BaseModel):
     optional_attributes = {'address'}
 
 
+class HouseholdModel(BaseModel):
+    required_attributes = {'name'}
+
+    sub_models = {
+        'addresses': AddressModel
+    }
+
+
 # noinspection PyMethodMayBeStatic
 class TestValidate(object):
 
@@ -128,19 +137,21 @@ class TestValidate(object):
         ModelC.validate(some_obj)
 
     def test_config_error(self):
-        class ErrorModel(BaseModel):
-            required_attributes = {
-                ('many_of', ('apple', 'pie'))
-            }
         with raises(exceptions.ConfigurationError):
-            ErrorModel.validate({})
+            class ErrorModel(BaseModel):
+                required_attributes = {
+                    ('many_of', ('apple', 'pie'))
+                }
+
+        with raises(exceptions.ConfigurationError):
+            class ErrorModel2(BaseModel):
+                optional_attributes = {
+                    ('many_of', ('apple', 'pie'))
+                }
 
-        class ErrorModel2(BaseModel):
-            optional_attributes = {
-                ('many_of', ('apple', 'pie'))
-            }
         with raises(exceptions.ConfigurationError):
-            ErrorModel2.validate({'apple': 'red'})
+            ModelA.required_attributes = {('all_of', ('apple', 'pie'))}  # only one_of and either_of are required
+        ModelA.validate({'A': 'something', 'B': 'or other'})  # the declaration was not replaced
 
 
 # noinspection PyMethodMayBeStatic
@@ -167,6 +178,103 @@ class TestPrepareResponse(object):
         }
         assert 'wifiPassword' not in PersonModel.prepare_response(person_obj)['address']
 
+    def test_fields(self):
+        person_obj = {
+            'name': 'Sepp Huber',
+            'email': 'sepp.huber@fancypants.com',
+            'tags': ['a', 'b'],
+            'address': {'street': 'Bakerstreet', 'city': 'London', 'wifiPassword': 'thecakeisalie'}
+        }
+
+        assert PersonModel.prepare_response(person_obj, fields=['name', 'address.city', 'unknown.field']) == {
+            'name': 'Sepp Huber',
+            'address': {'city': 'London'}
+        }
+        assert PersonModel.prepare_response(person_obj, fields=['address.wifiPassword']) == {'address': {}}
+        assert PersonModel.prepare_response(person_obj, fields=['address', 'address.city']) == {
+            'address': {'street': 'Bakerstreet', 'city': 'London'}
+        }
+        assert ModelA.prepare_response({'A': 1, 'B': 2}, fields=['A', 'B']) == {'B': 2}
+
+        prepared_obj = PersonModel.prepare_response(person_obj, fields=['tags'])
+        assert prepared_obj['tags'] is person_obj['tags']  # requested values are not copied
+
+    def test_fields_in_lists(self):
+        household_obj = {'addresses': [{'city': 'London', 'wifiPassword': 'thecakeisalie'}, {'city': 'Ratisbon'}]}
+
+        assert HouseholdModel.prepare_response(household_obj, fields=['addresses.city']) == {
+            'addresses': [{'city': 'London'}, {'city': 'Ratisbon'}]
+        }
+        assert HouseholdModel.prepare_response(household_obj, fields=['addresses']) == {
+            'addresses': [{'city': 'London'}, {'city': 'Ratisbon'}]
+        }
+
+    def test_input_is_never_mutated(self):
+        person_obj = {
+            'name': 'Sepp Huber',
+            'email': 'sepp.huber@fancypants.com',
+            'tags': ['a', 'b'],
+            'address': {
+                'street': 'Bakerstreet',
+                'city': 'London',
+                'plz': '12345',
+                'wifiPassword': 'thecakeisalie'
+            }
+        }
+        original = deepcopy(person_obj)
+
+        response_obj = PersonModel.prepare_response(person_obj)
+        assert person_obj == original
+        assert response_obj == {
+            'name': 'Sepp Huber',
+            'email': 'sepp.huber@fancypants.com',
+            'tags': ['a', 'b'],
+            'address': {
+                'street': 'Bakerstreet',
+                'city': 'London',
+                'plz': '12345'
+            }
+        }
+
+        response_obj['address']['city'] = 'Ratisbon'
+        assert person_obj['address']['city'] == 'London'
+
+    def test_unchanged_values_are_shared(self):
+        person_obj = {
+            'name': 'Sepp Huber',
+            'tags': ['a', 'b'],
+            'address': {'street': 'Bakerstreet', 'wifiPassword': 'thecakeisalie'}
+        }
+        response_obj = PersonModel.prepare_response(person_obj)
+        assert response_obj is not person_obj
+        assert response_obj['address'] is not person_obj['address']
+        assert response_obj['tags'] is person_obj['tags']
+
+        del person_obj['address']['wifiPassword']
+        assert PersonModel.prepare_response(person_obj) is person_obj  # nothing to strip, nothing to copy
+
+    def test_prepare_responses(self):
+        person_objs = [
+            {'name': 'Sepp', 'address': {'street': 'Bakerstreet', 'wifiPassword': 'thecakeisalie'}},
+            {'name': 'Hans', 'address': None},
+            {'name': 'Fritz'}
+        ]
+        household_obj = {'name': 'Huber', 'addresses': [{'city': 'London', 'wifiPassword': 'x'}, 'not a dict']}
+        original_objs = deepcopy(person_objs)
+
+        expected = [PersonModel.prepare_response(person_obj) for person_obj in person_objs]
+        assert PersonModel.prepare_responses(person_objs) == expected
+        assert person_objs == original_objs
+
+        prepared_objs = PersonModel.prepare_responses(person_objs, in_place=True)
+        assert prepared_objs == expected
+        assert all(prepared is person_obj for prepared, person_obj in zip(prepared_objs, person_objs))
+
+        assert HouseholdModel.prepare_responses([household_obj], in_place=True) == [
+            {'name': 'Huber', 'addresses': [{'city': 'London'}, 'not a dict']}
+        ]
+        assert CompanyModel.prepare_responses(iter(original_objs)) == original_objs  # nothing private
+
 
 # noinspection PyMethodMayBeStatic
 class TestMergeUpdated(object):
@@ -231,4 +339,312 @@ class TestMergeUpdated(object):
 
         assert person_obj != new_obj
         with raises(exceptions.ChangingImmutableAttributeError):
-            PersonModel.merge_updated(person_obj, new_obj)
\ No newline at end of file
+            PersonModel.merge_updated(person_obj, new_obj)
+
+# noinspection PyMethodMayBeStatic
+class TestStreams(object):
+
+    @staticmethod
+    def cursor(count):
+        for i in range(count):
+            yield {'A': i, 'B': 'private'} if i % 2 else {'B': 'invalid'}
+
+    def test_validate_stream(self):
+        stream = ModelA.validate_stream(self.cursor(10))
+        with raises(exceptions.ValidationError):
+            next(stream)
+
+        errors = []
+        validated_objs = list(ModelA.validate_stream(self.cursor(10), errors=errors))
+        assert [obj['A'] for obj in validated_objs] == [1, 3, 5, 7, 9]
+        assert [index for index, obj, e in errors] == [0, 2, 4, 6, 8]
+        assert all(isinstance(e, exceptions.ValidationError) for index, obj, e in errors)
+
+    def test_prepare_stream(self):
+        prepared_objs = ModelB.prepare_stream(iter([{'A': 1}, {'A': 2}]))
+        assert next(prepared_objs) == {'A': 1}
+        assert list(prepared_objs) == [{'A': 2}]
+
+        assert list(ModelA.prepare_stream(self.cursor(3))) == [{'B': 'invalid'}, {'B': 'private'}, {'B': 'invalid'}]
+
+
+# noinspection PyMethodMayBeStatic
+class TestValidateMany(object):
+
+    objs = [{'A': i} if i % 3 else {'B': i} for i in range(100)]
+
+    def test_parallel(self):
+        errors = []
+        validated_objs = ModelA.validate_many(self.objs, workers=2, chunksize=7, errors=errors, min_parallel_size=0)
+
+        assert validated_objs == [obj for obj in self.objs if 'A' in obj]
+        assert [index for index, obj, e in errors] == list(range(0, 100, 3))
+        assert all(obj is self.objs[index] for index, obj, e in errors)
+        assert all(isinstance(e, exceptions.ValidationError) for index, obj, e in errors)
+
+    def test_serial_fallback(self):
+        errors = []
+        validated_objs = ModelA.validate_many(self.objs, workers=2, errors=errors)
+
+        assert validated_objs == [obj for obj in self.objs if 'A' in obj]
+        assert len(errors) == 34
+
+    def test_failing_fast(self):
+        valid_objs = [{'A': i} for i in range(100)]
+        assert ModelA.validate_many(valid_objs, workers=2, chunksize=7, min_parallel_size=0) == valid_objs
+
+        with raises(exceptions.ValidationError):
+            ModelA.validate_many(self.objs, workers=2, chunksize=7, min_parallel_size=0)
+
+        with raises(exceptions.ValidationError):
+            ModelA.validate_many(self.objs, workers=1)
+
+    def test_current_rules_are_sent_to_spawned_workers(self):
+        class LocalModel(BaseModel):  # can't be imported by the workers
+            required_attributes = {'name'}
+
+        class TreeOfModels(BaseModel):
+            required_attributes = {'A'}
+            sub_models = {'local': LocalModel}
+
+        TreeOfModels.sub_models = {'local': LocalModel, 'tree': TreeOfModels}
+        TreeOfModels.required_attributes = {'A', 'Z'}
+
+        objs = [{'A': i, 'Z': i, 'local': {'name': i}, 'tree': {'A': i, 'Z': i}} for i in range(10)]
+        objs[3] = {'A': 3, 'Z': 3, 'tree': {'A': 3}}
+        objs[7] = {'A': 7, 'Z': 7, 'local': {}}
+
+        serial_errors, parallel_errors = [], []
+        expected = TreeOfModels.validate_many(objs, workers=1, errors=serial_errors)
+        assert TreeOfModels.validate_many(objs, workers=2, errors=parallel_errors, min_parallel_size=0,
+                                          start_method='spawn') == expected
+        assert [(index, e.errors) for index, obj, e in parallel_errors] == [
+            (index, e.errors) for index, obj, e in serial_errors
+        ] == [
+            (3, [exceptions.Violation('required', ['Z'], path=('tree',))]),
+            (7, [exceptions.Violation('required', ['name'], path=('local',))])
+        ]
+
+    def test_nested(self):
+        person_obj = {
+            'name': 'Sepp Huber',
+            'email': 'sepp.huber@fancypants.com',
+            'address': {'street': 'Bakerstreet', 'city': 'London'}
+        }
+
+        errors = []
+        PersonModel.validate_many([person_obj] * 3, workers=2, errors=errors, min_parallel_size=0)
+        assert len(errors) == 3
+
+
+# noinspection PyMethodMayBeStatic
+class TestCompiledPlan(object):
+
+    def test_plan_is_cached(self):
+        assert plan_for(ModelC) is plan_for(ModelC)
+        assert plan_for(ModelA) is not plan_for(ModelC)
+
+    def test_plan_is_rebuilt_on_change(self):
+        class ChangingModel(BaseModel):
+            required_attributes = {'A'}
+            optional_attributes = set()
+
+        ChangingModel.validate({'A': 'something'})
+        with raises(exceptions.ValidationError):
+            ChangingModel.validate({'A': 'something', 'B': 'else'})
+
+        ChangingModel.optional_attributes = {'B'}
+        ChangingModel.validate({'A': 'something', 'B': 'else'})
+
+        ChangingModel.required_attributes = {'A', 'C'}
+        with raises(exceptions.ValidationError):
+            ChangingModel.validate({'A': 'something', 'B': 'else'})
+
+    def test_subclasses_get_their_own_plan(self):
+        class ParentModel(BaseModel):
+            required_attributes = {'A'}
+
+        class ChildModel(ParentModel):
+            optional_attributes = set()
+
+        ParentModel.validate({'A': 'something', 'B': 'else'})
+        with raises(exceptions.ValidationError):
+            ChildModel.validate({'A': 'something', 'B': 'else'})
+
+        ParentModel.required_attributes = {'B'}  # inherited declarations are tracked as well
+        with raises(exceptions.ValidationError):
+            ChildModel.validate({'A': 'something'})
+
+    def test_tree_flags(self):
+        plan = plan_for(PersonModel)
+
+        assert plan.has_sub_models and not plan.has_resolved
+        assert plan.needs_prepare  # AddressModel has private attributes
+        assert plan.prepared_sub_plans == (('address', plan_for(AddressModel)),)
+        assert not plan_for(CompanyModel).needs_prepare
+
+    def test_branches_without_private_attributes_are_skipped(self):
+        class InnerModel(BaseModel):
+            pass
+
+        class OuterModel(BaseModel):
+            private_attributes = {'secret'}
+            sub_models = {'inner': InnerModel}
+
+        assert plan_for(OuterModel).prepared_sub_plans == ()
+
+        obj = {'inner': {'secret': 'not private in InnerModel'}}
+        assert OuterModel.prepare_response(obj) is obj
+
+        InnerModel.private_attributes = {'secret'}  # invalidates the plan of OuterModel as well
+        assert OuterModel.prepare_response(obj) == {'inner': {}}
+
+    def test_cyclic_sub_models(self):
+        class TreeModel(BaseModel):
+            private_attributes = {'secret'}
+
+        TreeModel.sub_models = {'child': TreeModel}
+
+        tree = {'secret': 1, 'child': {'secret': 2, 'child': {'secret': 3, 'name': 'leaf'}}}
+        assert TreeModel.prepare_response(tree) == {'child': {'child': {'name': 'leaf'}}}
+
+        TreeModel.private_attributes = {'name'}
+        assert TreeModel.prepare_response(tree) == {'secret': 1, 'child': {'secret': 2, 'child': {'secret': 3}}}
+        assert plan_for(TreeModel).sub_plans[0][1] is plan_for(TreeModel)
+
+    def test_malformed_rule(self):
+        with raises(exceptions.ConfigurationError):
+            class ErrorModel(BaseModel):
+                required_attributes = {
+                    ('one_of', 'A', 'B')
+                }
+
+
+# noinspection PyMethodMayBeStatic
+class TestValidationErrors(object):
+
+    person_obj = {
+        'name': 'Sepp Huber',
+        'address': {
+            'street': 'Bakerstreet'
+        }
+    }
+
+    def test_fail_fast_error(self):
+        with raises(exceptions.ValidationError) as e:
+            CompanyModel.validate({'name': 'Continental', 'city': 'Ratisbon'})
+
+        assert e.value.errors == [exceptions.Violation('not_allowed', ['city'])]
+        assert str(e.value) == '<root>: attributes not allowed city'
+
+    def test_nested_path(self):
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.validate({'name': 'Sepp Huber', 'email': 'sepp.huber@fancypants.com', 'address': {}})
+
+        error, = e.value.errors
+        assert (error.path, error.rule, error.keys) == (('address',), 'required', ('city', 'plz', 'street'))
+        assert str(e.value) == 'address: missing required attributes city, plz, street'
+
+    def test_non_string_keys(self):
+        with raises(exceptions.ValidationError) as e:
+            CompanyModel.validate({'name': 'Continental', 2: 'x', 'city': 'Ratisbon'})
+
+        assert e.value.errors == [exceptions.Violation('not_allowed', ['city', 2])]
+        assert str(e.value) == '<root>: attributes not allowed city, 2'
+
+        with raises(exceptions.ValidationError) as e:
+            CompanyModel.validate({'name': 'Continental', 1: 'x'}, collect_errors=True)
+        assert e.value.errors == [exceptions.Violation('not_allowed', [1])]
+
+    def test_collect_errors(self):
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.validate(self.person_obj, collect_errors=True)
+
+        assert e.value.errors == [
+            exceptions.Violation('required', ['email']),
+            exceptions.Violation('required', ['city', 'plz'], path=['address'])
+        ]
+
+    def test_collect_rule_types(self):
+        errors = ModelC.validation_errors({'C': 1, 'D': 1, 'E': 1, 'G': 1, 'H': 1, 'X': 1})
+
+        assert set(errors) == {
+            exceptions.Violation('one_of', ['A', 'B']),
+            exceptions.Violation('either_of', ['C', 'D']),
+            exceptions.Violation('not_allowed', ['X']),
+            exceptions.Violation('all_of', ['E', 'F']),
+            exceptions.Violation('either_of', ['G', 'H'])
+        }
+
+    def test_valid_objects(self):
+        valid_obj = {'A': 1, 'C': 1}
+        assert ModelC.validation_errors(valid_obj) == []
+        assert ModelC.validate(valid_obj, collect_errors=True) is valid_obj
+
+    def test_errors_can_be_pickled(self):
+        import pickle
+
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.validate(self.person_obj, collect_errors=True)
+
+        unpickled = pickle.loads(pickle.dumps(e.value))
+        assert unpickled.errors == e.value.errors
+        assert str(unpickled) == str(e.value)
+
+
+# noinspection PyMethodMayBeStatic
+class TestListValuedSubModels(object):
+
+    household_obj = {
+        'name': 'Huber',
+        'addresses': [
+            {'street': 'Bakerstreet', 'city': 'London', 'plz': '12345', 'wifiPassword': 'thecakeisalie'},
+            {'street': 'Brook St', 'city': 'London', 'plz': '98765', 'planet': 'Earth'}
+        ]
+    }
+
+    def test_validate(self):
+        assert HouseholdModel.validate(self.household_obj) is self.household_obj
+
+        invalid_obj = deepcopy(self.household_obj)
+        del invalid_obj['addresses'][1]['plz']
+        with raises(exceptions.ValidationError) as e:
+            HouseholdModel.validate(invalid_obj)
+
+        assert e.value.errors == [exceptions.Violation('required', ['plz'], path=['addresses', 1])]
+        assert str(e.value) == 'addresses.1: missing required attributes plz'
+
+    def test_collect_errors(self):
+        invalid_obj = {'name': 'Huber', 'addresses': [{'street': 'Bakerstreet'}, {}]}
+
+        assert [error.path for error in HouseholdModel.validation_errors(invalid_obj)] == [
+            ('addresses', 0), ('addresses', 1)
+        ]
+
+    def test_prepare_response(self):
+        prepared_obj = HouseholdModel.prepare_response(self.household_obj)
+
+        assert [address.get('wifiPassword') for address in prepared_obj['addresses']] == [None, None]
+        assert prepared_obj['addresses'][1] is self.household_obj['addresses'][1]  # nothing to strip
+        assert 'wifiPassword' in self.household_obj['addresses'][0]
+
+        public_obj = HouseholdModel.prepare_response(prepared_obj)
+        assert public_obj is prepared_obj
+
+    def test_merge_updated(self):
+        new_obj = deepcopy(self.household_obj)
+        new_obj['addresses'][0]['city'] = 'Ratisbon'
+        new_obj['addresses'].append({'street': 'Main St', 'city': 'Ratisbon', 'plz': '93047', 'planet': 'Mars'})
+
+        merged_obj = HouseholdModel.merge_updated(self.household_obj, new_obj)
+        assert [address['city'] for address in merged_obj['addresses']] == [
+            'Ratisbon', 'London', 'Ratisbon'
+        ]
+
+        new_obj['addresses'][1]['planet'] = 'Mars'
+        with raises(exceptions.ChangingImmutableAttributeError):
+            HouseholdModel.merge_updated(self.household_obj, new_obj)
+
+    def test_missing_sub_model_in_update(self):
+        merged_obj = HouseholdModel.merge_updated(self.household_obj, {'name': 'Maier'})
+        assert merged_obj == {'name': 'Maier'}
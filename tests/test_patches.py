@@ -0,0 +1,201 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+from copy import deepcopy
+
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import either_of
+from nosql_rest_preprocessor import exceptions
+from pytest import raises
+
+
+class AddressModel(BaseModel):
+    required_attributes = {'street', 'city'}
+    optional_attributes = {'plz', 'planet'}
+    immutable_attributes = {'planet'}
+
+
+class PersonModel(BaseModel):
+    required_attributes = {'name', either_of('email', 'phone')}
+    immutable_attributes = {'id'}
+
+    sub_models = {
+        'address': AddressModel
+    }
+
+    resolved_attributes = {
+        'company': lambda key: None
+    }
+
+
+db_obj = {
+    'id': 1,
+    'name': 'Sepp Huber',
+    'email': 'sepp.huber@fancypants.com',
+    'company': 'foreign_key_890',
+    'tags': ['a', 'b'],
+    'address': {
+        'street': 'Bakerstreet',
+        'city': 'London',
+        'planet': 'Earth'
+    }
+}
+
+
+# noinspection PyMethodMayBeStatic
+class TestMergePatch(object):
+
+    def setup_method(self):
+        self.db_obj = deepcopy(db_obj)
+
+    def test_merge_patch(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, {
+            'name': 'Sepp Maier',
+            'address': {'city': 'Ratisbon', 'plz': '93047'},
+            'tags': None
+        })
+
+        expected = deepcopy(db_obj)
+        expected['name'] = 'Sepp Maier'
+        expected['address'].update(city='Ratisbon', plz='93047')
+        del expected['tags']
+
+        assert merged_obj == expected
+        assert changes == {
+            '$set': {'name': 'Sepp Maier', 'address.city': 'Ratisbon', 'address.plz': '93047'},
+            '$unset': {'tags': ''}
+        }
+
+    def test_db_obj_is_not_mutated(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, {'address': {'city': 'Ratisbon'}})
+
+        assert self.db_obj == db_obj
+        assert merged_obj['tags'] is self.db_obj['tags']  # untouched values are shared
+        assert merged_obj['address'] is not self.db_obj['address']
+
+    def test_unchanged_values_are_not_in_changes(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, {'name': 'Sepp Huber', 'nickname': None})
+
+        assert merged_obj == db_obj
+        assert changes == {'$set': {}, '$unset': {}}
+
+    def test_json_patch(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, [
+            {'op': 'test', 'path': '/name', 'value': 'Sepp Huber'},
+            {'op': 'replace', 'path': '/address/city', 'value': 'Ratisbon'},
+            {'op': 'add', 'path': '/address/plz', 'value': '93047'},
+            {'op': 'move', 'from': '/email', 'path': '/phone'},
+            {'op': 'copy', 'from': '/tags', 'path': '/labels'},
+            {'op': 'remove', 'path': '/tags'}
+        ])
+
+        assert merged_obj['phone'] == db_obj['email']
+        assert 'email' not in merged_obj
+        assert merged_obj['labels'] == db_obj['tags']
+        assert changes == {
+            '$set': {
+                'address.city': 'Ratisbon', 'address.plz': '93047', 'phone': db_obj['email'], 'labels': db_obj['tags']
+            },
+            '$unset': {'email': '', 'tags': ''}
+        }
+
+    def test_invalid_json_patch(self):
+        invalid_patches = [
+            [{'op': 'test', 'path': '/name', 'value': 'Somebody'}],
+            [{'op': 'replace', 'path': '/nickname', 'value': 'Sepp'}],
+            [{'op': 'remove', 'path': '/nickname'}],
+            [{'op': 'add', 'path': '/nickname'}],
+            [{'op': 'add', 'path': 'nickname', 'value': 'Sepp'}],
+            [{'op': 'add', 'path': '/settings/theme', 'value': 'dark'}],
+            [{'op': 'replace', 'path': '', 'value': {}}],
+            [{'op': 'frobnicate', 'path': '/name'}],
+            [{'path': '/name'}],
+            'not a patch'
+        ]
+        for patch in invalid_patches:
+            with raises(exceptions.ValidationError) as e:
+                PersonModel.merge_patch(self.db_obj, patch)
+            assert [error.rule for error in e.value.errors] == ['invalid_patch']
+            assert str(e.value)
+
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.merge_patch(self.db_obj, [{'op': 'remove', 'path': '/nickname'}])
+        assert e.value.errors == [exceptions.Violation('invalid_patch', ['/nickname'])]
+        assert str(e.value) == '/nickname: nothing to remove'
+
+    def test_array_pointers_are_not_supported(self):
+        for pointer in ('/tags/0', '/tags/-'):
+            with raises(exceptions.ValidationError) as e:
+                PersonModel.merge_patch(self.db_obj, [{'op': 'add', 'path': pointer, 'value': 'c'}])
+            assert e.value.errors == [exceptions.Violation('invalid_patch', [pointer])]
+            assert 'arrays are not supported' in str(e.value)
+
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, [{'op': 'replace', 'path': '/tags', 'value': ['c']}])
+        assert changes['$set'] == {'tags': ['c']}
+
+    def test_pointer_escaping(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, [{'op': 'add', 'path': '/a~1b~0c', 'value': 1}])
+        assert merged_obj['a/b~c'] == 1
+
+    def test_touched_paths_are_validated(self):
+        with raises(exceptions.ValidationError):
+            PersonModel.merge_patch(self.db_obj, {'name': None})  # required
+
+        with raises(exceptions.ValidationError):
+            PersonModel.merge_patch(self.db_obj, {'phone': '12345'})  # either_of('email', 'phone')
+
+        with raises(exceptions.ValidationError):
+            PersonModel.merge_patch(self.db_obj, {'address': {'city': None}})  # required in AddressModel
+
+        with raises(exceptions.ValidationError):
+            PersonModel.merge_patch(self.db_obj, {'address': {'floor': 3}})  # not allowed in AddressModel
+
+        with raises(exceptions.ValidationError):
+            PersonModel.merge_patch(self.db_obj, {'address': 'somewhere'})  # not a valid sub model
+
+    def test_immutable_attributes(self):
+        with raises(exceptions.ChangingImmutableAttributeError):
+            PersonModel.merge_patch(self.db_obj, {'id': 2})
+
+        with raises(exceptions.ChangingImmutableAttributeError):
+            PersonModel.merge_patch(self.db_obj, [{'op': 'remove', 'path': '/id'}])
+
+        with raises(exceptions.ChangingImmutableAttributeError):
+            PersonModel.merge_patch(self.db_obj, {'address': {'planet': 'Mars'}})
+
+        PersonModel.merge_patch(self.db_obj, {'id': 1, 'address': {'planet': 'Earth'}})
+
+    def test_resolved_attributes_are_not_saved(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, {'company': {'name': 'Continental'}})
+
+        assert merged_obj['company'] == 'foreign_key_890'
+        assert changes == {'$set': {}, '$unset': {}}
+
+    def test_replacing_a_sub_model(self):
+        merged_obj, changes = PersonModel.merge_patch(self.db_obj, [
+            {'op': 'replace', 'path': '/address', 'value': {'street': 'Brook St', 'city': 'London', 'planet': 'Earth'}}
+        ])
+        assert changes['$set'] == {'address': {'street': 'Brook St', 'city': 'London', 'planet': 'Earth'}}
+
+        with raises(exceptions.ChangingImmutableAttributeError):
+            PersonModel.merge_patch(self.db_obj, [
+                {'op': 'replace', 'path': '/address', 'value': {'street': 'Brook St', 'city': 'London'}}
+            ])
+
+    def test_list_of_sub_models(self):
+        class CustomerModel(BaseModel):
+            sub_models = {'addresses': AddressModel}
+
+        db_customer = {'addresses': [{'street': 'Bakerstreet', 'city': 'London', 'planet': 'Earth'}]}
+        addresses = [{'street': 'Brook St', 'city': 'London', 'planet': 'Earth'}, {'street': 'Main St', 'city': 'Ulm'}]
+
+        merged_obj, changes = CustomerModel.merge_patch(db_customer, {'addresses': addresses})
+        assert merged_obj == {'addresses': addresses}
+        assert changes == {'$set': {'addresses': addresses}, '$unset': {}}
+
+        with raises(exceptions.ValidationError):
+            CustomerModel.merge_patch(db_customer, {'addresses': [{'street': 'Brook St'}]})
+
+        with raises(exceptions.ChangingImmutableAttributeError):
+            CustomerModel.merge_patch(db_customer, [
+                {'op': 'add', 'path': '/addresses', 'value': [{'street': 'x', 'city': 'y', 'planet': 'Mars'}]}
+            ])
@@ -0,0 +1,129 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import json
+import mmap
+import random
+import tempfile
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.utils import either_of
+from pytest import raises
+
+from tests.test_codegen import random_document, random_model
+
+
+def outcome(validate, data):
+    try:
+        validate(data)
+    except exceptions.ValidationError as e:
+        return 'invalid', e.errors
+    except (TypeError, AttributeError) as e:
+        return 'error', type(e)
+
+    return 'valid', None
+
+
+def noise(rng):
+    # values which have to be skipped without being decoded
+    return rng.choice([
+        None, True, 1.5e10, -3, 'a "quoted" ]}{[ string', 'ünicøde \\ backslash', [],
+        {'nested': [{'deeply': ['}', '{']}, 1, None]}, list(range(20)), {'': ''}
+    ])
+
+
+def noisy(rng, doc):
+    # adds values to skip, and sometimes replaces embedded objects with values validate can't check by their keys
+    doc = dict((key, noisy(rng, value) if isinstance(value, dict) else value) for key, value in doc.items())
+    if rng.random() < 0.5:
+        doc['K'] = noise(rng)
+    if 'child' in doc and rng.random() < 0.05:
+        doc['child'] = rng.choice([None, 'a string', ['a', 'list'], [[{}]], 5])
+    if isinstance(doc.get('children'), list):
+        doc['children'] = [noisy(rng, element) for element in doc['children']]
+
+    return doc
+
+
+def encode(rng, doc):
+    return json.dumps(doc, indent=rng.choice([None, 0, 2]), ensure_ascii=rng.random() < 0.5).encode('utf-8')
+
+
+# noinspection PyMethodMayBeStatic
+class TestValidateRaw(object):
+
+    def test_same_outcome_as_validate(self):
+        rng = random.Random(7)
+        outcomes = set()
+
+        for model_index in range(30):
+            model = random_model(rng, 'RawModel%d' % model_index, depth=3)
+
+            for _ in range(100):
+                data = encode(rng, noisy(rng, random_document(rng, model)))
+
+                expected = outcome(lambda raw: model.validate(json.loads(raw.decode('utf-8'))), data)
+                assert outcome(model.validate_raw, data) == expected, data
+                assert outcome(model.validate_raw, memoryview(data)) == expected, data
+
+                outcomes.add(expected[0])
+
+        assert outcomes == {'valid', 'invalid', 'error'}
+
+    def test_decode(self):
+        class PersonModel(BaseModel):
+            required_attributes = {'name', either_of('email', 'phone')}
+
+        doc = {'name': 'Sepp', 'email': 'sepp@example.com', 'tags': ['a', {'b': 'c'}]}
+        assert PersonModel.validate_raw(json.dumps(doc).encode('utf-8')) is None
+        assert PersonModel.validate_raw(bytearray(json.dumps(doc).encode('utf-8')), decode=True) == doc
+
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.validate_raw(b'{"name": "Sepp", "email": "x", "phone": "y", "extra": [1, 2]}')
+        assert e.value.errors == [exceptions.Violation('either_of', ['email', 'phone'])]
+
+    def test_collect_errors(self):
+        class AddressModel(BaseModel):
+            required_attributes = {'street'}
+
+        class PersonModel(BaseModel):
+            required_attributes = {'name'}
+            sub_models = {'address': AddressModel}
+
+        with raises(exceptions.ValidationError) as e:
+            PersonModel.validate_raw(b'{"address": {"city": "London"}}', collect_errors=True)
+        assert len(e.value.errors) == 2
+
+    def test_escaped_and_duplicate_keys(self):
+        class EscapedModel(BaseModel):
+            required_attributes = {'a"b', 'ü'}
+            optional_attributes = set()
+
+        EscapedModel.validate_raw(b'{"a\\"b": 1, "\\u00fc": 2, "\\u00fc": 3}')
+        EscapedModel.validate_raw('{"a\\"b": 1, "ü": 2}'.encode('utf-8'))
+
+    def test_mmap(self):
+        class LineModel(BaseModel):
+            required_attributes = {'id'}
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'{"id": 1, "payload": [1, 2, 3]}\n{"payload": "no id"}\n')
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            view = memoryview(mapped)
+            newline = mapped.find(b'\n')
+            LineModel.validate_raw(view[:newline])
+            with raises(exceptions.ValidationError):
+                LineModel.validate_raw(view[newline + 1:])
+
+            view.release()
+            mapped.close()
+
+    def test_malformed_json(self):
+        class AnyModel(BaseModel):
+            pass
+
+        for data in (b'{"a": 1', b'{"a" 1}', b'{"a": 1,}', b'{"a": 1} trailing', b'{"a": [1, 2}'):
+            with raises(ValueError):
+                AnyModel.validate_raw(data)
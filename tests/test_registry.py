@@ -0,0 +1,90 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import marshal
+
+from nosql_rest_preprocessor import exceptions
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.registry import ModelRegistry
+from nosql_rest_preprocessor.resolvers import ResolveWith
+from nosql_rest_preprocessor.utils import either_of, one_of
+from pytest import raises
+
+
+def make_models(backend='generated'):
+    class AddressModel(BaseModel):
+        required_attributes = {'street', one_of('city', 'zip')}
+        validation_backend = backend
+
+    class PersonModel(BaseModel):
+        required_attributes = {'name', either_of('email', 'phone')}
+        sub_models = {'address': AddressModel}
+        resolved_attributes = {'company': ResolveWith(lambda key: None, model=AddressModel)}
+        validation_backend = backend
+
+    return [AddressModel, PersonModel]
+
+
+# noinspection PyMethodMayBeStatic
+class TestModelRegistry(object):
+
+    def test_finds_all_models(self):
+        models = make_models()
+
+        assert set(models).issubset(ModelRegistry().models)
+
+    def test_configuration_problems(self):
+        class NoResolvingModel(BaseModel):
+            resolved_attributes = {'company': ResolveWith(lambda key: None)}
+
+        class NoSubModel(BaseModel):
+            sub_models = {'address': dict}
+            resolved_attributes = {'owner': 'find_owner'}
+
+        registry = ModelRegistry([NoResolvingModel, NoSubModel] + make_models())
+
+        problems = registry.problems()
+        assert len(problems) == 3
+        assert 'NoResolvingModel.company: resolved attribute has neither a model nor a sub_models entry' in problems[0]
+
+        with raises(exceptions.ConfigurationError):
+            registry.setup()
+
+        assert ModelRegistry(make_models()).problems() == []
+
+    def test_lazy_and_eager(self):
+        models = make_models()
+        ModelRegistry(models, compile='lazy').setup()
+        assert all('_compiled_plan' not in model.__dict__ for model in models)
+
+        registry = ModelRegistry(models, compile='eager').setup()
+        assert all(model._compiled_plan.validator is not None for model in models)
+        assert set(registry.timings) == {'check', 'plans', 'validators'}
+
+        with raises(exceptions.ConfigurationError):
+            ModelRegistry(models, compile='sometimes')
+
+    def test_serialized_validators(self):
+        schemas = ModelRegistry(make_models()).dumps()
+
+        models = make_models()  # e.g. a worker process with the same model definitions
+        registry = ModelRegistry(models, compile='eager')
+        assert registry.loads(schemas) == 2
+
+        address_model, person_model = models
+        assert address_model._compiled_plan.validator is not None
+        person_model.validate({'name': 'Sepp', 'email': 'sepp@example.com', 'address': {'street': 'x', 'zip': 1}})
+        with raises(exceptions.ValidationError):
+            person_model.validate({'name': 'Sepp', 'address': {'street': 'x', 'zip': 1}})
+
+    def test_changed_models_are_compiled_again(self):
+        schemas = ModelRegistry(make_models()).dumps()
+
+        address_model, person_model = models = make_models()
+        address_model.required_attributes = {'street'}
+        assert ModelRegistry(models).loads(schemas) == 1  # only the person model is unchanged
+
+        address_model.validate({'street': 'x'})
+
+    def test_other_python_version(self):
+        schemas = marshal.dumps({'python': 'another-python', 'validators': {}})
+        assert ModelRegistry(make_models()).loads(schemas) == 0
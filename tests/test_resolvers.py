@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals, division, print_function
 
-from nosql_rest_preprocessor.resolvers import resolve, ResolveWith
+from nosql_rest_preprocessor.resolvers import resolve, resolve_many, resolve_stream, IdentityMap, ResolveBudget, \
+    ResolveWith
 from nosql_rest_preprocessor.models import BaseModel
 from nosql_rest_preprocessor import exceptions
 from pytest import raises
@@ -163,9 +164,414 @@ class TestResolve(object):
         assert merged_obj['company'] == person_obj['company']
         assert merged_obj['address'] == person_obj['address']
 
+    def test_missing_resolving_model(self):
+        class BrokenModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(find_address_by_key)
+            }
+
+        assert resolve(BrokenModel, {'address': 'unknown'}) == {'address': 'unknown'}
+        with raises(exceptions.ConfigurationError):
+            resolve(BrokenModel, person_obj)
+
     def test_lookup_class(self):
         resolved_obj = resolve(PersonModel3, person_obj)  # use a lookup_class
         assert resolved_obj['address'] == address_obj1
 
         resolved_obj = resolve(PersonModel4, person_obj)  # use an object of a class
         assert resolved_obj['address'] == address_obj1
+
+
+class CountingStore(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def find(self, key):
+        self.calls.append(key)
+        return find_address_by_key(key)
+
+    def find_many(self, keys):
+        self.calls.append(sorted(keys))
+        return dict((key, find_address_by_key(key)) for key in keys if find_address_by_key(key))
+
+
+# noinspection PyMethodMayBeStatic
+class TestResolveMany(object):
+
+    @staticmethod
+    def models(store, batched=True):
+        batch_lookup_func = store.find_many if batched else None
+
+        class BatchedCompanyModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(store.find, model=AddressModel, batch_lookup_func=batch_lookup_func)
+            }
+
+        class BatchedPersonModel(BaseModel):
+            resolved_attributes = {
+                'address': ResolveWith(store.find, model=AddressModel, batch_lookup_func=batch_lookup_func),
+                'company': ResolveWith(store.find, model=BatchedCompanyModel, batch_lookup_func=batch_lookup_func)
+            }
+
+        return BatchedPersonModel
+
+    people = [
+        dict(person_obj, name='Person %d' % i, address=['foreign_key_123', 'foreign_key_456', 'unknown'][i % 3])
+        for i in range(30)
+    ]
+
+    def test_same_result_as_resolve(self):
+        model = self.models(CountingStore())
+
+        for depth in range(4):
+            expected = [resolve(PersonModel1, person, depth=depth) for person in self.people]
+            assert resolve_many(model, self.people, depth=depth) == expected
+
+    def test_one_batch_per_attribute_and_level(self):
+        store = CountingStore()
+        resolve_many(self.models(store), self.people, depth=2)
+
+        assert sorted(store.calls) == [
+            ['foreign_key_123', 'foreign_key_456', 'unknown'],  # address, company.address is known by then
+            ['foreign_key_890']                                # company
+        ]
+
+    def test_falls_back_to_deduplicated_single_lookups(self):
+        store = CountingStore()
+        resolve_many(self.models(store, batched=False), self.people, depth=2)
+
+        assert sorted(store.calls) == ['foreign_key_123', 'foreign_key_456', 'foreign_key_890', 'unknown']
+
+    def test_resolved_objects_are_not_shared(self):
+        resolved = resolve_many(self.models(CountingStore()), self.people, depth=1)
+
+        resolved[0]['company']['name'] = 'Something Else'
+        assert resolved[1]['company']['name'] == company_obj['name']
+        assert company_obj['name'] == 'Continental'
+
+    def test_nested_values_are_shared(self):
+        docs = {'company_1': {'name': 'Continental', 'tags': ['tires']}}
+
+        class TaggedPersonModel(BaseModel):
+            resolved_attributes = {'company': ResolveWith(docs.get, model=BaseModel)}
+
+        resolved = resolve_many(TaggedPersonModel, [{'company': 'company_1'}] * 2)
+
+        assert resolved[0]['company'] is not resolved[1]['company']  # only the top level is copied
+        assert resolved[0]['company']['tags'] is resolved[1]['company']['tags'] is docs['company_1']['tags']
+
+    def test_failing_fast(self):
+        with raises(exceptions.ResolvedObjectNotFound):
+            resolve_many(self.models(CountingStore()), self.people, fail_fast=True)
+
+    def test_inputs_are_not_mutated(self):
+        people = [dict(person) for person in self.people]
+        resolve_many(self.models(CountingStore()), people, depth=2)
+
+        assert people == self.people
+
+
+# noinspection PyMethodMayBeStatic
+class TestResolveStream(object):
+
+    def test_same_result_as_resolve(self):
+        people = TestResolveMany.people
+
+        resolved_objs = resolve_stream(PersonModel1, iter(people), depth=2, chunk_size=7)
+        assert list(resolved_objs) == [resolve(PersonModel1, person, depth=2) for person in people]
+
+    def test_one_batch_per_chunk(self):
+        store = CountingStore()
+        resolved_objs = resolve_stream(TestResolveMany.models(store), iter(TestResolveMany.people), chunk_size=10)
+
+        next(resolved_objs)
+        assert len(store.calls) == 2  # address and company of the first chunk only
+
+        list(resolved_objs)
+        assert len(store.calls) == 6
+
+    def test_collect_errors(self):
+        people = TestResolveMany.people
+
+        with raises(exceptions.ResolvedObjectNotFound):
+            list(resolve_stream(PersonModel1, people, fail_fast=True, chunk_size=7))
+
+        errors = []
+        resolved_objs = list(resolve_stream(PersonModel1, people, fail_fast=True, chunk_size=7, errors=errors))
+        assert len(resolved_objs) == 20
+        assert [index for index, obj, e in errors] == list(range(2, 30, 3))
+        assert all(obj is people[index] for index, obj, e in errors)
+
+
+# noinspection PyMethodMayBeStatic
+class TestListValuedResolving(object):
+
+    @staticmethod
+    def model(store):
+        class PersonWithAddressesModel(BaseModel):
+            resolved_attributes = {
+                'addresses': ResolveWith(store.find, model=AddressModel, batch_lookup_func=store.find_many)
+            }
+
+        return PersonWithAddressesModel
+
+    def test_ids_are_resolved_in_order(self):
+        store = CountingStore()
+        person = {'addresses': ['foreign_key_456', 'foreign_key_123', 'foreign_key_456']}
+
+        resolved_obj = resolve(self.model(store), person)
+        assert resolved_obj['addresses'] == [address_obj2, address_obj1, address_obj2]
+        assert resolved_obj['addresses'][0] is not resolved_obj['addresses'][2]
+        assert store.calls == [['foreign_key_123', 'foreign_key_456']]  # one bulk lookup for the whole list
+
+    def test_one_lookup_for_all_lists(self):
+        store = CountingStore()
+        people = [{'addresses': ['foreign_key_123']}, {'addresses': ['foreign_key_456', 'foreign_key_123']}]
+
+        resolved_objs = resolve_many(self.model(store), people)
+        assert [len(obj['addresses']) for obj in resolved_objs] == [1, 2]
+        assert len(store.calls) == 1
+
+    def test_missing_elements(self):
+        person = {'addresses': ['foreign_key_123', 'unknown']}
+
+        resolved_obj = resolve(self.model(CountingStore()), person)
+        assert resolved_obj['addresses'] == [address_obj1, 'unknown']
+
+        with raises(exceptions.ResolvedObjectNotFound):
+            resolve(self.model(CountingStore()), person, fail_fast=True)
+
+    def test_resolved_lists_are_not_saved_on_update(self):
+        model = self.model(CountingStore())
+        person = {'addresses': ['foreign_key_123']}
+
+        merged_obj = model.merge_updated(person, resolve(model, person))
+        assert merged_obj == person
+
+
+# noinspection PyMethodMayBeStatic
+class TestResolveFields(object):
+
+    def test_unrequested_attributes_are_not_looked_up(self):
+        store = CountingStore()
+        model = TestResolveMany.models(store)
+
+        resolved_obj = resolve(model, person_obj, depth=2, fields=['name', 'company.name'])
+        assert resolved_obj == {'name': 'Sepp Huber', 'company': {'name': 'Continental'}}
+        assert store.calls == [['foreign_key_890']]  # neither address nor company.address
+
+    def test_nested_fields(self):
+        store = CountingStore()
+        model = TestResolveMany.models(store)
+
+        resolved_objs = resolve_many(model, [person_obj] * 2, depth=2, fields=['company.address.city', 'address'])
+        assert resolved_objs[1] == {'address': address_obj1, 'company': {'address': {'city': 'London'}}}
+        assert len(store.calls) == 3
+
+    def test_whole_resolved_objects(self):
+        resolved_obj = resolve(PersonModel1, person_obj, depth=2, fields=['company'])
+        assert resolved_obj == {'company': {'name': 'Continental', 'address': address_obj2}}
+
+    def test_unresolved_ids(self):
+        resolved_obj = resolve(PersonModel1, dict(person_obj, company='unknown'), fields=['company.name'])
+        assert resolved_obj == {'company': 'unknown'}
+
+    def test_stream(self):
+        resolved_objs = resolve_stream(PersonModel1, [person_obj] * 3, fields=['email'])
+        assert list(resolved_objs) == [{'email': person_obj['email']}] * 3
+
+
+# noinspection PyMethodMayBeStatic
+class TestIdentityMap(object):
+
+    def test_one_lookup_per_key_across_calls(self):
+        store = CountingStore()
+        model = TestResolveMany.models(store, batched=False)
+        identity_map = IdentityMap()
+
+        first = resolve(model, person_obj, depth=2, identity_map=identity_map)
+        second = resolve(model, person_obj, depth=2, identity_map=identity_map)
+        assert first == second == resolve(PersonModel1, person_obj, depth=2)
+        assert sorted(store.calls) == ['foreign_key_123', 'foreign_key_456', 'foreign_key_890']
+
+        first['company']['name'] = 'Something Else'
+        assert second['company']['name'] == 'Continental'
+
+    def test_resolvers_share_lookups_by_namespace(self):
+        store = CountingStore()
+
+        class NamespacedModel(BaseModel):
+            resolved_attributes = {
+                'home': ResolveWith(store.find, model=AddressModel),
+                'work': ResolveWith(lambda key: store.find(key), model=AddressModel, cache_namespace=store.find)
+            }
+
+        resolved_obj = resolve(NamespacedModel, {'home': 'foreign_key_123', 'work': 'foreign_key_123'})
+        assert resolved_obj == {'home': address_obj1, 'work': address_obj1}
+        assert store.calls == ['foreign_key_123']
+
+    def test_lookup_classes_do_not_share_lookups(self):
+        class Collection(object):
+            docs = {'users': {1: {'name': 'user1'}}, 'companies': {1: {'name': 'company1'}}}
+
+            def __init__(self, name):
+                self.name = name
+
+            def find(self, key):
+                return self.docs[self.name].get(key)
+
+        class Doc(BaseModel):
+            resolved_attributes = {
+                'owner': ResolveWith(Collection.find, lookup_class=Collection, model=BaseModel,
+                                     lookup_class_kwargs={'name': 'users'}),
+                'company': ResolveWith(Collection.find, lookup_class=Collection, model=BaseModel,
+                                       lookup_class_kwargs={'name': 'companies'})
+            }
+
+        identity_map = IdentityMap()
+        resolved_obj = resolve(Doc, {'owner': 1, 'company': 1}, identity_map=identity_map)
+        assert resolved_obj == {'owner': {'name': 'user1'}, 'company': {'name': 'company1'}}
+        assert len(identity_map) == 2
+
+    def test_cycles_are_left_unresolved(self):
+        docs = {
+            'p1': {'name': 'Sepp', 'friend': 'p2'},
+            'p2': {'name': 'Hans', 'friend': 'p1'}
+        }
+
+        class FriendModel(BaseModel):
+            pass
+
+        FriendModel.resolved_attributes = {'friend': ResolveWith(docs.get, model=FriendModel)}
+
+        identity_map = IdentityMap()
+        resolved_obj = resolve(FriendModel, {'name': 'Sepp', 'friend': 'p2'}, depth=3, identity_map=identity_map)
+        assert resolved_obj['friend']['friend'] == {'name': 'Sepp', 'friend': 'p2'}  # p2 would be its own grandchild
+        assert identity_map.cycles == [(docs.get, 'p2')]
+
+    def test_failed_lookups_are_retried(self):
+        failures = [IOError('connection reset')]
+
+        def find(key):
+            if failures:
+                raise failures.pop()
+            return find_address_by_key(key)
+
+        class FlakyModel(BaseModel):
+            resolved_attributes = {'address': ResolveWith(find, model=AddressModel)}
+
+        identity_map = IdentityMap()
+        with raises(IOError):
+            resolve(FlakyModel, {'address': 'foreign_key_123'}, identity_map=identity_map)
+
+        assert len(identity_map) == 0
+        resolved_obj = resolve(FlakyModel, {'address': 'foreign_key_123'}, fail_fast=True, identity_map=identity_map)
+        assert resolved_obj == {'address': address_obj1}
+
+    def test_stream_retries_failed_chunks_one_by_one(self):
+        failures = [IOError('connection reset')]
+
+        def find(key):
+            if failures:
+                raise failures.pop()
+            return find_address_by_key(key)
+
+        class FlakyModel(BaseModel):
+            resolved_attributes = {'address': ResolveWith(find, model=AddressModel)}
+
+        objs = [{'address': 'foreign_key_123'}, {'address': 'foreign_key_456'}]
+        errors = []
+        resolved_objs = list(resolve_stream(FlakyModel, objs, errors=errors, identity_map=IdentityMap()))
+        assert resolved_objs == [{'address': address_obj1}, {'address': address_obj2}]
+        assert errors == []
+
+
+# noinspection PyMethodMayBeStatic
+class TestResolveLimits(object):
+
+    chain = dict(('link_%d' % i, {'name': 'Link %d' % i, 'next': 'link_%d' % (i + 1)}) for i in range(10))
+
+    @classmethod
+    def chain_model(cls, **resolve_with_kwargs):
+        class LinkModel(BaseModel):
+            pass
+
+        LinkModel.resolved_attributes = {'next': ResolveWith(cls.chain.get, model=LinkModel, **resolve_with_kwargs)}
+        return LinkModel
+
+    @staticmethod
+    def depth_of(obj):
+        depth = 0
+        while isinstance(obj['next'], dict):
+            obj, depth = obj['next'], depth + 1
+        return depth
+
+    def test_configurable_max_depth(self):
+        model = self.chain_model()
+
+        assert self.depth_of(resolve(model, self.chain['link_0'], depth=10)) == 3
+        assert self.depth_of(resolve(model, self.chain['link_0'], depth=6, max_depth=8)) == 6
+
+    def test_per_attribute_max_depth(self):
+        store = CountingStore()
+
+        class ShallowCompanyModel(BaseModel):
+            resolved_attributes = {'address': ResolveWith(store.find, model=AddressModel, max_depth=1)}
+
+        class ShallowPersonModel(BaseModel):
+            resolved_attributes = {'company': ResolveWith(store.find, model=ShallowCompanyModel)}
+
+        resolved_obj = resolve(ShallowPersonModel, person_obj, depth=3)
+        assert resolved_obj['company']['address'] == 'foreign_key_456'
+        assert store.calls == ['foreign_key_890']
+
+    def test_fail_fast_on_every_level(self):
+        with raises(exceptions.ResolvedObjectNotFound):
+            resolve(self.chain_model(), self.chain['link_7'], depth=3, fail_fast=True)  # link_10 doesn't exist
+
+    def test_lookup_budget(self):
+        links = [self.chain['link_%d' % i] for i in range(4)]
+        budget = ResolveBudget(max_lookups=2)
+
+        resolved_objs = resolve_many(self.chain_model(), links, budget=budget)
+        assert [obj['next'] for obj in resolved_objs] == [self.chain['link_1'], self.chain['link_2'], 'link_3', 'link_4']
+
+        assert budget.lookups == 2
+        assert [(attr, key, reason) for model, attr, key, reason in budget.unresolved] == [
+            ('next', 'link_3', 'max_lookups'), ('next', 'link_4', 'max_lookups')
+        ]
+
+    def test_per_attribute_lookup_budget(self):
+        budget = ResolveBudget()
+
+        resolved_obj = resolve(self.chain_model(max_lookups=2), self.chain['link_0'], depth=3, budget=budget)
+        assert self.depth_of(resolved_obj) == 2
+        assert budget.unresolved[0][1:] == ('next', 'link_3', 'max_lookups')
+
+    def test_per_attribute_lookup_budget_without_resolve_budget(self):
+        links = [self.chain['link_%d' % i] for i in range(5)]
+        identity_map = IdentityMap()
+
+        resolved_objs = resolve_many(self.chain_model(max_lookups=2), links, identity_map=identity_map)
+        assert [obj['next'] for obj in resolved_objs][2:] == ['link_3', 'link_4', 'link_5']
+        assert [(attr, key, reason) for model, attr, key, reason in identity_map.unresolved] == [
+            ('next', 'link_3', 'max_lookups'), ('next', 'link_4', 'max_lookups'), ('next', 'link_5', 'max_lookups')
+        ]
+
+    def test_timeout(self):
+        now = [0.0]
+
+        def lookup(key):
+            now[0] += 0.4
+            return self.chain.get(key)
+
+        class SlowLinkModel(BaseModel):
+            pass
+
+        SlowLinkModel.resolved_attributes = {'next': ResolveWith(lookup, model=SlowLinkModel)}
+        budget = ResolveBudget(timeout=0.7, clock=lambda: now[0])
+
+        resolved_obj = resolve(SlowLinkModel, self.chain['link_0'], depth=3, budget=budget)
+        assert self.depth_of(resolved_obj) == 2  # the third level starts after the deadline
+        assert budget.unresolved == [(SlowLinkModel, 'next', 'link_3', 'timeout')]
@@ -0,0 +1,182 @@
+from __future__ import absolute_import, unicode_literals, division, print_function
+
+import sys
+import threading
+
+from nosql_rest_preprocessor import exceptions, instrumentation
+from nosql_rest_preprocessor.cache import MISSING, ResolveCache
+from nosql_rest_preprocessor.models import BaseModel
+from nosql_rest_preprocessor.resolvers import resolve, resolve_many, ResolveWith
+from nosql_rest_preprocessor.utils import either_of
+
+THREADS = 16
+
+ROUNDS = 200
+
+docs = dict(
+    [('address_%d' % i, {'street': 'Street %d' % i, 'city': 'London', 'openWifi': 'secret'}) for i in range(20)] +
+    [('company_%d' % i, {'name': 'Company %d' % i, 'address': 'address_%d' % i}) for i in range(20)]
+)
+
+
+class Dao(object):
+    # counts instances to check that the pool is bounded
+    instances = 0
+    instances_lock = threading.Lock()
+
+    def __init__(self):
+        with Dao.instances_lock:
+            Dao.instances += 1
+        self.in_use = False
+
+    def find(self, key):
+        assert not self.in_use  # an instance is never used by two threads at the same time
+        self.in_use = True
+        try:
+            return docs.get(key)
+        finally:
+            self.in_use = False
+
+    def find_many(self, keys):
+        return dict((key, self.find(key)) for key in keys if key in docs)
+
+
+def make_models(backend):
+    cache = ResolveCache(max_size=10)  # smaller than the number of keys, evicts all the time
+
+    class AddressModel(BaseModel):
+        required_attributes = {'street', 'city'}
+        optional_attributes = {'openWifi'}
+        private_attributes = {'openWifi'}
+        validation_backend = backend
+
+    class CompanyModel(BaseModel):
+        resolved_attributes = {
+            'address': ResolveWith(Dao.find, model=AddressModel, lookup_class=Dao, lookup_scope='thread', cache=cache)
+        }
+
+    class PersonModel(BaseModel):
+        required_attributes = {'name', either_of('email', 'phone')}
+        private_attributes = {'password'}
+        sub_models = {'home': AddressModel}
+        resolved_attributes = {
+            'company': ResolveWith(Dao.find, model=CompanyModel, lookup_class=Dao, lookup_scope='pool', pool_size=3,
+                                   batch_lookup_func=Dao.find_many, cache=cache)
+        }
+        validation_backend = backend
+
+    return PersonModel
+
+
+def person(i):
+    return {
+        'name': 'Person %d' % i,
+        'email': 'person%d@example.com' % i,
+        'password': 'secret',
+        'home': {'street': 'Street %d' % i, 'city': 'London', 'openWifi': 'secret'},
+        'company': 'company_%d' % (i % 25)  # some companies don't exist
+    }
+
+
+def work(model, i):
+    # every API at once, returns something comparable
+    obj = person(i)
+    invalid = dict(obj, phone='123')
+
+    try:
+        model.validate(invalid)
+        invalid_outcome = None
+    except exceptions.ValidationError as e:
+        invalid_outcome = e.errors
+
+    return (
+        model.validate(obj) is obj,
+        invalid_outcome,
+        model.prepare_response(obj),
+        resolve(model, obj, depth=2),
+        resolve_many(model, [obj, person(i + 1)], depth=2)
+    )
+
+
+def hammer(func, count):
+    results = [None] * count
+    failures = []
+    start = threading.Event()
+
+    def run(thread_index):
+        start.wait()
+        try:
+            for i in range(thread_index, count, THREADS):
+                results[i] = func(i)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+
+    switch_interval = sys.getswitchinterval() if hasattr(sys, 'getswitchinterval') else None  # Python 3 only
+    if switch_interval is not None:
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible
+    try:
+        start.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+
+    assert failures == []
+    return results
+
+
+# noinspection PyMethodMayBeStatic
+class TestThreadSafety(object):
+
+    def test_deterministic_results(self):
+        for backend in ('interpreted', 'generated'):
+            expected = [work(make_models(backend), i) for i in range(ROUNDS)]
+
+            Dao.instances = 0
+            model = make_models(backend)  # plans, validators, caches and lookup instances are created concurrently
+            assert hammer(lambda i: work(model, i), ROUNDS) == expected
+
+            assert Dao.instances <= THREADS + 3  # one per thread for the address, a pool of 3 for the company
+
+    def test_declarations_change_while_validating(self):
+        model = make_models('interpreted')
+        home_model = model.sub_models['home']
+
+        def validate_or_change(i):
+            if i % 10 == 0:
+                home_model.required_attributes = {'street', 'city'}  # same rules, but every plan is rechecked
+            return work(model, i)
+
+        expected = [work(model, i) for i in range(ROUNDS)]
+        assert hammer(validate_or_change, ROUNDS) == expected
+
+    def test_shared_cache(self):
+        cache = ResolveCache(max_size=2)  # 3 keys, evicts and reorders all the time
+
+        def put_and_get(i):
+            for _ in range(50):
+                key = i % 3
+                cache.put(key, {'key': key})
+                assert cache.get(key) in (MISSING, {'key': key})
+                cache.get((key + 1) % 3)
+
+        hammer(put_and_get, ROUNDS * 10)
+        assert cache.hits + cache.misses == ROUNDS * 10 * 50 * 2  # no lost updates
+
+    def test_stats_collector(self):
+        stats = instrumentation.StatsCollector()
+        model = make_models('interpreted')
+
+        instrumentation.enable(stats)
+        try:
+            hammer(lambda i: model.validate(person(i)), ROUNDS)
+        finally:
+            instrumentation.disable()
+
+        validated = [entry for entry in stats.dump()['operations'] if entry['operation'] == 'validate']
+        assert sum(entry['calls'] for entry in validated) == ROUNDS * 2  # person and home
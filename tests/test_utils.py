@@ -60,4 +60,60 @@ class TestTuples(object):
         assert one_of('backgroundImg', 'backgroundUrl') == ('one_of', ('backgroundImg', 'backgroundUrl'))
 
     def test_either_of(self):
-        assert either_of('sweets', 'bacon') == ('either_of', ('sweets', 'bacon'))
\ No newline at end of file
+        assert either_of('sweets', 'bacon') == ('either_of', ('sweets', 'bacon'))
+
+# noinspection PyMethodMayBeStatic
+class TestChunked(object):
+
+    def test_chunks(self):
+        assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(chunked([], 2)) == []
+
+    def test_is_lazy(self):
+        def numbers():
+            yield 1
+            yield 2
+            raise AssertionError('read too far')
+
+        assert next(chunked(numbers(), 2)) == [1, 2]
+
+
+# noinspection PyMethodMayBeStatic
+class TestMapStream(object):
+
+    @staticmethod
+    def invert(number):
+        return 1 / number
+
+    def test_map(self):
+        assert list(map_stream(self.invert, [1, 2])) == [1, 0.5]
+
+    def test_collect_errors(self):
+        errors = []
+        assert list(map_stream(self.invert, [1, 0, 2], errors)) == [1, 0.5]
+
+        index, item, e = errors[0]
+        assert (index, item) == (1, 0)
+        assert isinstance(e, ZeroDivisionError)
+
+
+# noinspection PyMethodMayBeStatic
+class TestWithoutFailures(object):
+
+    def test_no_failures(self):
+        objs = ['a', 'b']
+        assert without_failures(objs, []) is objs
+
+    def test_collect_errors(self):
+        first, second = ValueError('b'), ValueError('d')
+
+        errors = []
+        assert without_failures(['a', 'b', 'c', 'd'], [(1, first), (3, second)], errors) == ['a', 'c']
+        assert errors == [(1, 'b', first), (3, 'd', second)]
+
+        try:
+            without_failures(['a', 'b', 'c', 'd'], [(1, first), (3, second)])
+        except ValueError as e:
+            assert e is first
+        else:
+            assert False